@@ -0,0 +1,68 @@
+"""
+Import-time benchmark for the project modules.
+
+Each module is imported in a fresh interpreter (so nothing is cached in 'sys.modules')
+and the wall-clock time of the import is measured. The script also checks that
+importing 'data_visualization' does not pull in 'matplotlib.pyplot' or Tk: the plotting
+backend is only loaded when a chart is rendered (see 'data_visualization.load_pyplot').
+
+Run from the './code' folder:
+    python benchmark_import.py
+    python benchmark_import.py --repeat 10 --limit 1.0
+"""
+
+import os
+import sys
+import argparse
+import subprocess
+
+### Module imported in the child interpreter; prints import time and heavyweight modules loaded
+strChildCode = """
+import sys, time
+t0 = time.perf_counter()
+import {module}
+t1 = time.perf_counter()
+lstHeavy = [m for m in ('matplotlib.pyplot', 'tkinter', 'turtle') if m in sys.modules]
+print(f"{{t1 - t0:.6f}}|{{','.join(lstHeavy)}}")
+"""
+
+def time_module_import(strModule, intRepeat=5):
+    """
+    Import 'strModule' in 'intRepeat' fresh interpreters.
+    Returns a dictionary {'times': list of seconds, 'heavy': list of heavyweight modules loaded}
+    """
+    strFolder = os.path.dirname(os.path.abspath(__file__))
+    lstTimes = list()
+    setHeavy = set()
+    for _ in range(intRepeat):
+        proc = subprocess.run([sys.executable, '-c', strChildCode.format(module=strModule)],
+                              cwd=strFolder, capture_output=True, text=True)
+        if proc.returncode != 0:
+            raise ImportError(f'import of "{strModule}" failed:\n{proc.stderr}')
+        strTime, strHeavy = proc.stdout.strip().splitlines()[-1].split('|')
+        lstTimes.append(float(strTime))
+        setHeavy.update([m for m in strHeavy.split(',') if len(m) > 0])
+
+    return {'times': lstTimes, 'heavy': sorted(setHeavy)}
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure import time of project modules')
+    parser.add_argument('--repeat', type=int, default=5, help='number of fresh interpreters per module')
+    parser.add_argument('--limit', type=float, default=1.0, help='max allowed median import time (seconds)')
+    parser.add_argument('modules', nargs='*', default=['utils', 'data_preparation', 'data_visualization'])
+    args = parser.parse_args()
+
+    blnPassed = True
+    for strModule in args.modules:
+        dctResult = time_module_import(strModule, args.repeat)
+        fltMedian = float(sorted(dctResult['times'])[len(dctResult['times']) // 2])
+        strHeavy = ', '.join(dctResult['heavy']) if len(dctResult['heavy']) > 0 else 'none'
+        print(f'{strModule:<24} median {fltMedian:.3f}s  min {min(dctResult["times"]):.3f}s  '
+              f'max {max(dctResult["times"]):.3f}s  heavy modules: {strHeavy}')
+        if fltMedian > args.limit or len(dctResult['heavy']) > 0:
+            blnPassed = False
+
+    return 0 if blnPassed else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,135 @@
+"""
+Consistency checks of the data pipeline.
+
+    sweep -- the threshold sweep ('data_sweep') must reproduce the merged data set of the current
+             config: the clean files are prepared and merged, then the sweep variant equal to the
+             config is compared genre by genre ('data_sweep.compare_sweep_with_pipeline')
+    merge-modes -- the merged file must be byte-identical whether the merge runs in memory, out of core
+                   ('dataprep.merge_clean_data_out_of_core') or as planned for a small memory budget
+                   ('dataprep.plan_execution'); the SHA-256 of the file of each mode is compared
+    prep-modes -- the clean IMDB titles file and its quality report must be the same whether the raw file
+                  is parsed at once or in chunks ('dataprep.prep_imdb_title_basics')
+
+The checks write the clean and merged files of the config to its data folder.
+
+Run from the repository folder (the data folders of config.json are relative to it):
+    python code/check_pipeline.py
+    python code/check_pipeline.py --config ./config/config.json sweep
+"""
+
+import os
+import sys
+import hashlib
+import argparse
+import utils
+import data_preparation as dataprep
+import data_sweep
+
+def check_sweep(config):
+    """
+    Prepare and merge the clean files of 'config', then compare the sweep with the merged data set.
+    Returns True if every genre statistic agrees.
+    """
+    dataprep.prepare_clean_data(config, writeReport=False)
+    dataprep.merge_clean_data(config)
+    df = data_sweep.compare_sweep_with_pipeline(config)
+    if df.shape[0] > 0:
+        print(f'sweep: {df.shape[0]} genres differ from the merged data set')
+        print(df.to_string())
+        return False
+    print('sweep: the variant of the current config reproduces the merged data set')
+    return True
+
+def file_sha256(strFilePath):
+    """
+    SHA-256 hex digest of the file 'strFilePath'
+    """
+    hashFile = hashlib.sha256()
+    with open(strFilePath, mode='rb') as fileData:
+        for bytesBlock in iter(lambda: fileData.read(1 << 20), b''):
+            hashFile.update(bytesBlock)
+    return hashFile.hexdigest()
+
+def merged_file_hashes(config, dctModes):
+    """
+    Run 'merge_clean_data' once per mode of 'dctModes' {mode name: (config, keyword arguments)} and
+    return {mode name: SHA-256 of the merged file}. The optional outputs (NumPy store, cube, sketches) are not written.
+    """
+    strMergedPath = os.path.join(config['folders']['data-csv'], config['files-merge']['clean-csv'])
+    dctHashes = dict()
+    for (strMode, (configMode, dctArgs)) in dctModes.items():
+        dataprep.merge_clean_data(configMode, writeNpyStore=False, writeCube=False, writeSketches=False, **dctArgs)
+        dctHashes[strMode] = file_sha256(strMergedPath)
+    return dctHashes
+
+def small_budget_config(config):
+    """
+    Copy of 'config' with a memory budget of 1 MB, so that every stage is planned in chunks or out of core
+    """
+    configSmall = dict(config)
+    configSmall['memory-budget'] = dict(config['memory-budget'], **{'budget-mb': 1, 'min-chunk-rows': 1000})
+    return configSmall
+
+def check_merge_modes(config):
+    """
+    Prepare the clean files of 'config' and merge them in every mode.
+    Returns True if the merged files are byte-identical.
+    """
+    dataprep.prepare_clean_data(config, writeReport=False)
+    ### few buckets and small chunks: every bucket and run boundary of the out-of-core merge is exercised
+    configSmall = dict(config)
+    configSmall['files-merge'] = dict(config['files-merge'], **{'out-of-core-buckets': 3, 'out-of-core-chunk-rows': 5000})
+    dctModes = {'in-memory': (config, {'outOfCore': False}),
+                'out-of-core': (config, {'outOfCore': True}),
+                'out-of-core-small': (configSmall, {'outOfCore': True}),
+                'auto-small-budget': (small_budget_config(config), {'outOfCore': 'auto'})}
+    dctHashes = merged_file_hashes(config, dctModes)
+    for (strMode, strHash) in dctHashes.items():
+        print(f'merge-modes: {strMode:<20} {strHash}')
+    if len(set(dctHashes.values())) > 1:
+        print('merge-modes: the merged files differ')
+        return False
+    print('merge-modes: the merged files are byte-identical')
+    return True
+
+def check_prep_modes(config):
+    """
+    Prepare the clean IMDB titles file of 'config' at once, in chunks of 5000 rows and as planned for a small
+    memory budget. Returns True if the clean files are byte-identical and the quality reports are equal.
+    """
+    strCleanPath = os.path.join(config['folders']['data-csv'], config['files-imdb']['csv']['clean-title-base'])
+    dctModes = {'at-once': (config, 0), 'chunks-5000': (config, 5000), 'small-budget': (small_budget_config(config), None)}
+    dctHashes = dict()
+    lstReports = list()
+    for (strMode, (configMode, chunkSize)) in dctModes.items():
+        dctReport = dict()
+        dataprep.prep_imdb_title_basics(configMode, dctReport=dctReport, chunkSize=chunkSize)
+        dctHashes[strMode] = file_sha256(strCleanPath)
+        lstReports.append(dctReport)
+        print(f'prep-modes: {strMode:<20} {dctHashes[strMode]}')
+    if len(set(dctHashes.values())) > 1 or any(dctReport != lstReports[0] for dctReport in lstReports):
+        print('prep-modes: the clean files or the quality reports differ')
+        return False
+    print('prep-modes: the clean files are byte-identical and the quality reports are equal')
+    return True
+
+### Checks by name
+dctChecks = {'sweep': check_sweep, 'merge-modes': check_merge_modes, 'prep-modes': check_prep_modes}
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the consistency of the data pipeline')
+    parser.add_argument('--config', default='./config/config.json', help='location of config.json')
+    parser.add_argument('checks', nargs='*', default=list(dctChecks), help=f'checks to run: {list(dctChecks)}')
+    args = parser.parse_args()
+
+    config = utils.load_json_config_from_file(args.config)
+    blnPassed = True
+    for strCheck in args.checks:
+        if strCheck not in dctChecks:
+            raise KeyError(f'Unknown check "{strCheck}"; valid checks: {list(dctChecks)}')
+        blnPassed = dctChecks[strCheck](config) and blnPassed
+
+    return 0 if blnPassed else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,370 @@
+"""
+This module contains statistical analysis code which works on the merged dataset produced by
+function "merge_clean_data(config)" (see data_preparation.py) or on frames derived from it.
+
+## Bootstrap confidence intervals
+'bootstrap_group_means' resamples the titles of all groups (genres, rating intervals) at once:
+values are sorted by group, and one matrix of random indices of shape (resamples, titles) draws
+every title position from its own group's index range. Group means of all resamples are then
+one 'np.add.reduceat' over the resampled matrix. Resamples are processed in chunks bounded by
+config['bootstrap']['max-chunk-elements'] and chunks are spread over a process pool; every chunk
+has its own seed spawned from config['bootstrap']['seed'], so results do not depend on the
+number of workers.
+
+## Grouped regression
+'fit_grouped_ols' fits one OLS model (with intercept) per group (e.g. genre) for all groups at once.
+The sufficient statistics of every group -- X'X (count, sums of x, sums of products of x), X'y and y'y --
+are group sums over the rows ('np.bincount' with weights, see 'grouped_regression_sums'), so the cost is one
+pass over the rows; sums of several chunks of rows simply add up. The normal equations of all groups are
+then solved as one stack of small matrices.
+
+## Genre co-occurrence
+A title's 'genres' entry (e.g. "Action,Adventure,Sci-Fi") is a row of the sparse title x genre incidence
+matrix A, kept as coordinate arrays (row, genre) since SciPy is not a dependency. The co-occurrence matrix
+of a title weight w (1, worldwide gross, numvotes) is A' diag(w) A: entry (i,j) sums w over the titles with
+both genres i and j, the diagonal over the titles of genre i. Titles with the same 'genres' entry have the
+same incidence row, so the product is taken over the distinct entries with their summed weights.
+
+## Year trends
+'year_trend_arrays' works on a dense group x year array of sums (one groupby over (genre, year) or a roll-up
+of the aggregate cube). One cumulative sum along the years gives the running totals, and a rolling window of
+any length w is the difference of two columns of it, C[t] - C[t-w]; year-over-year and window-over-window
+growth are ratios of shifted columns. Every window size costs the same single vectorized subtraction.
+"""
+
+import os
+import concurrent.futures
+import pandas as pd
+import numpy as np
+
+### Sorted values and group layout of a bootstrap worker process (set by 'init_bootstrap_worker')
+dctBootstrapWorkerData = dict()
+
+def init_bootstrap_worker(dctArrays):
+    """
+    Process pool initializer: keep the sorted values and the group layout in the worker
+    """
+    dctBootstrapWorkerData.clear()
+    dctBootstrapWorkerData.update(dctArrays)
+    return None
+
+def bootstrap_resample_means(dctArrays, intNumResamples, seedSequence):
+    """
+    Draw 'intNumResamples' bootstrap resamples of every group and return their means
+    as an array of shape (intNumResamples, number of groups).
+
+    'dctArrays' keys:
+        'values' -- values sorted by group
+        'starts' -- start position of each group in 'values'
+        'counts' -- number of values of each group
+        'elem_starts', 'elem_counts' -- 'starts' and 'counts' repeated for every value
+    """
+    rng = np.random.default_rng(seedSequence)
+    arrRandom = rng.random((intNumResamples, dctArrays['values'].shape[0]))
+    arrIndex = dctArrays['elem_starts'] + (arrRandom * dctArrays['elem_counts']).astype(np.int64)
+    del arrRandom
+    arrSums = np.add.reduceat(dctArrays['values'][arrIndex], dctArrays['starts'], axis=1)
+    return arrSums / dctArrays['counts']
+
+def bootstrap_resample_means_in_worker(tplTask):
+    """
+    Worker task: tplTask is (number of resamples, seed sequence)
+    """
+    return bootstrap_resample_means(dctBootstrapWorkerData, tplTask[0], tplTask[1])
+
+def bootstrap_group_means(arrValues, arrGroupCodes, config, numResamples=None, numWorkers=None):
+    """
+    Bootstrap percentile confidence intervals of the mean of every group.
+
+    Arguments:
+        'arrValues': values (e.g. title worldwide gross), no NaNs
+        'arrGroupCodes': integer group code of every value (e.g. from pd.factorize); codes < 0 are ignored
+        'config': uses config['bootstrap'] keys 'resamples', 'confidence-level', 'seed', 'max-chunk-elements'
+        'numResamples': overrides config['bootstrap']['resamples']
+        'numWorkers': number of worker processes (default: os.cpu_count()); 1 runs in-process
+    Returns a DataFrame indexed by group code with columns 'count', 'mean', 'ci_low', 'ci_high'.
+    """
+    dctConfig = config['bootstrap']
+    if numResamples is None:
+        numResamples = dctConfig['resamples']
+    arrValues = np.asarray(arrValues, dtype=np.float64)
+    arrGroupCodes = np.asarray(arrGroupCodes)
+    mskValid = (arrGroupCodes >= 0)
+    arrValues, arrGroupCodes = arrValues[mskValid], arrGroupCodes[mskValid]
+
+    ### Sort values by group; keep groups with at least one value
+    arrOrder = np.argsort(arrGroupCodes, kind='stable')
+    arrValues, arrGroupCodes = arrValues[arrOrder], arrGroupCodes[arrOrder]
+    arrCodes, arrStarts, arrCounts = np.unique(arrGroupCodes, return_index=True, return_counts=True)
+    dctArrays = {'values': arrValues, 'starts': arrStarts, 'counts': arrCounts,
+                 'elem_starts': np.repeat(arrStarts, arrCounts), 'elem_counts': np.repeat(arrCounts, arrCounts)}
+
+    ### Chunks of resamples bounded by 'max-chunk-elements'; one seed per chunk
+    intChunkResamples = max(1, min(numResamples, dctConfig['max-chunk-elements'] // max(1, arrValues.shape[0])))
+    lstChunkSizes = [min(intChunkResamples, numResamples - i) for i in range(0, numResamples, intChunkResamples)]
+    lstSeeds = np.random.SeedSequence(dctConfig['seed']).spawn(len(lstChunkSizes))
+    lstTasks = list(zip(lstChunkSizes, lstSeeds))
+
+    if numWorkers is None:
+        numWorkers = os.cpu_count() or 1
+    numWorkers = max(1, min(numWorkers, len(lstTasks)))
+    if numWorkers == 1:
+        lstMeans = [bootstrap_resample_means(dctArrays, n, seed) for (n, seed) in lstTasks]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=numWorkers, initializer=init_bootstrap_worker,
+                                                    initargs=(dctArrays,)) as executor:
+            lstMeans = list(executor.map(bootstrap_resample_means_in_worker, lstTasks))
+    arrMeans = np.concatenate(lstMeans, axis=0)
+
+    fltAlpha = (1.0 - dctConfig['confidence-level']) / 2.0
+    arrLow, arrHigh = np.percentile(arrMeans, [100.0*fltAlpha, 100.0*(1.0-fltAlpha)], axis=0)
+    df = pd.DataFrame({'count': arrCounts,
+                       'mean': np.add.reduceat(arrValues, arrStarts) / arrCounts,
+                       'ci_low': arrLow,
+                       'ci_high': arrHigh}, index=pd.Index(arrCodes, name='group'))
+    return df
+
+def bootstrap_genre_mean_ci(df, strValueColName, config, numResamples=None, numWorkers=None):
+    """
+    Bootstrap confidence intervals of the mean of 'strValueColName' for all genres at once.
+    'df' must contain columns 'genres' and 'strValueColName' without NaNs in the value column.
+    Returns a DataFrame with columns 'genres', 'count', 'mean', 'ci_low', 'ci_high'.
+    """
+    arrCodes, idxGenres = pd.factorize(df['genres'])
+    dfCI = bootstrap_group_means(df[strValueColName].to_numpy(), arrCodes, config, numResamples, numWorkers)
+    dfCI.insert(0, 'genres', idxGenres[dfCI.index.to_numpy()])
+    return dfCI.reset_index(drop=True)
+
+def bootstrap_rating_interval_mean_ci(df, lstIntervalSet, strRatingColName, strRevenueColName, config,
+                                      numResamples=None, numWorkers=None):
+    """
+    Bootstrap confidence intervals of the mean of 'strRevenueColName' for every rating interval (a,b]
+    of 'lstIntervalSet' at once. Intervals are expected not to overlap.
+    Returns a DataFrame with one row per interval: 'interval', 'count', 'mean', 'ci_low', 'ci_high'
+    (NaN for intervals without titles).
+    """
+    arrRating = df[strRatingColName].to_numpy(dtype=np.float64)
+    arrCodes = np.full(arrRating.shape[0], -1, dtype=np.int64)
+    for (intCode, lstInterval) in enumerate(lstIntervalSet):
+        arrCodes[(arrRating > lstInterval[0]) & (arrRating <= lstInterval[1])] = intCode
+    dfCI = bootstrap_group_means(df[strRevenueColName].to_numpy(), arrCodes, config, numResamples, numWorkers)
+    dfCI = dfCI.reindex(range(len(lstIntervalSet)))
+    dfCI.insert(0, 'interval', [tuple(lstInterval) for lstInterval in lstIntervalSet])
+    return dfCI.reset_index(drop=True)
+
+def grouped_regression_sums(arrX, arrY, arrGroupCodes, intNumGroups=None):
+    """
+    Sufficient statistics of the OLS fits of 'arrY' on 'arrX' (with intercept) of every group.
+
+    Arguments:
+        'arrX': regressor values, shape (rows,) or (rows, regressors)
+        'arrY': response values
+        'arrGroupCodes': integer group code of every row (e.g. from pd.factorize); codes < 0 are ignored
+        'intNumGroups': number of groups (default: largest code + 1)
+    Rows with NaN in a regressor or the response are skipped.
+    Returns a dictionary of arrays over the groups: 'xtx' (groups, k, k) and 'xty' (groups, k) where k is the
+    number of regressors + 1 (intercept first), 'yty' (groups,). Sums of several parts of the rows add up.
+    """
+    arrX = np.asarray(arrX, dtype=np.float64)
+    if arrX.ndim == 1:
+        arrX = arrX.reshape(-1, 1)
+    arrY = np.asarray(arrY, dtype=np.float64)
+    arrGroupCodes = np.asarray(arrGroupCodes, dtype=np.int64)
+    mskValid = (arrGroupCodes >= 0) & ~np.isnan(arrY) & ~np.isnan(arrX).any(axis=1)
+    arrX, arrY, arrGroupCodes = arrX[mskValid], arrY[mskValid], arrGroupCodes[mskValid]
+    if intNumGroups is None:
+        intNumGroups = int(arrGroupCodes.max()) + 1 if arrGroupCodes.shape[0] > 0 else 0
+
+    arrDesign = np.column_stack([np.ones(arrY.shape[0]), arrX])
+    intK = arrDesign.shape[1]
+    arrXtX = np.zeros((intNumGroups, intK, intK))
+    arrXtY = np.zeros((intNumGroups, intK))
+    for i in range(intK):
+        for j in range(i, intK):
+            arrXtX[:, i, j] = np.bincount(arrGroupCodes, weights=arrDesign[:, i] * arrDesign[:, j], minlength=intNumGroups)
+            arrXtX[:, j, i] = arrXtX[:, i, j]
+        arrXtY[:, i] = np.bincount(arrGroupCodes, weights=arrDesign[:, i] * arrY, minlength=intNumGroups)
+    arrYtY = np.bincount(arrGroupCodes, weights=arrY * arrY, minlength=intNumGroups)
+    return {'xtx': arrXtX, 'xty': arrXtY, 'yty': arrYtY}
+
+def fit_grouped_ols(dctSums, lstXNames=None):
+    """
+    Solve the normal equations of all groups of 'dctSums' (output of 'grouped_regression_sums') at once.
+    'lstXNames' names the regressors (default 'x', or 'x0', 'x1', ...).
+    Returns a DataFrame indexed by group code with columns:
+        'count' -- rows of the group
+        'coef_intercept', 'coef_<x>' -- coefficients
+        'se_intercept', 'se_<x>' -- standard errors (residual variance with count - k degrees of freedom)
+        'r2' -- coefficient of determination, 'residual_std' -- standard deviation of the residuals
+    Groups with no more rows than coefficients or with constant regressors have NaN statistics.
+    """
+    arrXtX, arrXtY, arrYtY = dctSums['xtx'], dctSums['xty'], dctSums['yty']
+    intNumGroups, intK = arrXtY.shape
+    if lstXNames is None:
+        lstXNames = ['x'] if intK == 2 else [f'x{i}' for i in range(intK - 1)]
+    lstNames = ['intercept'] + list(lstXNames)
+    arrCount = arrXtX[:, 0, 0]
+
+    ### groups with a unique solution and at least one residual degree of freedom
+    mskFit = arrCount > intK
+    mskFit[mskFit] = np.linalg.matrix_rank(arrXtX[mskFit]) == intK
+    arrCoef = np.full((intNumGroups, intK), np.nan)
+    arrSE = np.full((intNumGroups, intK), np.nan)
+    arrR2 = np.full(intNumGroups, np.nan)
+    arrResidualStd = np.full(intNumGroups, np.nan)
+    if mskFit.any():
+        arrInverse = np.linalg.inv(arrXtX[mskFit])
+        arrBeta = np.einsum('gij,gj->gi', arrInverse, arrXtY[mskFit])
+        arrN, arrSumY = arrCount[mskFit], arrXtY[mskFit, 0]
+        arrSSE = np.clip(arrYtY[mskFit] - np.einsum('gi,gi->g', arrBeta, arrXtY[mskFit]), 0, None)
+        arrSST = arrYtY[mskFit] - arrSumY * arrSumY / arrN
+        arrVariance = arrSSE / (arrN - intK)
+        arrCoef[mskFit] = arrBeta
+        arrSE[mskFit] = np.sqrt(arrVariance[:, None] * np.clip(np.diagonal(arrInverse, axis1=1, axis2=2), 0, None))
+        arrR2[mskFit] = np.where(arrSST > 0, 1.0 - arrSSE / np.where(arrSST > 0, arrSST, 1.0), np.nan)
+        arrResidualStd[mskFit] = np.sqrt(arrVariance)
+
+    df = pd.DataFrame({'count': arrCount.astype(np.int64)}, index=pd.Index(np.arange(intNumGroups), name='group'))
+    for (i, strName) in enumerate(lstNames):
+        df[f'coef_{strName}'] = arrCoef[:, i]
+    for (i, strName) in enumerate(lstNames):
+        df[f'se_{strName}'] = arrSE[:, i]
+    df['r2'] = arrR2
+    df['residual_std'] = arrResidualStd
+    return df
+
+def fit_group_regression(df, lstXColNames, strYColName, strGroupColName='genres', logY=False):
+    """
+    OLS fits of 'strYColName' on the columns 'lstXColNames' (a name or a list) for every value of
+    'strGroupColName' at once (see 'fit_grouped_ols'); with 'strGroupColName' None one fit of all rows.
+    With 'logY' the response is log(y) (rows with y > 0), e.g. a log-revenue model.
+    Returns a DataFrame with the group column ('all' for one fit), 'count', 'coef_*', 'se_*', 'r2',
+    'residual_std' and 'log_y'; groups without rows are dropped.
+    """
+    if isinstance(lstXColNames, str):
+        lstXColNames = [lstXColNames]
+    arrY = df[strYColName].to_numpy(dtype=np.float64)
+    if logY:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            arrY = np.where(arrY > 0, np.log(arrY), np.nan)
+    if strGroupColName is None:
+        arrCodes, idxGroups = np.zeros(df.shape[0], dtype=np.int64), pd.Index(['all'])
+    else:
+        arrCodes, idxGroups = pd.factorize(df[strGroupColName])
+    dctSums = grouped_regression_sums(df[lstXColNames].to_numpy(dtype=np.float64), arrY, arrCodes, len(idxGroups))
+    dfFit = fit_grouped_ols(dctSums, lstXColNames)
+    dfFit.insert(0, strGroupColName if strGroupColName is not None else 'group', idxGroups[dfFit.index.to_numpy()])
+    dfFit['log_y'] = logY
+    return dfFit.loc[dfFit['count'] > 0].reset_index(drop=True)
+
+def genre_incidence(srGenres, strSeparator=','):
+    """
+    Sparse incidence matrix of the 'genres' entries 'srGenres' (missing entries have no genre).
+    Returns (arrRows, arrGenreCodes, arrGenreNames): entry k of the matrix is row arrRows[k], column arrGenreCodes[k];
+    genre names are sorted. Only the distinct entries are split.
+    """
+    arrEntryCodes, idxEntries = pd.factorize(srGenres)
+    lstEntryGenres = [sorted(set(strEntry.split(strSeparator))) for strEntry in idxEntries]
+    arrGenreNames = np.array(sorted({strGenre for lstGenres in lstEntryGenres for strGenre in lstGenres}), dtype=object)
+    dctGenreCodes = {strGenre: i for (i, strGenre) in enumerate(arrGenreNames)}
+    ### incidence of the distinct entries, then of the rows through their entry code
+    arrEntryCounts = np.array([len(lstGenres) for lstGenres in lstEntryGenres], dtype=np.int64)
+    arrEntryGenreCodes = np.array([dctGenreCodes[strGenre] for lstGenres in lstEntryGenres for strGenre in lstGenres],
+                                  dtype=np.int64)
+    arrEntryStarts = np.concatenate([[0], np.cumsum(arrEntryCounts)])
+    arrRowIndex = np.flatnonzero(arrEntryCodes >= 0)
+    arrRowCounts = arrEntryCounts[arrEntryCodes[arrRowIndex]]
+    arrRows = np.repeat(arrRowIndex, arrRowCounts)
+    arrOffsets = np.arange(arrRows.shape[0]) - np.repeat(np.cumsum(arrRowCounts) - arrRowCounts, arrRowCounts)
+    arrGenreCodes = arrEntryGenreCodes[np.repeat(arrEntryStarts[arrEntryCodes[arrRowIndex]], arrRowCounts) + arrOffsets]
+    return arrRows, arrGenreCodes, arrGenreNames
+
+def genre_cooccurrence_matrices(df, dctWeightColNames=None):
+    """
+    Genre x genre co-occurrence matrices A' diag(w) A of the titles 'df' (column 'genres' and weight columns).
+
+    Arguments:
+        'dctWeightColNames': {matrix name: weight column}; NaN weights count as 0. Default:
+            'worldwide_gross' and 'numvotes' (revenue- and vote-weighted)
+    Returns a dictionary of arrays: 'genre_names', 'titles' (co-occurrence counts, int64),
+    one float64 matrix per weight, and '<name>_titles' (titles with a weight) per weight.
+    """
+    if dctWeightColNames is None:
+        dctWeightColNames = {'worldwide_gross': 'worldwide_gross', 'numvotes': 'numvotes'}
+    ### one incidence row per distinct 'genres' entry, weights summed per entry
+    arrEntryCodes, idxEntries = pd.factorize(df['genres'])
+    mskValid = arrEntryCodes >= 0
+    arrRows, arrGenreCodes, arrGenreNames = genre_incidence(pd.Series(idxEntries, dtype=object))
+    intNumEntries, intNumGenres = len(idxEntries), arrGenreNames.shape[0]
+    dctEntryWeights = {'titles': np.bincount(arrEntryCodes[mskValid], minlength=intNumEntries).astype(np.float64)}
+    for (strName, strCol) in dctWeightColNames.items():
+        arrWeights = df[strCol].to_numpy(dtype=np.float64)[mskValid]
+        dctEntryWeights[strName] = np.bincount(arrEntryCodes[mskValid], weights=np.nan_to_num(arrWeights), minlength=intNumEntries)
+        dctEntryWeights[f'{strName}_titles'] = np.bincount(arrEntryCodes[mskValid], weights=~np.isnan(arrWeights),
+                                                           minlength=intNumEntries)
+
+    ### A' diag(w) A: every pair of genres of an entry, summed over the entries
+    arrCounts = np.bincount(arrRows, minlength=intNumEntries)
+    arrStarts = np.concatenate([[0], np.cumsum(arrCounts)])
+    arrPairEntry = np.repeat(np.arange(intNumEntries), arrCounts * arrCounts)
+    arrPairOffset = np.arange(arrPairEntry.shape[0]) - np.repeat(np.cumsum(arrCounts * arrCounts) - arrCounts * arrCounts,
+                                                                 arrCounts * arrCounts)
+    arrLeft = arrGenreCodes[arrStarts[arrPairEntry] + arrPairOffset // arrCounts[arrPairEntry]]
+    arrRight = arrGenreCodes[arrStarts[arrPairEntry] + arrPairOffset % arrCounts[arrPairEntry]]
+    arrPairCells = arrLeft * intNumGenres + arrRight
+    dctMatrices = {'genre_names': arrGenreNames.astype(str)}
+    for (strName, arrEntryWeights) in dctEntryWeights.items():
+        arrMatrix = np.bincount(arrPairCells, weights=arrEntryWeights[arrPairEntry], minlength=intNumGenres * intNumGenres)
+        arrMatrix = arrMatrix.reshape(intNumGenres, intNumGenres)
+        dctMatrices[strName] = np.rint(arrMatrix).astype(np.int64) if (strName == 'titles' or strName.endswith('_titles')) \
+                               else arrMatrix
+    return dctMatrices
+
+def genre_pairs_frame(dctMatrices, strMeasure='titles'):
+    """
+    Genre pairs (i < j) of the co-occurrence matrices with their value of 'strMeasure' and the pair title counts,
+    in descending order of 'strMeasure'; pairs without titles are dropped
+    """
+    arrGenreNames = np.asarray(dctMatrices['genre_names'], dtype=object)
+    arrLeft, arrRight = np.triu_indices(arrGenreNames.shape[0], k=1)
+    df = pd.DataFrame({'genre_a': arrGenreNames[arrLeft], 'genre_b': arrGenreNames[arrRight],
+                       'titles': dctMatrices['titles'][arrLeft, arrRight]})
+    if strMeasure != 'titles':
+        df[strMeasure] = dctMatrices[strMeasure][arrLeft, arrRight]
+    df = df.loc[df['titles'] > 0]
+    return df.sort_values([strMeasure,'genre_a','genre_b'], ascending=[False,True,True], kind='stable').reset_index(drop=True)
+
+def year_trend_arrays(arrValues, lstWindows):
+    """
+    Trend arrays of the group x year sums 'arrValues' (shape (groups, years), consecutive years, 0 for no titles).
+    Returns a dictionary of arrays of the same shape:
+        'cumsum' -- running total up to each year
+        'yoy' -- growth on the previous year, value[t] / value[t-1] - 1 (NaN for the first year or a previous 0)
+        'rolling<w>' -- sum of the w years up to each year (NaN for the first w-1 years), for every w of 'lstWindows'
+        'rolling<w>_growth' -- growth of that sum on the w years before (NaN where the previous window is incomplete or 0)
+    """
+    arrValues = np.asarray(arrValues, dtype=np.float64)
+    intNumYears = arrValues.shape[1]
+    arrCumsum = np.concatenate([np.zeros((arrValues.shape[0], 1)), np.cumsum(arrValues, axis=1)], axis=1)
+    dctTrends = {'cumsum': arrCumsum[:, 1:]}
+
+    def growth(arrCurrent, arrPrevious):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(arrPrevious > 0, arrCurrent / np.where(arrPrevious > 0, arrPrevious, 1.0) - 1.0, np.nan)
+
+    arrPrevious = np.full(arrValues.shape, np.nan)
+    arrPrevious[:, 1:] = arrValues[:, :-1]
+    dctTrends['yoy'] = growth(arrValues, arrPrevious)
+    for intWindow in lstWindows:
+        if intWindow < 1:
+            raise ValueError(f'Window {intWindow} must be at least 1 year')
+        ### rolling sum ending at year t: C[t+1] - C[t+1-w], complete windows only
+        arrRolling = np.full(arrValues.shape, np.nan)
+        if intWindow <= intNumYears:
+            arrRolling[:, intWindow-1:] = arrCumsum[:, intWindow:] - arrCumsum[:, :intNumYears-intWindow+1]
+        arrPreviousWindow = np.full(arrValues.shape, np.nan)
+        if intWindow < intNumYears:
+            arrPreviousWindow[:, intWindow:] = arrRolling[:, :intNumYears-intWindow]
+        dctTrends[f'rolling{intWindow}'] = arrRolling
+        dctTrends[f'rolling{intWindow}_growth'] = growth(arrRolling, arrPreviousWindow)
+    return dctTrends
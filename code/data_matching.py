@@ -0,0 +1,273 @@
+"""
+This module matches BOM/TN revenue rows which "merge_clean_data(config)" could not attach to an IMDB title
+(the merge joins on the exact upper-case title within config['files-merge']['revenue-year-window'] years,
+see 'data_preparation.merge_title_and_revenue') to IMDB titles
+with a similar title and a release year within config['fuzzy-match']['year-window'] years.
+
+## Index
+Titles are normalized (upper case, every run of non-alphanumeric characters becomes one space) and cut into
+the set of their character trigrams (with a leading and trailing space, e.g. ' UP', 'UP '). The IMDB trigrams
+form an inverted index blocked by release year: the sorted keys (trigram, year) with the titles of every key.
+The most frequent trigrams ('intStopTrigrams', e.g. 'THE') are not indexed; they are kept as a bit mask
+per title instead.
+
+## Scoring
+Candidates of a revenue row are the IMDB titles of the years year-w .. year+w sharing an indexed trigram.
+The score is the Dice coefficient of the two trigram sets, 2*|A and B| / (|A| + |B|) (1 for equal normalized
+titles): shared indexed trigrams are counted over the candidate pairs, shared frequent trigrams with the bit masks.
+Revenue rows are scored in chunks of config['fuzzy-match']['chunk-rows'] rows in a process pool.
+
+Example:
+    dfMatches = data_matching.fuzzy_match_unmatched_revenue(config)
+    dfMatches.loc[(dfMatches['rank'] == 1) & (dfMatches['score'] >= 0.8)]
+"""
+
+import os
+import csv
+import concurrent.futures
+import pandas as pd
+import numpy as np
+import data_preparation as dataprep
+
+### Number of most frequent IMDB trigrams kept as a bit mask instead of in the index (bits of a uint64)
+intStopTrigrams = 64
+
+### Columns of the match file (see 'fuzzy_match_unmatched_revenue')
+lstMatchColumns = ['title','year','revenue_source','domestic_gross','foreign_gross','rank','score','year_diff',
+                   'tconst','imdb_title','imdb_year','numvotes','tconst_has_revenue']
+
+### Index of a worker process (set by 'init_match_worker')
+dctMatchWorkerData = dict()
+
+def normalize_match_titles(srTitles):
+    """
+    Titles for matching: upper case, every run of characters other than letters and digits replaced by
+    one space, without leading and trailing spaces
+    """
+    return srTitles.astype(str).str.upper().str.replace(r'[\W_]+', ' ', regex=True).str.strip()
+
+def title_trigrams(srTitles):
+    """
+    Distinct character trigrams of every normalized title, padded with one space on both sides.
+    Returns (number of trigrams of every title, list of all trigrams title after title)
+    """
+    lstTrigramSets = [sorted({strPadded[i:i+3] for i in range(len(strPadded) - 2)})
+                      for strPadded in (' ' + srTitles + ' ').to_list()]
+    arrCounts = np.array([len(lstTrigrams) for lstTrigrams in lstTrigramSets], dtype=np.int64)
+    return arrCounts, [strTrigram for lstTrigrams in lstTrigramSets for strTrigram in lstTrigrams]
+
+def trigram_codes(arrCounts, arrCodes, arrStopCodes):
+    """
+    Split trigram codes (-1: not in the index vocabulary) of titles with 'arrCounts' trigrams into
+    the indexed trigrams (CSR offsets and codes) and a uint64 bit mask of the stop trigrams of every title
+    """
+    arrTitle = np.repeat(np.arange(arrCounts.shape[0]), arrCounts)
+    arrStopBit = np.full(arrCodes.shape[0], -1, dtype=np.int64)
+    mskKnown = arrCodes >= 0
+    arrStopBit[mskKnown] = arrStopCodes[arrCodes[mskKnown]]
+    mskStop = arrStopBit >= 0
+    arrMasks = np.zeros(arrCounts.shape[0], dtype=np.uint64)
+    np.bitwise_or.at(arrMasks, arrTitle[mskStop], np.left_shift(np.uint64(1), arrStopBit[mskStop].astype(np.uint64)))
+    mskIndexed = mskKnown & ~mskStop
+    arrOffsets = np.zeros(arrCounts.shape[0] + 1, dtype=np.int64)
+    np.cumsum(np.bincount(arrTitle[mskIndexed], minlength=arrCounts.shape[0]), out=arrOffsets[1:])
+    return arrOffsets, arrCodes[mskIndexed], arrMasks
+
+def build_title_index(dfTitles):
+    """
+    Year-blocked trigram index of the IMDB titles 'dfTitles' (columns 'tconst', 'title', 'year', 'numvotes').
+    Returns a dictionary of arrays:
+        'vocabulary' -- all trigrams (pandas Index), 'stop_codes' -- stop bit of every trigram (-1: indexed)
+        'keys' -- sorted (trigram code * number of years + year offset) of the postings, 'titles' -- title of every posting
+        'year_min', 'num_years', 'sizes' -- trigrams per title, 'stop_masks' -- stop trigram bit mask per title
+        'tconst', 'title', 'year', 'numvotes' -- title columns
+    """
+    srNormalized = normalize_match_titles(dfTitles['title'])
+    arrCounts, lstTrigrams = title_trigrams(srNormalized)
+    arrCodes, idxVocabulary = pd.factorize(pd.Series(lstTrigrams, dtype=object))
+    arrCodes = arrCodes.astype(np.int64)
+    ### the most frequent trigrams are stop trigrams (one bit each)
+    arrFrequency = np.bincount(arrCodes, minlength=len(idxVocabulary))
+    arrStopCodes = np.full(len(idxVocabulary), -1, dtype=np.int64)
+    arrMostFrequent = np.argsort(-arrFrequency, kind='stable')[:intStopTrigrams]
+    arrStopCodes[arrMostFrequent] = np.arange(arrMostFrequent.shape[0])
+    arrOffsets, arrIndexedCodes, arrMasks = trigram_codes(arrCounts, arrCodes, arrStopCodes)
+
+    arrYear = dfTitles['year'].to_numpy(dtype=np.int64)
+    intYearMin = int(arrYear.min()) if arrYear.shape[0] > 0 else 0
+    intNumYears = int(arrYear.max()) - intYearMin + 1 if arrYear.shape[0] > 0 else 1
+    arrPostingTitles = np.repeat(np.arange(arrCounts.shape[0]), np.diff(arrOffsets))
+    arrKeys = arrIndexedCodes * intNumYears + (arrYear[arrPostingTitles] - intYearMin)
+    arrOrder = np.argsort(arrKeys, kind='stable')
+    return {'vocabulary': idxVocabulary, 'stop_codes': arrStopCodes, 'keys': arrKeys[arrOrder],
+            'titles': arrPostingTitles[arrOrder], 'year_min': intYearMin, 'num_years': intNumYears,
+            'sizes': arrCounts, 'stop_masks': arrMasks, 'tconst': dfTitles['tconst'].to_numpy(dtype=object),
+            'title': dfTitles['title'].to_numpy(dtype=object), 'year': arrYear,
+            'numvotes': dfTitles['numvotes'].to_numpy(dtype=np.float64)}
+
+def build_query_arrays(dctIndex, srTitles, srYears):
+    """
+    Trigram arrays of the revenue titles 'srTitles' with release years 'srYears' against the index 'dctIndex':
+    'offsets', 'codes' (indexed trigrams, CSR), 'stop_masks', 'sizes' (all trigrams), 'year'
+    """
+    arrCounts, lstTrigrams = title_trigrams(normalize_match_titles(srTitles))
+    arrCodes = dctIndex['vocabulary'].get_indexer(pd.Index(lstTrigrams, dtype=object)).astype(np.int64)
+    arrOffsets, arrIndexedCodes, arrMasks = trigram_codes(arrCounts, arrCodes, dctIndex['stop_codes'])
+    return {'offsets': arrOffsets, 'codes': arrIndexedCodes, 'stop_masks': arrMasks, 'sizes': arrCounts,
+            'year': srYears.to_numpy(dtype=np.int64)}
+
+def empty_match_candidates():
+    return pd.DataFrame({'row': np.empty(0, dtype=np.int64), 'title_row': np.empty(0, dtype=np.int64),
+                         'score': np.empty(0), 'year_diff': np.empty(0, dtype=np.int64), 'rank': np.empty(0, dtype=np.int64)})
+
+def score_query_chunk(dctIndex, dctQueries, intYearWindow, fltMinScore, intTopCandidates):
+    """
+    Score the queries 'dctQueries' (a chunk of 'build_query_arrays', with 'row': query row numbers) against
+    the index. Returns a DataFrame with the best 'intTopCandidates' candidates of every query with a score of
+    at least 'fltMinScore': 'row', 'title_row', 'score', 'year_diff', 'rank' (1 = best; ties: smaller year
+    difference, more votes, lower 'tconst').
+    """
+    intNumQueries = dctQueries['sizes'].shape[0]
+    arrQuery = np.repeat(np.arange(intNumQueries), np.diff(dctQueries['offsets']))
+    arrCodes = dctQueries['codes']
+    ### (i) posting ranges of every (query trigram, year in the window)
+    lstQuery, lstStart, lstEnd = list(), list(), list()
+    for intDelta in range(-intYearWindow, intYearWindow + 1):
+        arrYearOffset = dctQueries['year'][arrQuery] + intDelta - dctIndex['year_min']
+        mskYear = (arrYearOffset >= 0) & (arrYearOffset < dctIndex['num_years'])
+        arrKeys = arrCodes[mskYear] * dctIndex['num_years'] + arrYearOffset[mskYear]
+        lstQuery.append(arrQuery[mskYear])
+        lstStart.append(np.searchsorted(dctIndex['keys'], arrKeys, side='left'))
+        lstEnd.append(np.searchsorted(dctIndex['keys'], arrKeys, side='right'))
+    arrQuery, arrStart, arrEnd = np.concatenate(lstQuery), np.concatenate(lstStart), np.concatenate(lstEnd)
+    arrLengths = arrEnd - arrStart
+    ### (ii) candidate pairs: every posting of every range; shared indexed trigrams by pair
+    intNumPairs = int(arrLengths.sum())
+    if intNumPairs == 0:
+        return empty_match_candidates()
+    arrPosting = np.arange(intNumPairs) - np.repeat(np.cumsum(arrLengths) - arrLengths, arrLengths) + \
+                 np.repeat(arrStart, arrLengths)
+    arrPairKeys = np.repeat(arrQuery, arrLengths) * dctIndex['sizes'].shape[0] + dctIndex['titles'][arrPosting]
+    arrPairKeys, arrShared = np.unique(arrPairKeys, return_counts=True)
+    arrPairQuery, arrPairTitle = np.divmod(arrPairKeys, dctIndex['sizes'].shape[0])
+    ### (iii) Dice score with the shared stop trigrams
+    arrShared = arrShared + np.bitwise_count(dctQueries['stop_masks'][arrPairQuery] & dctIndex['stop_masks'][arrPairTitle])
+    arrScore = 2.0 * arrShared / (dctQueries['sizes'][arrPairQuery] + dctIndex['sizes'][arrPairTitle])
+    df = pd.DataFrame({'row': dctQueries['row'][arrPairQuery], 'title_row': arrPairTitle, 'score': arrScore,
+                       'year_diff': np.abs(dctIndex['year'][arrPairTitle] - dctQueries['year'][arrPairQuery]),
+                       'numvotes': dctIndex['numvotes'][arrPairTitle], 'tconst': dctIndex['tconst'][arrPairTitle]})
+    df = df.loc[df['score'] >= fltMinScore]
+    df = df.sort_values(['row','score','year_diff','numvotes','tconst'], ascending=[True,False,True,False,True],
+                        na_position='last', kind='stable')
+    df['rank'] = df.groupby('row', sort=False).cumcount() + 1
+    return df.loc[df['rank'] <= intTopCandidates, ['row','title_row','score','year_diff','rank']]
+
+def init_match_worker(dctIndex, dctMatchParams):
+    """
+    Process pool initializer: keep the title index and the match parameters in the worker for all its chunks
+    """
+    dctMatchWorkerData.clear()
+    dctMatchWorkerData.update({'index': dctIndex, 'params': dctMatchParams})
+    return None
+
+def score_query_chunk_in_worker(dctQueries):
+    """
+    Worker task: score one chunk of queries against the worker's title index
+    """
+    dctParams = dctMatchWorkerData['params']
+    return score_query_chunk(dctMatchWorkerData['index'], dctQueries, dctParams['year-window'],
+                             dctParams['min-score'], dctParams['top-candidates'])
+
+def query_chunks(dctQueries, intChunkRows):
+    """
+    Split the query arrays of 'build_query_arrays' into chunks of 'intChunkRows' queries with their row numbers
+    """
+    intNumQueries = dctQueries['sizes'].shape[0]
+    for intStart in range(0, intNumQueries, intChunkRows):
+        intEnd = min(intStart + intChunkRows, intNumQueries)
+        intCodeStart, intCodeEnd = dctQueries['offsets'][intStart], dctQueries['offsets'][intEnd]
+        yield {'offsets': dctQueries['offsets'][intStart:intEnd+1] - intCodeStart,
+               'codes': dctQueries['codes'][intCodeStart:intCodeEnd],
+               'stop_masks': dctQueries['stop_masks'][intStart:intEnd], 'sizes': dctQueries['sizes'][intStart:intEnd],
+               'year': dctQueries['year'][intStart:intEnd], 'row': np.arange(intStart, intEnd)}
+
+def fuzzy_match_titles(config, dfTitles, dfQueries, numWorkers=None):
+    """
+    Fuzzy match the titles of 'dfQueries' (columns 'title', 'year') to the IMDB titles 'dfTitles'
+    (columns 'tconst', 'title', 'year', 'numvotes').
+    Uses config['fuzzy-match'] keys 'year-window', 'min-score', 'top-candidates' and 'chunk-rows'.
+    'numWorkers': number of worker processes (default: os.cpu_count()); 1 runs in-process.
+    Returns a DataFrame with the candidates of every query (see 'score_query_chunk'): 'row' (position in
+    'dfQueries'), 'title_row' (position in 'dfTitles'), 'score', 'year_diff', 'rank'.
+    """
+    dctMatchParams = {strKey: config['fuzzy-match'][strKey] for strKey in ['year-window','min-score','top-candidates']}
+    dctIndex = build_title_index(dfTitles)
+    dctQueries = build_query_arrays(dctIndex, dfQueries['title'], dfQueries['year'])
+    lstChunks = list(query_chunks(dctQueries, config['fuzzy-match']['chunk-rows']))
+    if numWorkers is None:
+        numWorkers = os.cpu_count() or 1
+    numWorkers = max(1, min(numWorkers, len(lstChunks)))
+
+    lstFrames = list()
+    if numWorkers == 1:
+        init_match_worker(dctIndex, dctMatchParams)
+        lstFrames = [score_query_chunk_in_worker(dctChunk) for dctChunk in lstChunks]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=numWorkers, initializer=init_match_worker,
+                                                    initargs=(dctIndex, dctMatchParams)) as executor:
+            lstFrames = list(executor.map(score_query_chunk_in_worker, lstChunks))
+    if len(lstFrames) == 0:
+        return empty_match_candidates()
+    return pd.concat(lstFrames, axis=0, ignore_index=True)
+
+def unmatched_revenue_rows(config, dfMerged=None, dfRevenue=None):
+    """
+    Revenue rows (output of 'dataprep.combine_clean_bom_and_tn_revenue_data') not attached to any title of
+    the merged data set: no merged row has their title and 'revenue_year'.
+    'dfMerged' (columns 'title', 'revenue_year') and 'dfRevenue' are loaded when not given.
+    """
+    if dfMerged is None:
+        dfMerged = dataprep.select(config, ['title','revenue_year'], [('revenue_year','notna')])
+    if dfRevenue is None:
+        dfRevenue = dataprep.combine_clean_bom_and_tn_revenue_data(config)
+    dfAttached = dfMerged.loc[dfMerged['revenue_year'].notna(), ['title','revenue_year']].drop_duplicates()
+    dfAttached = dfAttached.astype({'revenue_year':np.int64}).rename(columns={'revenue_year':'year'})
+    dfAttached['_attached'] = True
+    df = pd.merge(dfRevenue.astype({'year':np.int64}), dfAttached, how='left', on=['title','year'])
+    return dfRevenue.loc[df['_attached'].isna().to_numpy()].reset_index(drop=True)
+
+def fuzzy_match_unmatched_revenue(config, numWorkers=None, writeFile=True, blnReport=False):
+    """
+    Fuzzy match the revenue rows not attached by "merge_clean_data" ('unmatched_revenue_rows') to the IMDB
+    titles of the merged data set (see 'fuzzy_match_titles').
+    Returns a DataFrame with columns 'lstMatchColumns', one row per candidate:
+        revenue columns 'title', 'year', 'revenue_source', 'domestic_gross', 'foreign_gross'
+        'rank', 'score' (Dice coefficient of the title trigrams), 'year_diff'
+        IMDB columns 'tconst', 'imdb_title', 'imdb_year', 'numvotes'
+        'tconst_has_revenue' -- the title already has revenue from the exact title match
+    With 'writeFile' the candidates are also written to config['files-merge']['fuzzy-matches'], so that
+    thresholds on 'score' and 'year_diff' can be tuned without matching again.
+    With 'blnReport' the number of unmatched revenue rows and of rows with a candidate is printed.
+    """
+    dfTitles = dataprep.select(config, ['tconst','title','year','numvotes','revenue_year'])
+    dfQueries = unmatched_revenue_rows(config, dfTitles)
+    dfCandidates = fuzzy_match_titles(config, dfTitles, dfQueries, numWorkers)
+
+    arrRow, arrTitleRow = dfCandidates['row'].to_numpy(), dfCandidates['title_row'].to_numpy()
+    df = dfQueries.loc[:, ['title','year','revenue_source','domestic_gross','foreign_gross']].iloc[arrRow].reset_index(drop=True)
+    df['rank'] = dfCandidates['rank'].to_numpy()
+    df['score'] = dfCandidates['score'].round(4).to_numpy()
+    df['year_diff'] = dfCandidates['year_diff'].to_numpy()
+    df['tconst'] = dfTitles['tconst'].to_numpy()[arrTitleRow]
+    df['imdb_title'] = dfTitles['title'].to_numpy()[arrTitleRow]
+    df['imdb_year'] = dfTitles['year'].to_numpy()[arrTitleRow]
+    df['numvotes'] = dfTitles['numvotes'].to_numpy()[arrTitleRow]
+    df['tconst_has_revenue'] = dfTitles['revenue_year'].notna().to_numpy()[arrTitleRow]
+    if blnReport:
+        print(f"Fuzzy title match: {dfQueries.shape[0]} unmatched revenue rows, "
+              f"{df.loc[df['rank'] == 1].shape[0]} with a candidate of score >= {config['fuzzy-match']['min-score']}")
+    df = df.loc[:, lstMatchColumns]
+    if writeFile:
+        strFilePath = os.path.join(config['folders']['data-csv'], config['files-merge']['fuzzy-matches'])
+        df.to_csv(strFilePath,encoding='utf-8',index=False,quotechar='"',quoting=csv.QUOTE_MINIMAL)
+    return df
@@ -16,41 +16,202 @@ There can be an unlimited amount of support functions.
 Each support function should have an informative name and return the partially cleaned bit of the dataset.
 """
 
+import io
 import os
 import csv
+import json
+import pickle
+import asyncio
+import itertools
+import tempfile
+import concurrent.futures
 import pandas as pd
 import numpy as np
+import utils
+import data_sketch
 
 def df_print_numnullvalues_bycol(df):
+    ### one pass over the data; 'isna' is an alias of 'isnull' and is not computed again
+    srNumNull = df.isnull().sum()
     for col in range(df.shape[1]):
-        intNumNull = df.iloc[:,col].isnull().sum()
-        intNumNan  = df.iloc[:,col].isna().sum()
-        print(f"Col {col}: Num NULL {intNumNull}: {df.columns[col]}")
-        print(f"Col {col}: Num NaN  {intNumNan}: {df.columns[col]}")
+        print(f"Col {col}: Num NULL {srNumNull.iloc[col]}: {df.columns[col]}")
 
     return None
 
-def parse_one_tn_gross_revenue_value(colVal):
+def count_rejected_value(dctRejects, strRule):
+    """
+    Count a value rejected by parsing rule 'strRule' in 'dctRejects' {rule: count} (if given).
+    Returns np.nan, the value of a rejected field.
+    """
+    if dctRejects is not None:
+        dctRejects[strRule] = dctRejects.get(strRule, 0) + 1
+    return np.nan
+
+def new_quality_report(intRowsRead):
+    """
+    Data-quality report of one "prep" function, filled while the file is parsed and filtered:
+        'rows_read' -- rows in the raw file
+        'nulls' -- {column: number of null values} of the columns checked for nulls
+        'rejected' -- {column: {rule: number of values}} rejected by the revenue parsers
+        'out_of_range' -- {column: number of rows} outside the config bounds (counted whether or not
+                          the bounds are applied, see 'applyThresholds')
+        'rows_kept' -- rows in the clean DataFrame
+    Counts come from the masks used for filtering and from the parsers; the data is not scanned again.
+    """
+    return {'rows_read': int(intRowsRead), 'nulls': dict(), 'rejected': dict(), 'out_of_range': dict(), 'rows_kept': 0}
+
+def add_quality_report(dctTotal, dctPart):
+    """
+    Add the counts of the quality report 'dctPart' (e.g. of one chunk of a file) to 'dctTotal' (in place)
+    """
+    for (strKey, value) in dctPart.items():
+        if isinstance(value, dict):
+            add_quality_report(dctTotal.setdefault(strKey, dict()), value)
+        else:
+            dctTotal[strKey] = dctTotal.get(strKey, 0) + value
+    return dctTotal
+
+### Memory budget: peak memory of a stage as a multiple of its parsed data (copies made by masks, joins,
+### type conversions). Each stage estimates its footprint from the file size and a parsed sample of rows
+### ('estimate_csv_footprint') and runs in memory, in chunks or out of core ('plan_execution').
+dctStageWorkingSetFactors = {'prep': 3.0, 'merge': 4.0, 'select': 2.0}
+
+def available_memory_bytes():
+    """
+    Memory available to new allocations: 'MemAvailable' of /proc/meminfo, else the physical memory (os.sysconf);
+    None if neither is known
+    """
+    try:
+        with open('/proc/meminfo', mode='r', encoding='utf-8') as fileMemInfo:
+            for strLine in fileMemInfo:
+                if strLine.startswith('MemAvailable:'):
+                    return int(strLine.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+def memory_budget_bytes(config):
+    """
+    Memory budget of one stage: config['memory-budget']['budget-mb'] if above 0, else
+    config['memory-budget']['available-fraction'] of the available memory ('available_memory_bytes'),
+    so that hosts of any size run the same config
+    """
+    dctBudget = config['memory-budget']
+    if dctBudget['budget-mb'] > 0:
+        return int(dctBudget['budget-mb'] * 1024 * 1024)
+    intAvailable = available_memory_bytes()
+    if intAvailable is None:
+        raise ValueError('The available memory is unknown on this host: set config["memory-budget"]["budget-mb"]')
+    return int(intAvailable * dctBudget['available-fraction'])
+
+def estimate_csv_footprint(strFilePath, intSampleRows, **dctReadArgs):
+    """
+    Estimated in-memory size of a CSV file parsed with 'pd.read_csv(strFilePath, **dctReadArgs)' (e.g. 'usecols',
+    'dtype'): the first 'intSampleRows' rows are parsed, the number of rows is the file size over the sample
+    bytes per line, and the bytes per row are the deep memory usage of the sample.
+    Returns {'rows', 'bytes_per_row', 'bytes'}.
+    """
+    intFileBytes = os.path.getsize(strFilePath)
+    with open(strFilePath, mode='rb') as fileCSV:
+        intHeaderBytes = len(fileCSV.readline())
+        intSampleBytes = sum(len(bytesLine) for bytesLine in itertools.islice(fileCSV, intSampleRows))
+    dfSample = pd.read_csv(strFilePath, nrows=intSampleRows, **dctReadArgs)
+    if dfSample.shape[0] == 0:
+        return {'rows': 0, 'bytes_per_row': 0.0, 'bytes': 0}
+    intRows = int(np.ceil((intFileBytes - intHeaderBytes) * dfSample.shape[0] / max(1, intSampleBytes)))
+    fltBytesPerRow = float(dfSample.memory_usage(deep=True, index=False).sum()) / dfSample.shape[0]
+    return {'rows': intRows, 'bytes_per_row': fltBytesPerRow, 'bytes': int(intRows * fltBytesPerRow)}
+
+def plan_execution(config, strStage, dctFootprint, blnReport=False):
+    """
+    Execution plan of stage 'strStage' (key of 'dctStageWorkingSetFactors') for data of footprint 'dctFootprint'
+    (see 'estimate_csv_footprint'; 'rows', 'bytes_per_row' and 'bytes' of all inputs) under 'memory_budget_bytes':
+        'mode' -- 'in-memory' if the working set (footprint times the stage factor) fits the budget, else
+                  'chunked' (prep, select) or 'out-of-core' (merge)
+        'chunk_rows' -- rows per chunk whose working set fits the budget, at least
+                        config['memory-budget']['min-chunk-rows'] (None in memory)
+        'buckets' -- out-of-core merge buckets: working set over budget, at least 2 (None otherwise)
+        'working_set_bytes', 'budget_bytes'
+    If 'blnReport' is True the plan is printed.
+    """
+    intBudget = memory_budget_bytes(config)
+    fltFactor = dctStageWorkingSetFactors[strStage]
+    intWorkingSet = int(dctFootprint['bytes'] * fltFactor)
+    dctPlan = {'mode': 'in-memory', 'chunk_rows': None, 'buckets': None,
+               'working_set_bytes': intWorkingSet, 'budget_bytes': intBudget}
+    if intWorkingSet > intBudget:
+        dctPlan['mode'] = 'out-of-core' if strStage == 'merge' else 'chunked'
+        intChunkRows = int(intBudget / max(1.0, fltFactor * dctFootprint['bytes_per_row']))
+        dctPlan['chunk_rows'] = max(config['memory-budget']['min-chunk-rows'], intChunkRows)
+        if strStage == 'merge':
+            dctPlan['buckets'] = max(2, int(np.ceil(intWorkingSet / intBudget)))
+    if blnReport:
+        print(f"Memory plan '{strStage}': {dctPlan['mode']} (working set {intWorkingSet/2**20:.1f} MB, "
+              f"budget {intBudget/2**20:.1f} MB, chunk rows {dctPlan['chunk_rows']}, buckets {dctPlan['buckets']})")
+    return dctPlan
+
+def parse_release_dates(srDates, strFormat, dctRejects=None):
+    """
+    Parse release date strings (e.g. 'Dec 18, 2009' with 'strFormat' '%b %d, %Y') in one vectorized call.
+    Each distinct string is parsed once and the result is mapped back to the rows by factorized codes,
+    so repeated dates (a few thousand distinct values for the TN file) cost nothing extra.
+    Values which do not match 'strFormat' are NaT and counted in 'dctRejects' as 'unrecognized_date'.
+    Returns a NumPy array of type 'datetime64[D]'.
+    """
+    arrCodes, idxUnique = pd.factorize(srDates)
+    arrUniqueDates = pd.to_datetime(pd.Series(idxUnique, dtype=object), format=strFormat, errors='coerce') \
+                       .to_numpy(dtype='datetime64[D]')
+    arrDates = np.full(arrCodes.shape[0], np.datetime64('NaT'), dtype='datetime64[D]')
+    mskKnown = (arrCodes >= 0)
+    arrDates[mskKnown] = arrUniqueDates[arrCodes[mskKnown]]
+    intRejected = int((np.isnat(arrDates) & mskKnown).sum())
+    if dctRejects is not None and intRejected > 0:
+        dctRejects['unrecognized_date'] = dctRejects.get('unrecognized_date', 0) + intRejected
+    return arrDates
+
+def release_dates_to_years(arrDates):
+    """
+    Release year of every 'datetime64' value as float64 (NaN for NaT)
+    """
+    arrYears = arrDates.astype('datetime64[Y]').astype(np.int64).astype(np.float64) + 1970
+    arrYears[np.isnat(arrDates)] = np.nan
+    return arrYears
+
+def release_year_mask(config, srYear, dctQuality):
+    """
+    Shared year-bounds stage of the "prep" functions: True for rows with
+    config['title-release-year-min'] <= year <= config['title-release-year-max'].
+    The number of rows outside the bounds is recorded in dctQuality['out_of_range']['year'].
+    """
+    mskYear = ( (srYear >= config['title-release-year-min']) & (srYear <= config['title-release-year-max']) )
+    dctQuality['out_of_range']['year'] = int((mskYear==False).sum())
+    return mskYear
+
+def parse_one_tn_gross_revenue_value(colVal, dctRejects=None):
     """
     Functions parses strings of type '456,454,454'
     They appear as part of tn.movie_budgets.csv file
 
     Argument: colVal -- leading '$' char is stripped before the argument is passed 
                         to the function
+              dctRejects -- optional {rule: count} of rejected values, see 'count_rejected_value'
     Returns np.uint64 or throw a TypeError if cannot convert to int
     """
     returnValue = colVal.split(',')
     if len(returnValue[0]) > 3 or len(returnValue[0]) == 0:
         ### $,456,456 or $93847,387,384
-        return np.nan
+        return count_rejected_value(dctRejects, 'bad_digit_groups')
     ### checking sub-strings with index 1 to second to last
     for splitVal in returnValue[1:-1]:
         if len(splitVal) != 3:
             ### numbers like $345,45464,34353,343
-            return np.nan
+            return count_rejected_value(dctRejects, 'bad_digit_groups')
     if len(returnValue[-1]) > 3 or len(returnValue) == 0:
         ### numbers like $456,456,4546 or $456,456,
-        return np.nan
+        return count_rejected_value(dctRejects, 'bad_digit_groups')
     try:
         returnValue = np.uint64(''.join(returnValue))
     except TypeError as err:
@@ -59,19 +220,20 @@ def parse_one_tn_gross_revenue_value(colVal):
     
     return returnValue
 
-def parse_tn_gross_revenue_values(colVal):
+def parse_tn_gross_revenue_values(colVal, dctRejects=None):
     """
     Function converts the string values of gross revenue (domestic and worldwide)
     into integer values from string values
     id	release_date	movie	production_budget	domestic_gross	worldwide_gross
 	1	Dec 18, 2009	Avatar	$425,000,000	$760,507,625	$2,776,345,279
+    Rejected values are returned as np.nan and counted by rule in 'dctRejects' (if given).
     """
     returnValue = 0 # initialize returnValue to zero
     # all chars from string.punctuation except comma (',') and point ('.'), dollar sign ('$')
     strInvalidChars = """!"#%&\'()*+-/:;<=>?@[\\]^_`{|}~"""
     if type(colVal) == str:
         if any(char in strInvalidChars for char in colVal):
-            return np.nan
+            return count_rejected_value(dctRejects, 'invalid_characters')
         elif len(colVal) == 0:
             ### it may mean there was no release in any foreign location
             return 0
@@ -82,9 +244,9 @@ def parse_tn_gross_revenue_values(colVal):
             if returnValue.isnumeric():
                 return np.uint64(returnValue)
             else:
-                return np.nan
+                return count_rejected_value(dctRejects, 'not_numeric')
         elif ('.' in colVal) and colVal.count('.') > 1:
-            return np.nan
+            return count_rejected_value(dctRejects, 'multiple_decimal_points')
         elif colVal.isnumeric():
             ### the string contains only numeric data
             try:
@@ -102,27 +264,27 @@ def parse_tn_gross_revenue_values(colVal):
                 print("Error Output:\n", err)
         elif (not colVal.startswith('$')) and ('.' not in colVal) and (',' in colVal):
             ### strings like "345,343,335"
-            returnValue = parse_one_tn_gross_revenue_value(colVal)
+            returnValue = parse_one_tn_gross_revenue_value(colVal, dctRejects)
         elif (not colVal.startswith('$')) and (',' in colVal) and ('.' in colVal and colVal.count('.') == 1):
             #### parsing cases like "1,234,000,000.0"
             lstColValSplit = colVal.split('.') # this list has len 2 (substring before '.' and after '.')
             if ',' in lstColValSplit[1]:
                 ### string like '434,454.454,345'
-                return np.nan
-            returnValue = parse_one_tn_gross_revenue_value(lstColValSplit[0])
+                return count_rejected_value(dctRejects, 'comma_after_decimal_point')
+            returnValue = parse_one_tn_gross_revenue_value(lstColValSplit[0], dctRejects)
         elif colVal.startswith('$') and (',' in colVal) and ('.' in colVal and colVal.count('.') == 1):
             colVal = colVal[1:]
             lstColValSplit = colVal.split('.') # this list has len 2 (substring before '.' and after '.')
             if ',' in lstColValSplit[1]:
                 ### string like '434,454.454,345'
-                return np.nan
-            returnValue = parse_one_tn_gross_revenue_value(lstColValSplit[0])
+                return count_rejected_value(dctRejects, 'comma_after_decimal_point')
+            returnValue = parse_one_tn_gross_revenue_value(lstColValSplit[0], dctRejects)
         elif colVal.startswith('$') and (',' in colVal) and ('.' not in colVal):
             colVal = colVal[1:]
-            returnValue = parse_one_tn_gross_revenue_value(colVal)
+            returnValue = parse_one_tn_gross_revenue_value(colVal, dctRejects)
         else:
             ### final clause of "if(colVal)==str"
-            return np.nan
+            return count_rejected_value(dctRejects, 'unrecognized_format')
     ### tn.movie_budgets.csv is loaded as str type for revenue (no need to parse for num types)
     # elif type(colVal) == float:
     #     ### Converting type float to int: if NaN, then 0 (this may be an overkill)
@@ -145,11 +307,11 @@ def parse_tn_gross_revenue_values(colVal):
     #             print(f"Value Error: cannot convert int value --{colVal}-- to np.uint64")
     #             print("Error Output:\n", err)
     else:
-        returnValue = np.nan
+        returnValue = count_rejected_value(dctRejects, 'not_a_string')
 
     return returnValue
 
-def prep_tn_movie_budgets(config,fileLocation=''):
+def prep_tn_movie_budgets(config,fileLocation='',applyThresholds=True,writeFile=True,dctReport=None):
     """
     This function prepares the uncompressed file from IMDB "tn.movie_budgets.csv" for analysis by:
     RangeIndex: 5782 entries, 0 to 5781
@@ -168,11 +330,20 @@ def prep_tn_movie_budgets(config,fileLocation=''):
 	1	Dec 18, 2009	Avatar	$425,000,000	$760,507,625	$2,776,345,279
     
     memory usage: 271.2+ KB
-    (i) Insert column 'release_year'
+    (i) Parse 'release_date' (format config['files-tn']['release-date-format'], see 'parse_release_dates')
+        and derive column 'year'; rows with an unrecognized date are dropped
 
-    (ii) Drop all rows with release year < 2010 and above 2019
+    (ii) Drop all rows with release year < 2010 and above 2019 (see 'release_year_mask')
 
     (iii) Convert domestic_gross and worldwide_gross to integers
+
+    (iv) Convert production_budget to integers; a budget which cannot be parsed is set to 0 (unknown)
+
+    Keyword arguments:
+    'applyThresholds' -- if False, the release year bounds from config are not applied (see 'data_sweep')
+    'writeFile' -- if False, the clean file is not written
+    'dctReport' -- if given, updated with the data-quality report (see 'new_quality_report')
+    Returns the clean DataFrame
     """
     if len(fileLocation) == 0:
         fileLocation = os.path.join(config['folders']['data-csv'], config['files-tn']['csv'])
@@ -187,23 +358,33 @@ def prep_tn_movie_budgets(config,fileLocation=''):
                      quotechar= '"', # quote char encloses the field where separator (',') char is present
                      quoting  = csv.QUOTE_MINIMAL  # quote char only around data with separator char (',')           
          )
-    ### (0) drop colums 'id', 'production_budget', rename 'movie' to 'title'
-    df = df.drop(columns=['id','production_budget'])
+    dctQuality = new_quality_report(df.shape[0])
+    dctQuality['rejected'] = {'release_date': dict(), 'domestic_gross': dict(), 'worldwide_gross': dict(),
+                              'production_budget': dict()}
+
+    ### (0) drop colum 'id', rename 'movie' to 'title'
+    df = df.drop(columns=['id'])
     df = df.rename(columns={'movie':'title'})
     
-    ### (i) Deriving column 'release_year'
-    df['year'] = df['release_date'].apply(lambda d: np.uint16(d[-4:]))
-    df = df.drop(columns=['release_date'])
+    ### (i) Full release date and column 'year'
+    arrDates = parse_release_dates(df['release_date'], config['files-tn']['release-date-format'],
+                                   dctRejects=dctQuality['rejected']['release_date'])
+    df['release_date'] = arrDates
+    df['year'] = release_dates_to_years(arrDates)
+    df = df.loc[df['year'].notna()]
+    df = df.astype({'year':np.uint16})
 
     ### (ii) Keeping titles in valid release year range
-    mskValidYears = ( (df['year'] >= config['title-release-year-min']) & \
-                      (df['year'] <= config['title-release-year-max']) )
-    df = df.loc[mskValidYears]
+    mskValidYears = release_year_mask(config, df['year'], dctQuality)
+    if applyThresholds:
+        df = df.loc[mskValidYears]
 
     ### (iii) Convert domestic and worldwide gross to meaningful types, remove np.nan rows
-    ### and convert to np.uint64
-    df['domestic_gross']   = df['domestic_gross'].apply(parse_tn_gross_revenue_values)
-    df['worldwide_gross']  = df['worldwide_gross'].apply(parse_tn_gross_revenue_values)
+    ### and convert to np.uint64; rejected values are counted by parsing rule
+    df['domestic_gross']   = df['domestic_gross'].apply(parse_tn_gross_revenue_values,
+                                                        dctRejects=dctQuality['rejected']['domestic_gross'])
+    df['worldwide_gross']  = df['worldwide_gross'].apply(parse_tn_gross_revenue_values,
+                                                         dctRejects=dctQuality['rejected']['worldwide_gross'])
     mskNullGross = ( (df['domestic_gross'].isnull()) | (df['worldwide_gross'].isnull()) )
     df = df.loc[mskNullGross==False]
     df = df.astype({'domestic_gross':np.uint64, 'worldwide_gross':np.uint64})
@@ -212,15 +393,24 @@ def prep_tn_movie_budgets(config,fileLocation=''):
     df['foreign_gross'] = df['worldwide_gross'].sub(df['domestic_gross'])
     df = df.drop(columns=['worldwide_gross'])
 
-    ### (v) Re-arrange columns
-    df = df.loc[:,['title','year','domestic_gross','foreign_gross']]
+    ### (v) Production budget with the same parser; an unparsed budget is kept as 0 like a missing BOM gross
+    df['production_budget'] = df['production_budget'].apply(parse_tn_gross_revenue_values,
+                                                             dctRejects=dctQuality['rejected']['production_budget'])
+    df['production_budget'] = df['production_budget'].fillna(0).astype(np.uint64)
 
-    strFilePath = os.path.join(config['folders']['data-csv'], config['files-tn']['clean-csv'])
-    df.to_csv(strFilePath,encoding='utf-8',index=False)
+    ### (vi) Re-arrange columns
+    df = df.loc[:,['title','year','release_date','domestic_gross','foreign_gross','production_budget']]
 
-    return None
+    if writeFile:
+        strFilePath = os.path.join(config['folders']['data-csv'], config['files-tn']['clean-csv'])
+        df.to_csv(strFilePath,encoding='utf-8',index=False,date_format='%Y-%m-%d')
+
+    dctQuality['rows_kept'] = int(df.shape[0])
+    if dctReport is not None:
+        dctReport.update(dctQuality)
+    return df
 
-def parse_bom_gross_revenue_values(colVal):
+def parse_bom_gross_revenue_values(colVal, dctRejects=None):
     """
     Parsing through values in column 'foreign_gross' and converting these values to a numeric format.
     Parsing rules: if 'colVal' is a string
@@ -228,6 +418,7 @@ def parse_bom_gross_revenue_values(colVal):
      (ii) Null values enclosed in quotation marks are set to 0;
     (iii) colVal has char '.' and ',' to the left of it. This values is gross in million of dollars: remove ',',
           convert the result to 'float', and multiply by 1e6.
+    Rejected values are returned as np.nan and counted by rule in 'dctRejects' (if given).
     """
     returnValue = 0 # initialize returnValue to zero
     # all chars from string.punctuation except comma (',') and point ('.')
@@ -253,24 +444,24 @@ def parse_bom_gross_revenue_values(colVal):
                 print("Error Output:\n", err)
         elif (',' in colVal) and (colVal.count(',') == 1) and ('.' not in colVal):
             ### sting values of type '1235356,343'
-            return np.nan
+            return count_rejected_value(dctRejects, 'comma_without_decimal_point')
         elif any(char in strInvalidChars for char in colVal):
             ### colVal contains at least one non-numeric character
-            return np.nan
+            return count_rejected_value(dctRejects, 'invalid_characters')
         elif '.' in colVal and colVal.count('.') > 1:
-            return np.nan
+            return count_rejected_value(dctRejects, 'multiple_decimal_points')
         elif ',' in colVal and colVal.count(',') > 1:
-            return np.nan
+            return count_rejected_value(dctRejects, 'multiple_commas')
         elif ',' in colVal and '.' in colVal:
             #### parsing cases like "1,234.0": 1 billion 234 million
             indComma = colVal.index(',')
             indPoint = colVal.index('.')
             if indPoint < indComma:
                 ### str vals like "1.454,0"
-                return np.nan
+                return count_rejected_value(dctRejects, 'decimal_point_before_comma')
             if indPoint - indComma != 4:
                 ### str vals like "1,45.9" (not "1,234.0")
-                return np.nan
+                return count_rejected_value(dctRejects, 'bad_digit_groups')
             else:
                 ### deal with values "1,345.0" in millions of dollars
                 tempVal = colVal.replace(',','')
@@ -282,8 +473,8 @@ def parse_bom_gross_revenue_values(colVal):
                 returnValue = np.uint64(returnValue * 1e6)
         else:
             ### final clause of "if(colVal)==str"
-            return np.nan
-    elif type(colVal) in [float, np.float, np.float16,np.float32,np.float64]:
+            return count_rejected_value(dctRejects, 'unrecognized_format')
+    elif type(colVal) in [float, np.float16, np.float32, np.float64]:
         ### Converting type float to int: if NaN, then 0 (corresponds to empty field as (,,))
         if np.isnan(colVal):
             returnValue = np.uint64(0)
@@ -293,7 +484,7 @@ def parse_bom_gross_revenue_values(colVal):
             except ValueError as err:
                 print(f"Value Error: cannot convert float value --{colVal}-- to np.uint64")
                 print("Error Output:\n", err)
-    elif type(colVal) in [int,np.int,np.int32,np.int64,np.uint32,np.uint64]:
+    elif type(colVal) in [int, np.int32, np.int64, np.uint32, np.uint64]:
         ### Converting type int to np.uint64: if NaN, then 0 (this may be an overkill)
         ### int or np.int types cannot be NaN since np.nan is only float.
         try:
@@ -306,7 +497,7 @@ def parse_bom_gross_revenue_values(colVal):
 
     return returnValue
 
-def prep_bom_movie_gross(config):
+def prep_bom_movie_gross(config,applyThresholds=True,writeFile=True,dctReport=None):
     """
     This function prepares the uncompressed file from IMDB "bom.movie_gros.csv" for analysis by:
     RangeIndex: 3387 entries, 0 to 3386
@@ -326,7 +517,14 @@ def prep_bom_movie_gross(config):
     (ii) convert a NULL or NaN value from domestic_gross or foreign_gross column to 0
 
     (iii) Convert data in columns "start_year" and "runtime_minutes" to type 'np.uint16'
-    
+
+    (iv) Drop rows with release year out of bounds (see 'release_year_mask')
+
+    Keyword arguments:
+    'applyThresholds' -- if False, the release year bounds from config are not applied (see 'data_sweep')
+    'writeFile' -- if False, the clean file is not written
+    'dctReport' -- if given, updated with the data-quality report (see 'new_quality_report')
+    Returns the clean DataFrame
     """
     strFilePath = os.path.join(config['folders']['data-csv'], config['files-bom']['csv'])
     dctColDataTypes = {'title':str,'studio':str,'year':np.uint16,'domestic_gross':np.float64,'foreign_gross':str}
@@ -338,17 +536,26 @@ def prep_bom_movie_gross(config):
                      quotechar= '"', # quote char encloses the field where separator (',') char is present
                      quoting  = csv.QUOTE_MINIMAL,    # quote char present in field only where the separator char (',') is present              
                      dtype    = dctColDataTypes)
+    dctQuality = new_quality_report(df.shape[0])
+    dctQuality['rejected'] = {'domestic_gross': dict(), 'foreign_gross': dict()}
+
     ### (0) Drop column 'studio' removing rows with no titles and no release year
     df = df.drop(columns=['studio'])
-    mskInvalidRows = ( df['title'].isnull() | df['year'].isnull() )
+    dfNull = df.loc[:,['title','year']].isnull()
+    dctQuality['nulls'] = {col: int(intNumNull) for (col, intNumNull) in dfNull.sum().items()}
+    mskInvalidRows = dfNull.any(axis=1)
     df = df.loc[mskInvalidRows==False]
 
     ### (i) removing rows with release year out of bounds
-    mskYear = (df['year']>=config['title-release-year-min']) & (df['year']<=config['title-release-year-max'])
+    mskYear = release_year_mask(config, df['year'], dctQuality)
+    if applyThresholds:
+        df = df.loc[mskYear]
 
-     ### (ii) Convert data to meaningful values
-    df['domestic_gross'] = df['domestic_gross'].apply(parse_bom_gross_revenue_values)
-    df['foreign_gross']  = df['foreign_gross'].apply(parse_bom_gross_revenue_values)
+     ### (ii) Convert data to meaningful values; rejected values are counted by parsing rule
+    df['domestic_gross'] = df['domestic_gross'].apply(parse_bom_gross_revenue_values,
+                                                      dctRejects=dctQuality['rejected']['domestic_gross'])
+    df['foreign_gross']  = df['foreign_gross'].apply(parse_bom_gross_revenue_values,
+                                                     dctRejects=dctQuality['rejected']['foreign_gross'])
 
     ### (iii) removing titles with NaN revenue figures: after parsing all revenue should be 
     ###       either a valid number or NaN. NaN's should be removed.
@@ -357,12 +564,16 @@ def prep_bom_movie_gross(config):
 
     ### (iv) Re-arrange columns and save
     df = df.loc[:,['title','year','domestic_gross','foreign_gross']]
-    strFilePath = os.path.join(config['folders']['data-csv'], config['files-bom']['clean-csv'])
-    df.to_csv(strFilePath,encoding='utf-8',index=False,quotechar='"',quoting=csv.QUOTE_MINIMAL)
+    if writeFile:
+        strFilePath = os.path.join(config['folders']['data-csv'], config['files-bom']['clean-csv'])
+        df.to_csv(strFilePath,encoding='utf-8',index=False,quotechar='"',quoting=csv.QUOTE_MINIMAL)
 
-    return None
+    dctQuality['rows_kept'] = int(df.shape[0])
+    if dctReport is not None:
+        dctReport.update(dctQuality)
+    return df
 
-def prep_imdb_title_basics(config):
+def prep_imdb_title_basics(config,applyThresholds=True,writeFile=True,dctReport=None,chunkSize=None):
     """
     This function prepares the uncompressed file from IMDB "imdb.title.basics.csv" for analysis by:
     (i) removing any row which contains a null values except for rows with original title being NULL
@@ -376,45 +587,112 @@ def prep_imdb_title_basics(config):
     (iii) Remove all pandemic data items with "start_year" before 2020 to exclude COVID pandemic releases
     (iv) Remove all titles with run times over 6 hours; there are 77 titles in that category after NULL value
     removal
+    All steps are row by row, so the raw file can be parsed and cleaned in chunks (see 'prep_imdb_title_basics_frame');
+    the clean file is the same.
+
+    Keyword arguments:
+    'applyThresholds' -- if False, steps (iii) and (iv) are skipped (see 'data_sweep')
+    'writeFile' -- if False, the clean file is not written
+    'dctReport' -- if given, updated with the data-quality report (see 'new_quality_report')
+    'chunkSize' -- rows parsed at a time; None: chosen from the memory budget (see 'plan_execution'),
+                   0: the whole file at once
+    Returns the clean DataFrame if the whole file is parsed at once. In chunks, the clean chunks are streamed
+    to the clean file and None is returned, or, if 'writeFile' is False, an iterator of the clean chunks is
+    returned ('dctReport' is updated when the iterator is exhausted).
     """
     strFilePath = os.path.join(config['folders']['data-csv'], config['files-imdb']['csv']['title-base'])
     dctColDataTypes = {'tconst': str,'primary_title':str,'original_title': str,
                        'start_year':np.float32,'runtime_minutes': np.float32, 'genres': str}
-    df = pd.read_csv(strFilePath,
-                     sep      = ',',
-                     header   = 0,
-                     encoding = 'utf-8',
-                     engine   = 'python',
-                     quotechar= '"', # quote char encloses all field
-                     quoting  = csv.QUOTE_ALL,   # quote char present in all fields (aka csv.QUOTE_ALL)             
-                     dtype=dctColDataTypes)
+    dctReadArgs = {'sep'      : ',',
+                   'header'   : 0,
+                   'encoding' : 'utf-8',
+                   'engine'   : 'python',
+                   'quotechar': '"', # quote char encloses all field
+                   'quoting'  : csv.QUOTE_ALL,   # quote char present in all fields (aka csv.QUOTE_ALL)
+                   'dtype'    : dctColDataTypes}
+    if chunkSize is None:
+        dctFootprint = estimate_csv_footprint(strFilePath, config['memory-budget']['sample-rows'], **dctReadArgs)
+        chunkSize = plan_execution(config, 'prep', dctFootprint)['chunk_rows']
+    strCleanFilePath = os.path.join(config['folders']['data-csv'], config['files-imdb']['csv']['clean-title-base'])
+
+    if chunkSize:
+        iterChunks = iter_prep_imdb_title_basics_chunks(config, strFilePath, dctReadArgs, chunkSize, applyThresholds,
+                                                        strCleanFilePath if writeFile else None, dctReport)
+        if not writeFile:
+            return iterChunks
+        for df in iterChunks:
+            pass
+        return None
+
+    df = pd.read_csv(strFilePath, **dctReadArgs)
+    dctQuality = new_quality_report(df.shape[0])
+    df = prep_imdb_title_basics_frame(config, df, applyThresholds, dctQuality)
+    if writeFile:
+        df.to_csv(strCleanFilePath,encoding='utf-8',index=False,quotechar='"', quoting=csv.QUOTE_MINIMAL)
+
+    if dctReport is not None:
+        dctReport.update(dctQuality)
+    return df
+
+def iter_prep_imdb_title_basics_chunks(config, strFilePath, dctReadArgs, chunkSize, applyThresholds,
+                                       strCleanFilePath, dctReport):
+    """
+    Generator of the clean chunks of 'prep_imdb_title_basics': the raw file is parsed 'chunkSize' rows at a time,
+    every clean chunk is appended to 'strCleanFilePath' (if not None) and the quality reports of the chunks are
+    summed into 'dctReport' (if not None) once the file is done. A raw file without rows gives a clean file
+    with the header only.
+    """
+    dctQuality = new_quality_report(0)
+    blnFirstChunk = True
+    for df in pd.read_csv(strFilePath, chunksize=chunkSize, **dctReadArgs):
+        dctChunkQuality = new_quality_report(df.shape[0])
+        df = prep_imdb_title_basics_frame(config, df, applyThresholds, dctChunkQuality)
+        add_quality_report(dctQuality, dctChunkQuality)
+        if strCleanFilePath is not None:
+            df.to_csv(strCleanFilePath,mode='w' if blnFirstChunk else 'a',header=blnFirstChunk,
+                      encoding='utf-8',index=False,quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        blnFirstChunk = False
+        yield df
+    if blnFirstChunk and strCleanFilePath is not None:
+        df = prep_imdb_title_basics_frame(config, pd.read_csv(strFilePath, nrows=0, **dctReadArgs), applyThresholds,
+                                          new_quality_report(0))
+        df.to_csv(strCleanFilePath,encoding='utf-8',index=False,quotechar='"', quoting=csv.QUOTE_MINIMAL)
+    if dctReport is not None:
+        dctReport.update(dctQuality)
+
+def prep_imdb_title_basics_frame(config, df, applyThresholds, dctQuality):
+    """
+    Steps (i)-(v) of 'prep_imdb_title_basics' on the raw rows 'df' (the whole file or one chunk);
+    counts are recorded in 'dctQuality' (see 'new_quality_report'). Returns the clean rows.
+    """
     ### (0) Drop 'original_title' and stardardize column names
     df = df.drop(columns=['original_title'])
     df = df.rename(columns={'primary_title': 'title','start_year':'year'}) 
-    
+
     ### (i) Removing rows with NULL values
-    mskRowsNullValues = (df['tconst'].isnull() | df['title'].isnull() | df['year'].isnull() | \
-                        df['runtime_minutes'].isnull() | df['genres'].isnull())
+    dfNull = df.isnull()
+    dctQuality['nulls'] = {col: int(intNumNull) for (col, intNumNull) in dfNull.sum().items()}
+    mskRowsNullValues = dfNull.any(axis=1)
     df = df.loc[(mskRowsNullValues==False)]
 
-     ### (ii) Revome titles outside of release year boundaries
-    mskPreCovidData = ((df['year'] >= config['title-release-year-min']) & \
-                       (df['year'] <= config['title-release-year-max']))
-    df = df.loc[mskPreCovidData]
+    ### (ii) Titles outside of release year boundaries
+    mskPreCovidData = release_year_mask(config, df['year'], dctQuality)
 
-    ### (iv) Remove titles with run times below 25 min and above 6 hours (360 minutes)
+    ### (iv) Titles with run times below 25 min and above 6 hours (360 minutes)
     mskRuntime = ((df['runtime_minutes'] >= config['runtime-minutes-min']) & \
                   (df['runtime_minutes'] <= config['runtime-minutes-max']))
-    df = df.loc[mskRuntime]
+    dctQuality['out_of_range']['runtime_minutes'] = int((mskRuntime==False).sum())
+
+    if applyThresholds:
+        df = df.loc[mskPreCovidData & mskRuntime]
 
     ### (v) Convert runtime_minutes and 'start_year' to np.uint16
     df = df.astype({'year':np.uint16, 'runtime_minutes':np.uint16})
 
-    strFilePath = os.path.join(config['folders']['data-csv'], config['files-imdb']['csv']['clean-title-base'])
-    df.to_csv(strFilePath,encoding='utf-8',index=False,quotechar='"', quoting=csv.QUOTE_MINIMAL)
-    return None
+    dctQuality['rows_kept'] = int(df.shape[0])
+    return df
 
-def prep_imdb_title_ratings(config):
+def prep_imdb_title_ratings(config,applyThresholds=True,writeFile=True,dctReport=None):
     """
     This function prepares the uncompressed file from IMDB "imdb.title.ratings.csv" for analysis by:
     (i) removing any row which contains a null values except for rows with original title being NULL
@@ -431,6 +709,12 @@ def prep_imdb_title_ratings(config):
 
     (ii) Remove rows with average rating below 1 and above 10
     (iii) Remove rows with numvotes below the minimum vote threshold
+
+    Keyword arguments:
+    'applyThresholds' -- if False, step (iii) is skipped (see 'data_sweep')
+    'writeFile' -- if False, the clean file is not written
+    'dctReport' -- if given, updated with the data-quality report (see 'new_quality_report')
+    Returns the clean DataFrame
     """
     strFilePath = os.path.join(config['folders']['data-csv'], config['files-imdb']['csv']['title-rate'])
     dctColDataTypes = {'tconst': str,'averagerating':np.float64,'numvotes': np.float64}
@@ -443,28 +727,40 @@ def prep_imdb_title_ratings(config):
                      quotechar='"',
                      quoting  = csv.QUOTE_ALL)
     
+    dctQuality = new_quality_report(df.shape[0])
+
     ### (i) Removing rows with NULL values
-    mskRowsNullValues = (df["tconst"].isnull() | df["averagerating"].isnull() | df["numvotes"].isnull())
+    dfNull = df.isnull()
+    dctQuality['nulls'] = {col: int(intNumNull) for (col, intNumNull) in dfNull.sum().items()}
+    mskRowsNullValues = dfNull.any(axis=1)
     df = df.loc[(mskRowsNullValues==False)]
 
     ### (ii) Remove rows with average rating below 1 and above 10
     mskRating = ( (df['averagerating'] >= config['title-rating-min-value']) & \
                   (df['averagerating'] <= config['title-rating-max-value']) )
+    dctQuality['out_of_range']['rating'] = int((mskRating==False).sum())
     df = df.loc[mskRating]
 
     ### (iii) Remove rows with number of votes below a minimum threshold
     mskNumVotes = (df['numvotes'] >= config['rating-votes-min'])
-    df = df.loc[mskNumVotes]
+    dctQuality['out_of_range']['numvotes'] = int((mskNumVotes==False).sum())
+    if applyThresholds:
+        df = df.loc[mskNumVotes]
 
     ### (iv) Rename 'averagerating' to 'rating', Convert 'averagerating' and 'numvotes' to float and int, respetively
     df = df.rename(columns={'averagerating':'rating'})
     df = df.astype({'rating':np.float32,'numvotes':np.uint64})
 
-    strFile = os.path.join(config['folders']['data-csv'], config['files-imdb']['csv']['clean-title-rate'])
-    df.to_csv(strFile,encoding='utf-8',index=False,quotechar='"',quoting=csv.QUOTE_MINIMAL)
-    return None
+    if writeFile:
+        strFile = os.path.join(config['folders']['data-csv'], config['files-imdb']['csv']['clean-title-rate'])
+        df.to_csv(strFile,encoding='utf-8',index=False,quotechar='"',quoting=csv.QUOTE_MINIMAL)
 
-def prepare_clean_data(config):
+    dctQuality['rows_kept'] = int(df.shape[0])
+    if dctReport is not None:
+        dctReport.update(dctQuality)
+    return df
+
+def prepare_clean_data(config, writeReport=True):
     """
     Umbrella function which calls functions for cleaning individual data files
     after these files are decompressed and written to the project ./data folder:
@@ -475,8 +771,9 @@ def prepare_clean_data(config):
 
     Aarguments:
     config - JSON obect which contains the parameters of the project
+    writeReport - if True, the data-quality report is written to config['files-quality']['report-json']
     Return Value:
-    None - the function returns no value
+    Data-quality report of the run: {file key: report of its "prep" function (see 'new_quality_report')}
     Side Effect:
     Each "prep" function writes out a CSV data file with prefix "clean"
     (1) "clean.imdb.title.basics.csv"
@@ -484,37 +781,55 @@ def prepare_clean_data(config):
     (3) "clean.bom.movie_gross.csv"
     (4) "clean.tn.movie_budgets.csv"
     """
-    prep_imdb_title_basics(config)
-    prep_imdb_title_ratings(config)
-    prep_bom_movie_gross(config)
-    prep_tn_movie_budgets(config)
-
-    return None
-
-def load_clean_imdb_title_basics(config):
+    dctReport = {'imdb-title-basics': dict(), 'imdb-title-ratings': dict(), 'bom-movie-gross': dict(), 'tn-movie-budgets': dict()}
+    prep_imdb_title_basics(config, dctReport=dctReport['imdb-title-basics'])
+    prep_imdb_title_ratings(config, dctReport=dctReport['imdb-title-ratings'])
+    prep_bom_movie_gross(config, dctReport=dctReport['bom-movie-gross'])
+    prep_tn_movie_budgets(config, dctReport=dctReport['tn-movie-budgets'])
+
+    if writeReport:
+        strFilePath = os.path.join(config['folders']['data-csv'], config['files-quality']['report-json'])
+        with open(strFilePath, mode='w', encoding='utf-8') as fileReport:
+            json.dump(dctReport, fileReport, indent=4)
+
+    ### Year partitions of the clean files with a release year (see 'partition_clean_file_by_year')
+    if config['year-partitions']['enabled']:
+        for strDataset in ['imdb-title-basics', 'bom-movie-gross', 'tn-movie-budgets']:
+            partition_clean_file_by_year(config, strDataset)
+    return dctReport
+
+def load_clean_imdb_title_basics(config, chunkSize=None, yearRange=None, fileLocation=''):
     """
     Load to dataframe from file './data/clean.imdb.title.basics.csv'
+    With 'chunkSize' set, returns an iterator of DataFrames of up to 'chunkSize' rows.
+    With 'yearRange' (first year, last year) set, only the matching year partitions are read
+    (see 'load_year_partitions'); 'fileLocation' overrides the file location.
     """
-    strFileLocation = os.path.join(config['folders']['data-csv'], config['files-imdb']['csv']['clean-title-base'])
+    if yearRange is not None:
+        return load_year_partitions(config, 'imdb-title-basics', yearRange, chunkSize)
+    strFileLocation = fileLocation if len(fileLocation) > 0 else \
+                      os.path.join(config['folders']['data-csv'], config['files-imdb']['csv']['clean-title-base'])
     df = pd.read_csv(
         strFileLocation,
         encoding='utf-8',
         sep      = ',',
         header   = 0,
-        engine   = 'python',
+        engine   = 'c',  # the C parser releases the GIL while tokenizing (see 'load_clean_sources_concurrently')
         dtype    = {'tconst':str,
                     'title':str,
                     'year':np.uint16,
                     'runtime_minutes':np.uint16,
                     'genres':str},
+        chunksize= chunkSize,
         quotechar= '"', # quote char encloses the field where separator (',') char is present
         quoting  = 0    # quote char present in field only where the separator char (',') is present              
     )
     return df
 
-def load_clean_imdb_title_ratings(config):
+def load_clean_imdb_title_ratings(config, chunkSize=None):
     """
     Load to dataframe from file './data/clean.imdb.title.ratings.csv'
+    With 'chunkSize' set, returns an iterator of DataFrames of up to 'chunkSize' rows.
     """
     strFileLocation = os.path.join(config['folders']['data-csv'], config['files-imdb']['csv']['clean-title-rate'])
     df = pd.read_csv(
@@ -522,164 +837,1204 @@ def load_clean_imdb_title_ratings(config):
         encoding='utf-8',
         sep      = ',',
         header   = 0,
-        engine   = 'python',
+        engine   = 'c',
         quotechar= '"',
         quoting= 0,
         dtype    = {'tconst':str,
                     'rating':np.float64,
-                    'numvotes':np.uint64}
+                    'numvotes':np.uint64},
+        chunksize= chunkSize
     )
     return df
 
-def load_clean_bom_movie_gross(config):
+def load_clean_bom_movie_gross(config, chunkSize=None, yearRange=None, fileLocation=''):
     """
     Load to dataframe from file './data/clean.bom.movie_gross.csv'
+    With 'chunkSize' set, returns an iterator of DataFrames of up to 'chunkSize' rows.
+    With 'yearRange' (first year, last year) set, only the matching year partitions are read
+    (see 'load_year_partitions'); 'fileLocation' overrides the file location.
     """
-    strFileLocation = os.path.join(config['folders']['data-csv'], config['files-bom']['clean-csv'])
+    if yearRange is not None:
+        return load_year_partitions(config, 'bom-movie-gross', yearRange, chunkSize)
+    strFileLocation = fileLocation if len(fileLocation) > 0 else \
+                      os.path.join(config['folders']['data-csv'], config['files-bom']['clean-csv'])
     df = pd.read_csv(strFileLocation,encoding='utf-8',sep = ',',
-            header = 0, engine = 'python',quotechar= '"',quoting = 0,
-            dtype = {'title':str, 'year':np.uint16, 'domestic_gross':np.uint64,'foreign_gross':np.uint64})
+            header = 0, engine = 'c',quotechar= '"',quoting = 0,
+            dtype = {'title':str, 'year':np.uint16, 'domestic_gross':np.uint64,'foreign_gross':np.uint64},
+            chunksize = chunkSize)
     return df
 
-def load_clean_tn_movie_gross(config):
+def load_clean_tn_movie_gross(config, chunkSize=None, yearRange=None, fileLocation=''):
     """
     Load TN movie gross revenue file from project root folder.
     File location './data/clean.tn.budget_gross.csv'
+    'release_date' is parsed to datetime64; pandas has no day unit ('datetime64[D]'), so dates are whole-day timestamps.
+    With 'chunkSize' set, returns an iterator of DataFrames of up to 'chunkSize' rows.
+    With 'yearRange' (first year, last year) set, only the matching year partitions are read
+    (see 'load_year_partitions'); 'fileLocation' overrides the file location.
     """    
-    strFileLocation = os.path.join(config['folders']['data-csv'], config['files-tn']['clean-csv'])
+    if yearRange is not None:
+        return load_year_partitions(config, 'tn-movie-budgets', yearRange, chunkSize)
+    strFileLocation = fileLocation if len(fileLocation) > 0 else \
+                      os.path.join(config['folders']['data-csv'], config['files-tn']['clean-csv'])
     df = pd.read_csv(strFileLocation, encoding='utf-8', sep = ',',
-            header = 0, engine = 'python', quotechar= '"', quoting = 0,
-            dtype = {'release_year':np.uint16,'movie':str,'domestic_gross':np.uint64,'foreign_gross':np.uint64})
+            header = 0, engine = 'c', quotechar= '"', quoting = 0,
+            dtype = {'title':str,'year':np.uint16,'domestic_gross':np.uint64,'foreign_gross':np.uint64,
+                     'production_budget':np.uint64},
+            parse_dates = ['release_date'], date_format = '%Y-%m-%d',
+            chunksize = chunkSize)
     return df
 
-def combine_clean_bom_and_tn_revenue_data(config):
+def combine_clean_bom_and_tn_revenue_data(config, dfB=None, dfT=None):
     """
     Function combines clean BOM and TN datasets to generate a more comprehensive set of revenue data from both sources.
 
     Argument:
         'config': used for constants to file folders and file names
+        'dfB', 'dfT': optional clean BOM and TN DataFrames; loaded from the clean files when not given
+
+    (i) Titles are upper-cased and each source is reduced to one row per (title, year), keeping the
+        largest gross values of duplicate entries
+    (ii) BOM and TN rows are joined on (title, year); where both sources report a value the larger one is kept
+    (iii) 'production_budget' is only reported by TN; it is NaN for BOM-only rows and for a budget of 0 (unknown)
     
-    Post merge file:
+    Post merge file: one row per (title, year)
     --------------------
-    title year_bom domestic_gross_bom foreign_gross_bom year_tn domestic_gross_tn foreign_gross_tn
-    0 #Horror NaN NaN NaN 2015.0 0.0 0.0
-    1 '71 2015.0 1300000.0 355000.0 NaN	NaN	NaN
-    2 1,000 Times Good Night 2014.0 53900.0 0.0 NaN NaN NaN
+    title year domestic_gross foreign_gross revenue_source production_budget
+    0 #HORROR 2015 0 0 tn 1500000.0
+    1 '71 2015 1300000 355000 bom NaN
+    2 1,000 TIMES GOOD NIGHT 2014 53900 0 bom NaN
     --------------------
     """
 
     ### Load Clean Data from the Drive
-    dfB = load_clean_bom_movie_gross(config)
-    dfT = load_clean_tn_movie_gross(config)
-
-    ### Derive a combined list of titles with unique entries as a data frame
-    dfB.title = dfB.title.apply(str.upper)
-    dfT.title = dfT.title.apply(str.upper)
-    dfTitles = pd.concat([dfB.title, dfT.title], axis=0).reset_index()
-    dfTitles.drop(columns=['index'], inplace=True)
-    dfTitles.columns = ['title']
-    dfTitles.sort_values('title', inplace=True)
-    srUniqueTitles = dfTitles['title'].unique()
-    dfUniqueTitles = pd.DataFrame(srUniqueTitles,columns=['title'])
-
-    ### Merge dfUniqueTitles with data in dfT and dfB
-    dfMerged = pd.merge(dfUniqueTitles, dfB, how='left',on='title', suffixes=('_bomtn', '_bom'))
-    dfMerged = pd.merge(dfMerged, dfT, how='left', on = 'title', suffixes=('_bom','_tn'))
-
-    ### Apply row-level functions to choose values for columns 'year', 'domestic_gross', and 'foreign_gross'
-    dfMerged = dfMerged.apply(combine_clean_bom_and_tn_revenue_select_year, axis=1)
-    dfMerged = dfMerged.apply(combine_clean_bom_and_tn_revenue_select_domestic_gross, axis=1)
-    dfMerged = dfMerged.apply(combine_clean_bom_and_tn_revenue_select_foreign_gross, axis=1)
-
-    ### Remove invalid rows: any row with a NaN value; convert 'year', 'domestic_gross', and 'foreign_gross' to int
+    if dfB is None:
+        dfB = load_clean_bom_movie_gross(config)
+    if dfT is None:
+        dfT = load_clean_tn_movie_gross(config)
+
+    ### (i) One row per (title, year) in each source
+    lstKeys = ['title','year']
+    lstGross = ['domestic_gross','foreign_gross']
+    dfB = dfB.assign(title=dfB.title.apply(str.upper)).astype({'year':np.int64})
+    dfT = dfT.assign(title=dfT.title.apply(str.upper)).astype({'year':np.int64})
+    dfB = dfB.groupby(lstKeys, sort=False)[lstGross].max().reset_index()
+    dfT = dfT.groupby(lstKeys, sort=False)[lstGross + ['production_budget']].max().reset_index()
+
+    ### (ii) Join the sources on (title, year) and select gross values
+    dfMerged = pd.merge(dfB, dfT, how='outer', on=lstKeys, suffixes=('_bom','_tn'), indicator=True)
+    for col in lstGross:
+        dfMerged[col] = np.fmax(dfMerged[f'{col}_bom'].to_numpy(dtype=np.float64),
+                                dfMerged[f'{col}_tn'].to_numpy(dtype=np.float64))
+    dfMerged['revenue_source'] = dfMerged['_merge'].map({'left_only':'bom','right_only':'tn','both':'bom+tn'}).astype(str)
+    ### (iii) TN budget; 0 means unknown
+    arrBudget = dfMerged['production_budget'].to_numpy(dtype=np.float64)
+    dfMerged['production_budget'] = np.where(arrBudget > 0, arrBudget, np.nan)
+    dfMerged = dfMerged.loc[:, ['title','year','domestic_gross','foreign_gross','revenue_source','production_budget']]
+    dfMerged = dfMerged.sort_values(lstKeys, kind='stable').reset_index(drop=True)
+
+    ### convert 'year', 'domestic_gross', and 'foreign_gross' to int
     dfMerged = dfMerged.astype({'year':np.uint16,'domestic_gross':np.uint64,'foreign_gross':np.uint64})
 
     return dfMerged
 
-def combine_clean_bom_and_tn_revenue_select_year(row):
+def merge_title_and_revenue(df, dfRevenue, intYearWindow=1, blnReport=False):
     """
-    Select year from column values reprenting TN and BOM ('year_bom', 'year_tn')
+    Attach revenue to IMDB titles with one row per 'tconst'.
+
+    Arguments:
+        'df': titles with columns 'tconst', 'title' (CAPS), 'year', 'numvotes'
+        'dfRevenue': output of 'combine_clean_bom_and_tn_revenue_data' (one row per (title, year))
+        'intYearWindow': largest difference in years between a title and its revenue row
+                         (config['files-merge']['revenue-year-window'])
+        'blnReport': print the fan-out of a plain join on 'title'
+    (i) Fan-out detection: the number of rows a plain left join on 'title' would produce is computed
+        from the key counts, before anything is joined, and reported with the blowup factor
+    (ii) Each title is matched to the revenue row with the same title and the nearest release year
+         within 'intYearWindow' years; equal distances go to the earlier revenue year. A revenue row further
+         away is another film with the same title and is left to the fuzzy matching ('data_matching')
+    (iii) A revenue row matched by several titles (e.g. a remake with the same title and year) is kept
+          for the best title only: smallest year difference, then most votes, then lowest 'tconst'
+    Added columns:
+        'domestic_gross', 'foreign_gross', 'production_budget', 'revenue_source', 'revenue_year'
+        'revenue_candidates' -- number of revenue rows with the same title
+        'revenue_match' -- 'title_year' (same year), 'title_year_pm1' (year +-1),
+                           'title_year_window' (year within 'intYearWindow', more than 1 year apart),
+                           'ambiguous' (revenue row kept for another title), 'none' (no revenue row in the window)
+    Returns a DataFrame with the rows of 'df' in the same order, and the blowup factor.
     """
-    if np.isnan(row.year_bom) and np.isnan(row.year_tn):
-        row['year'] = np.nan
-    elif np.isnan(row.year_bom) and not np.isnan(row.year_tn):
-        row['year'] = row.year_tn
-    elif not np.isnan(row.year_bom) and np.isnan(row.year_tn):
-        row['year'] = row.year_bom
-    else:
-        if row.year_bom == row.year_tn:
-            row['year'] = row.year_bom
-        else:
-            row['year'] = row.year_bom
-    row = row.drop(labels=['year_bom','year_tn'])
-    return row
+    ### (i) Fan-out of a plain join on 'title'
+    arrCandidates = df['title'].map(dfRevenue['title'].value_counts()).fillna(0).to_numpy(dtype=np.int64)
+    intJoinRows = int(np.maximum(arrCandidates, 1).sum())
+    fltBlowup = intJoinRows / max(1, df.shape[0])
+    if blnReport:
+        print(f"Title join fan-out: {intJoinRows} rows for {df.shape[0]} titles (blowup factor {fltBlowup:.4f})")
+
+    ### (ii) Nearest revenue year per title: backward and forward as-of joins within each title
+    ### 'title' keys are kept as object on both sides so that an empty 'dfRevenue' still has matching key types
+    dfLeft = pd.DataFrame({'title': pd.Series(df['title'].to_numpy(), dtype=object), 'year': df['year'].to_numpy(dtype=np.int64),
+                           'row': np.arange(df.shape[0])}).sort_values('year', kind='stable')
+    dfRight = pd.DataFrame({'title': pd.Series(dfRevenue['title'].to_numpy(), dtype=object), 'revenue_year': dfRevenue['year'].to_numpy(dtype=np.int64),
+                            'revenue_row': np.arange(dfRevenue.shape[0])}).sort_values('revenue_year', kind='stable')
+    dfBack = pd.merge_asof(dfLeft, dfRight, left_on='year', right_on='revenue_year', by='title', direction='backward')
+    dfFwd  = pd.merge_asof(dfLeft, dfRight, left_on='year', right_on='revenue_year', by='title', direction='forward')
+    arrDiffBack = (dfBack['year'] - dfBack['revenue_year']).to_numpy(dtype=np.float64)
+    arrDiffFwd  = (dfFwd['revenue_year'] - dfFwd['year']).to_numpy(dtype=np.float64)
+    mskUseFwd = (np.isnan(arrDiffBack) & (np.isnan(arrDiffFwd)==False)) | (arrDiffFwd < arrDiffBack)
+    arrRevenueRow = np.where(mskUseFwd, dfFwd['revenue_row'], dfBack['revenue_row'])
+    arrYearDiff = np.where(mskUseFwd, arrDiffFwd, arrDiffBack)
+    ### back to the row order of 'df'
+    arrOrder = np.argsort(dfLeft['row'].to_numpy(), kind='stable')
+    arrRevenueRow = pd.Series(arrRevenueRow[arrOrder]).fillna(-1).to_numpy(dtype=np.int64)
+    arrYearDiff = arrYearDiff[arrOrder]
+    ### same title, but released more than 'intYearWindow' years apart: no match
+    arrRevenueRow[arrYearDiff > intYearWindow] = -1
+
+    ### (iii) One title per revenue row
+    dfRank = pd.DataFrame({'revenue_row': arrRevenueRow, 'year_diff': arrYearDiff,
+                           'numvotes': df['numvotes'].to_numpy(dtype=np.float64), 'tconst': df['tconst'].to_numpy()})
+    dfRank = dfRank.loc[dfRank['revenue_row'] >= 0]
+    dfRank = dfRank.sort_values(['revenue_row','year_diff','numvotes','tconst'], ascending=[True,True,False,True],
+                                na_position='last', kind='stable')
+    arrLosers = dfRank.index[dfRank['revenue_row'].duplicated(keep='first')].to_numpy()
+    mskAmbiguous = np.zeros(df.shape[0], dtype=bool)
+    mskAmbiguous[arrLosers] = True
+    arrRevenueRow[mskAmbiguous] = -1
+
+    ### Attach revenue columns and match quality
+    mskMatched = (arrRevenueRow >= 0)
+    df = df.reset_index(drop=True)
+    for col in ['domestic_gross','foreign_gross','production_budget']:
+        arrValues = np.full(df.shape[0], np.nan)
+        arrValues[mskMatched] = dfRevenue[col].to_numpy(dtype=np.float64)[arrRevenueRow[mskMatched]]
+        df[col] = arrValues
+    arrSource = np.full(df.shape[0], np.nan, dtype=object)
+    arrSource[mskMatched] = dfRevenue['revenue_source'].to_numpy(dtype=object)[arrRevenueRow[mskMatched]]
+    df['revenue_source'] = arrSource
+    arrRevenueYear = np.full(df.shape[0], np.nan)
+    arrRevenueYear[mskMatched] = dfRevenue['year'].to_numpy(dtype=np.float64)[arrRevenueRow[mskMatched]]
+    df['revenue_year'] = arrRevenueYear
+    df['revenue_candidates'] = arrCandidates.astype(np.uint16)
+    arrMatch = np.select([mskAmbiguous, mskMatched & (arrYearDiff == 0), mskMatched & (arrYearDiff == 1), mskMatched],
+                         ['ambiguous', 'title_year', 'title_year_pm1', 'title_year_window'], default='none')
+    df['revenue_match'] = arrMatch
+
+    return df, fltBlowup
+
+
+def join_titles_and_ratings(dfTitles, dfRating):
+    """
+    Left join of clean IMDB titles and ratings on 'tconst'; titles are upper-cased for the revenue join
+    """
+    df = pd.merge(dfTitles, dfRating, how='left', on='tconst')
+    df['title'] = df['title'].apply(str.upper)
+    return df
 
-def combine_clean_bom_and_tn_revenue_select_domestic_gross(row):
+async def load_clean_sources_async(config, executor=None):
     """
-    Select domestic gross value from column values reprenting TN and BOM ('domestic_gross_bom', 'domestic_gross_tn')
+    Coroutine which reads the four clean files concurrently in 'executor' (default: the event loop's
+    thread pool) and runs each join as soon as its inputs are ready:
+        titles + ratings -> 'join_titles_and_ratings'
+        BOM + TN         -> 'combine_clean_bom_and_tn_revenue_data'
+    Returns the tuple (titles with ratings, combined revenue).
     """
-    if np.isnan(row.domestic_gross_bom) and np.isnan(row.domestic_gross_tn):
-        row['domestic_gross'] = np.nan
-    elif np.isnan(row.domestic_gross_bom) and not np.isnan(row.domestic_gross_tn):
-        row['domestic_gross'] = row.domestic_gross_tn
-    elif not np.isnan(row.domestic_gross_bom) and np.isnan(row.domestic_gross_tn):
-        row['domestic_gross'] = row.domestic_gross_bom
-    else:
-        row['domestic_gross'] = max(row.domestic_gross_bom,row.domestic_gross_tn)
-    row = row.drop(labels=['domestic_gross_bom','domestic_gross_tn'])
-    return row
+    loop = asyncio.get_running_loop()
+    futTitles = loop.run_in_executor(executor, load_clean_imdb_title_basics, config)
+    futRating = loop.run_in_executor(executor, load_clean_imdb_title_ratings, config)
+    futB = loop.run_in_executor(executor, load_clean_bom_movie_gross, config)
+    futT = loop.run_in_executor(executor, load_clean_tn_movie_gross, config)
+
+    async def join_titles():
+        dfTitles, dfRating = await asyncio.gather(futTitles, futRating)
+        return await loop.run_in_executor(executor, join_titles_and_ratings, dfTitles, dfRating)
+
+    async def combine_revenue():
+        dfB, dfT = await asyncio.gather(futB, futT)
+        return await loop.run_in_executor(executor, combine_clean_bom_and_tn_revenue_data, config, dfB, dfT)
+
+    df, dfRevenue = await asyncio.gather(join_titles(), combine_revenue())
+    return df, dfRevenue
 
-def combine_clean_bom_and_tn_revenue_select_foreign_gross(row):
+def load_clean_sources_concurrently(config):
     """
-    Select foreign gross value from column values reprenting TN and BOM ('foreign_gross_bom', 'foreign_gross_tn')
+    Synchronous entry point to 'load_clean_sources_async'. Uses a thread pool with one thread per clean file.
+    Inside a running event loop (e.g. a Jupyter notebook) the coroutine runs on its own loop in a helper thread.
+    Returns the tuple (titles with ratings, combined revenue).
     """
-    if np.isnan(row.foreign_gross_bom) and np.isnan(row.foreign_gross_tn):
-        row['foreign_gross'] = np.nan
-    elif np.isnan(row.foreign_gross_bom) and not np.isnan(row.foreign_gross_tn):
-        row['foreign_gross'] = row.foreign_gross_tn
-    elif not np.isnan(row.foreign_gross_bom) and np.isnan(row.foreign_gross_tn):
-        row['foreign_gross'] = row.foreign_gross_bom
-    else:
-        row['foreign_gross'] = max(row.foreign_gross_bom,row.foreign_gross_tn)
-    row = row.drop(labels=['foreign_gross_bom','foreign_gross_tn'])
-    return row    
+    async def run_with_executor():
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+            return await load_clean_sources_async(config, executor)
 
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(run_with_executor())
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executorLoop:
+        return executorLoop.submit(asyncio.run, run_with_executor()).result()
 
-def merge_clean_data(config):
+def clean_sources_footprint(config):
+    """
+    Estimated in-memory size of the four clean files joined by 'merge_clean_data' (see 'estimate_csv_footprint');
+    'rows' and 'bytes' are summed, 'bytes_per_row' is their ratio
+    """
+    lstFiles = [config['files-imdb']['csv']['clean-title-base'], config['files-imdb']['csv']['clean-title-rate'],
+                config['files-bom']['clean-csv'], config['files-tn']['clean-csv']]
+    dctFootprint = {'rows': 0, 'bytes_per_row': 0.0, 'bytes': 0}
+    for strFile in lstFiles:
+        dctFile = estimate_csv_footprint(os.path.join(config['folders']['data-csv'], strFile),
+                                         config['memory-budget']['sample-rows'], encoding='utf-8')
+        dctFootprint['rows'] += dctFile['rows']
+        dctFootprint['bytes'] += dctFile['bytes']
+    dctFootprint['bytes_per_row'] = dctFootprint['bytes'] / max(1, dctFootprint['rows'])
+    return dctFootprint
+
+def merge_clean_data(config, writeNpyStore=None, outOfCore=None, writeCube=None, writeSketches=None, blnReport=False):
     """
     This file loads all clean data into DataFrames using utility functions and 
-    merges them into working dataset using pandas merge utility
+    merges them into working dataset using pandas merge utility.
+    Revenue is attached with 'merge_title_and_revenue' (one row per 'tconst') within
+    config['files-merge']['revenue-year-window'] years.
+    If 'writeNpyStore' is True (default: config['files-merge']['write-npy-store']) the merged data set
+    is also written as a NumPy column store, see 'write_merged_npy_store'.
+    If 'outOfCore' is True (default: config['files-merge']['out-of-core']) the inputs are joined bucket by
+    bucket on disk with bounded memory, see 'merge_clean_data_out_of_core'; the merged file is the same.
+    If 'outOfCore' is 'auto' the merge runs out of core when the clean files do not fit the memory budget
+    (see 'clean_sources_footprint' and 'plan_execution'), with the planned number of buckets and chunk rows.
+    If 'writeCube' is True (default: config['files-merge']['write-aggregate-cube']) the aggregate cube used by
+    the charts is also written, see 'aggregate_cube_cells' and 'write_aggregate_cube'.
+    If 'writeSketches' is True (default: config['files-merge']['write-sketches']) quantile and distinct-count
+    sketches per genre and year are also written, see 'data_sketch.update_group_sketches'.
+    If config['year-partitions']['enabled'] is True the merged file is also split into year partitions.
+    If 'blnReport' is True the execution plan and the fan-out of the title join are printed.
     """
-    ### dfTitles: columns 'tconst', 'title', 'year', 'runtime_minutes', 'genres'
-    ### dfRating: colums 'tconst','rating','numvotes'
-    ### dfRevenue: columns 'title' (CAPS), 'year','domestic_gross', 'foreign_gross'
-    dfTitles = load_clean_imdb_title_basics(config)
-    dfRating = load_clean_imdb_title_ratings(config)
-    dfRevenue = combine_clean_bom_and_tn_revenue_data(config)
-    dfRevenue = dfRevenue.drop(columns=['year'])
+    if writeNpyStore is None:
+        writeNpyStore = config['files-merge']['write-npy-store']
+    if outOfCore is None:
+        outOfCore = config['files-merge']['out-of-core']
+    if writeCube is None:
+        writeCube = config['files-merge']['write-aggregate-cube']
+    if writeSketches is None:
+        writeSketches = config['files-merge']['write-sketches']
+    if outOfCore == 'auto':
+        dctPlan = plan_execution(config, 'merge', clean_sources_footprint(config), blnReport=blnReport)
+        outOfCore = (dctPlan['mode'] == 'out-of-core')
+        if outOfCore:
+            ### planned buckets and chunks, but never coarser than configured
+            config = dict(config)
+            config['files-merge'] = dict(config['files-merge'])
+            config['files-merge']['out-of-core-buckets'] = max(dctPlan['buckets'], config['files-merge']['out-of-core-buckets'])
+            config['files-merge']['out-of-core-chunk-rows'] = min(dctPlan['chunk_rows'], config['files-merge']['out-of-core-chunk-rows'])
+    if outOfCore:
+        if writeNpyStore:
+            raise ValueError('The NumPy column store needs the merged data set in memory; it cannot be written in out-of-core mode')
+        ### cube cells are aggregated from the frames streamed to the merged file
+        lstCubeCells = list() if writeCube else None
+        dctSketches = data_sketch.new_group_sketches() if writeSketches else None
+        ### buckets are kept next to the clean files and removed when the merge is done
+        with tempfile.TemporaryDirectory(prefix='merge.buckets.', dir=config['folders']['data-csv']) as strTempFolder:
+            merge_clean_data_out_of_core(config, strTempFolder, lstCubeCells, dctSketches, blnReport=blnReport)
+        if writeCube:
+            write_aggregate_cube(config, lstCubeCells)
+        if writeSketches:
+            data_sketch.write_group_sketches(config, dctSketches)
+        if config['year-partitions']['enabled']:
+            partition_clean_file_by_year(config, 'merged')
+        return None
+
+    ### df: title and rating data, columns 'tconst', 'title' (CAPS), 'year', 'runtime_minutes', 'genres',
+    ###     'rating', 'numvotes'
+    ### dfRevenue: columns 'title' (CAPS), 'year','domestic_gross', 'foreign_gross', 'revenue_source', 'production_budget'
+    ### All clean files are read concurrently, see 'load_clean_sources_concurrently'
+    df, dfRevenue = load_clean_sources_concurrently(config)
 
     ### Merge title, rating, and revenue data
-    df = pd.merge(dfTitles, dfRating, how='left', on='tconst')
-    df['title'] = df['title'].apply(str.upper)
-    df = pd.merge(df, dfRevenue, how='left', on='title')
+    df, fltBlowup = merge_title_and_revenue(df, dfRevenue, config['files-merge']['revenue-year-window'], blnReport=blnReport)
+
+    ### Materialize derived columns used by the charts
+    df = add_merged_derived_columns(config, df)
     
     ### write out merged data set
-    strFilePath = os.path.join(config['folders']['data-csv'], config['files-merge']['clean-csv'])
-    df.to_csv(strFilePath,encoding='utf-8',index=False,quotechar='"', quoting=csv.QUOTE_MINIMAL)
+    write_merged_clean_data(config, df)
+    if writeNpyStore:
+        write_merged_npy_store(config, df)
+    if writeCube:
+        write_aggregate_cube(config, [aggregate_cube_cells(df, config['rating-numvotes-pertitle-min'])])
+    if writeSketches:
+        data_sketch.write_group_sketches(config, data_sketch.update_group_sketches(config, data_sketch.new_group_sketches(), df))
+    if config['year-partitions']['enabled']:
+        partition_clean_file_by_year(config, 'merged')
     return None
 
-def load_merged_clean_data(config):
+### Derived columns materialized by 'merge_clean_data' and their data types
+dctMergedDerivedColDataTypes = {'worldwide_gross':np.float64,'rating_times_numvotes':np.float64,
+                                'ratingsqrd_times_numvotes':np.float64,'profit':np.float64,'roi':np.float64,
+                                'profit_margin':np.float64,'valid_flags':np.uint8}
+
+### Column data types of the merged data set "clean.merge.title.rating.revenue.csv"
+dctMergedColDataTypes = {'tconst':str,'title':str,'year':np.uint16,'runtime_minutes':np.uint16,'genres':str,
+                         'rating':np.float16,'numvotes':np.float32,'domestic_gross':np.float64,'foreign_gross':np.float64,
+                         'production_budget':np.float64,'revenue_source':str,'revenue_year':np.float32,
+                         'revenue_candidates':np.uint16,'revenue_match':str}
+dctMergedColDataTypes.update(dctMergedDerivedColDataTypes)
+
+### Bits of column 'valid_flags': a bit is set when the row passes the corresponding validity check
+### 'domestic_gross', 'foreign_gross', 'worldwide_gross' -- value is not NaN
+### 'worldwide_gross_positive' -- worldwide gross is not NaN and above 0
+### 'rating' -- rating and numvotes are not NaN; the vote threshold config['rating-numvotes-pertitle-min'] is not
+###             part of the bit, it is applied when the data is loaded (see 'rating_numvotes_filter')
+### 'production_budget' -- budget is known (not NaN, above 0), so 'profit' and 'roi' are not NaN
+dctValidFlagBits = {'domestic_gross':1,'foreign_gross':2,'worldwide_gross':4,
+                    'worldwide_gross_positive':8,'rating':16,'production_budget':32}
+
+def add_merged_derived_columns(config, df):
+    """
+    Add the derived columns listed in 'dctMergedDerivedColDataTypes' to the merged data set:
+        'worldwide_gross' -- domestic_gross + foreign_gross (NaN only if both are NaN)
+        'rating_times_numvotes', 'ratingsqrd_times_numvotes' -- terms of the vote-weighted rating mean/stdev
+        'profit' -- worldwide_gross - production_budget
+        'roi' -- return on investment, profit / production_budget
+        'profit_margin' -- profit / worldwide_gross (NaN if the worldwide gross is 0)
+        'valid_flags' -- validity bitmask, see 'dctValidFlagBits'
+    'profit' and 'roi' are NaN where the budget or the worldwide gross is unknown.
+    """
+    df['worldwide_gross'] = df['domestic_gross'].add(df['foreign_gross'], fill_value=0)
+    df['rating_times_numvotes'] = df['rating'].mul(df['numvotes'])
+    df['ratingsqrd_times_numvotes'] = df['rating'].mul(df['rating']).mul(df['numvotes'])
+
+    arrGross = df['worldwide_gross'].to_numpy(dtype=np.float64)
+    arrBudget = df['production_budget'].to_numpy(dtype=np.float64)
+    arrProfit = arrGross - arrBudget
+    with np.errstate(invalid='ignore', divide='ignore'):
+        df['profit'] = arrProfit
+        df['roi'] = arrProfit / arrBudget
+        df['profit_margin'] = np.where(arrGross > 0, arrProfit / arrGross, np.nan)
+
+    arrFlags = np.zeros(df.shape[0], dtype=np.uint8)
+    arrFlags |= np.where(df['domestic_gross'].notna(), dctValidFlagBits['domestic_gross'], 0).astype(np.uint8)
+    arrFlags |= np.where(df['foreign_gross'].notna(), dctValidFlagBits['foreign_gross'], 0).astype(np.uint8)
+    arrFlags |= np.where(df['worldwide_gross'].notna(), dctValidFlagBits['worldwide_gross'], 0).astype(np.uint8)
+    arrFlags |= np.where(df['worldwide_gross'] > 0, dctValidFlagBits['worldwide_gross_positive'], 0).astype(np.uint8)
+    mskValidRating = ( df['rating'].notna() & df['numvotes'].notna() )
+    arrFlags |= np.where(mskValidRating, dctValidFlagBits['rating'], 0).astype(np.uint8)
+    arrFlags |= np.where(arrBudget > 0, dctValidFlagBits['production_budget'], 0).astype(np.uint8)
+    df['valid_flags'] = arrFlags
+
+    return df
+
+def valid_flags_filter(*lstFlagNames):
+    """
+    Returns a 'select' filter which keeps rows with all validity bits 'lstFlagNames' set.
+    Example: select(config, ['genres','worldwide_gross'], [valid_flags_filter('worldwide_gross_positive')])
+    """
+    intBits = 0
+    for strFlagName in lstFlagNames:
+        intBits |= dctValidFlagBits[strFlagName]
+    return ('valid_flags', 'allbits', intBits)
+
+def rating_numvotes_filter(config):
+    """
+    Returns a 'select' filter which keeps titles with at least config['rating-numvotes-pertitle-min'] votes.
+    Used with the 'rating' validity bit, so that the vote threshold is read from config when the data is loaded.
+    Example: select(config, ['genres','rating'], [valid_flags_filter('rating'), rating_numvotes_filter(config)])
+    """
+    return ('numvotes', '>=', config['rating-numvotes-pertitle-min'])
+
+def write_merged_clean_data(config, df):
+    """
+    Write the merged data set in row groups of config['files-merge']['row-group-size'] rows.
+    The CSV file is identical to a single 'df.to_csv' call; in addition a row-group index
+    (config['files-merge']['clean-index']) records for every row group its byte offset and length,
+    the number of rows, the number of nulls per column and min/max of the numeric columns.
+    Function 'select' uses the index to skip row groups which cannot satisfy its filters and
+    to parse only the requested columns.
+    """
+    intRowGroupSize = config['files-merge']['row-group-size']
+    ### at least one (possibly empty) frame, so that the header is always written
+    iterFrames = (df.iloc[intStart:intStart+intRowGroupSize] for intStart in range(0, max(1, df.shape[0]), intRowGroupSize))
+    write_merged_clean_data_frames(config, iterFrames)
+    return None
+
+def write_merged_clean_data_frames(config, iterFrames):
+    """
+    Streaming version of 'write_merged_clean_data': 'iterFrames' yields consecutive parts of the
+    merged data set (any number of rows, same columns and data types). Parts are re-cut into row
+    groups of config['files-merge']['row-group-size'] rows, so the CSV file and the row-group index
+    do not depend on how the data set was split. Returns the number of rows written.
+    """
+    strFilePath  = os.path.join(config['folders']['data-csv'], config['files-merge']['clean-csv'])
+    strIndexPath = os.path.join(config['folders']['data-csv'], config['files-merge']['clean-index'])
+    intRowGroupSize = config['files-merge']['row-group-size']
+
+    lstRowGroups = list()
+    lstColumns = list()
+
+    def write_row_group(fileCSV, dfGroup):
+        bytesGroup = dfGroup.to_csv(index=False,header=False,quotechar='"',quoting=csv.QUOTE_MINIMAL).encode('utf-8')
+        dctStats = dict()
+        for col in dfGroup.columns:
+            dctColStats = {'nulls': int(dfGroup[col].isnull().sum())}
+            if pd.api.types.is_numeric_dtype(dfGroup[col]) and dctColStats['nulls'] < dfGroup.shape[0]:
+                dctColStats['min'] = float(dfGroup[col].min())
+                dctColStats['max'] = float(dfGroup[col].max())
+            dctStats[col] = dctColStats
+        lstRowGroups.append({'offset': fileCSV.tell(), 'length': len(bytesGroup),
+                             'rows': int(dfGroup.shape[0]), 'stats': dctStats})
+        fileCSV.write(bytesGroup)
+
+    with open(strFilePath, mode='wb') as fileCSV:
+        lstPending = list()
+        intPending = 0
+        for df in iterFrames:
+            if len(lstColumns) == 0:
+                fileCSV.write(df.iloc[:0].to_csv(index=False,quotechar='"',quoting=csv.QUOTE_MINIMAL).encode('utf-8'))
+                lstColumns = df.columns.to_list()
+            if df.shape[0] == 0:
+                continue
+            lstPending.append(df)
+            intPending += df.shape[0]
+            while intPending >= intRowGroupSize:
+                dfPending = lstPending[0] if len(lstPending) == 1 else pd.concat(lstPending, axis=0)
+                write_row_group(fileCSV, dfPending.iloc[:intRowGroupSize])
+                lstPending = [dfPending.iloc[intRowGroupSize:]]
+                intPending -= intRowGroupSize
+        if intPending > 0:
+            write_row_group(fileCSV, pd.concat(lstPending, axis=0))
+
+    dctIndex = {'columns': lstColumns, 'row-groups': lstRowGroups}
+    with open(strIndexPath, mode='w', encoding='utf-8') as fileIndex:
+        json.dump(dctIndex, fileIndex)
+    return sum([dctRowGroup['rows'] for dctRowGroup in lstRowGroups])
+
+def hash_partition_codes(srKeys, intNumBuckets):
+    """
+    Bucket number (0 .. intNumBuckets-1) of every key; the same key always goes to the same bucket
+    """
+    return (pd.util.hash_pandas_object(srKeys, index=False).to_numpy() % np.uint64(intNumBuckets)).astype(np.int64)
+
+def append_frame_to_buckets(df, arrBuckets, strFolder, strName):
+    """
+    Append the rows of 'df' to the on-disk buckets '<strFolder>/<strName>.<bucket>.pkl'.
+    A bucket file is a sequence of pickled DataFrames, read back by 'read_bucket_frames'.
+    """
+    for (intBucket, dfPart) in df.groupby(arrBuckets, sort=False):
+        with open(os.path.join(strFolder, f'{strName}.{intBucket}.pkl'), mode='ab') as fileBucket:
+            pickle.dump(dfPart, fileBucket, protocol=pickle.HIGHEST_PROTOCOL)
+    return None
+
+def read_bucket_frames(strFolder, strName, intBucket):
+    """
+    Generator of the DataFrames appended to bucket 'intBucket' by 'append_frame_to_buckets'
+    """
+    strFilePath = os.path.join(strFolder, f'{strName}.{intBucket}.pkl')
+    if not os.path.exists(strFilePath):
+        return
+    with open(strFilePath, mode='rb') as fileBucket:
+        while True:
+            try:
+                yield pickle.load(fileBucket)
+            except EOFError:
+                return
+
+def load_bucket(strFolder, strName, intBucket, dfEmpty):
+    """
+    Load a whole bucket into one DataFrame; 'dfEmpty' (no rows, expected columns) is returned for an empty bucket
+    """
+    lstFrames = list(read_bucket_frames(strFolder, strName, intBucket))
+    if len(lstFrames) == 0:
+        return dfEmpty
+    return pd.concat(lstFrames, axis=0, ignore_index=True)
+
+def merge_runs_by_row_number(strFolder, intNumBuckets, intNumRows, intWindowRows):
+    """
+    Stream the sorted bucket runs 'run.<bucket>.pkl' (column '_row' ascending within a run) back in
+    the original row order. Rows are collected in windows of 'intWindowRows' original row numbers:
+    every run contributes its next rows below the end of the window, so at most one part of each
+    run is held in memory. Yields DataFrames without column '_row'.
+    """
+    lstIters = [read_bucket_frames(strFolder, 'run', intBucket) for intBucket in range(intNumBuckets)]
+    lstBuffers = [next(iterRun, None) for iterRun in lstIters]
+    for intEnd in range(intWindowRows, intNumRows + intWindowRows, intWindowRows):
+        lstPieces = list()
+        for i in range(intNumBuckets):
+            df = lstBuffers[i]
+            while df is not None:
+                intTake = int(np.searchsorted(df['_row'].to_numpy(), intEnd, side='left'))
+                if intTake > 0:
+                    lstPieces.append(df.iloc[:intTake])
+                if intTake < df.shape[0]:
+                    break
+                df = next(lstIters[i], None)
+            lstBuffers[i] = None if df is None else df.iloc[intTake:]
+        if len(lstPieces) > 0:
+            dfWindow = pd.concat(lstPieces, axis=0).sort_values('_row', kind='stable')
+            yield dfWindow.drop(columns='_row')
+
+def merge_clean_data_out_of_core(config, strTempFolder, lstCubeCells=None, dctSketches=None, blnReport=False):
+    """
+    Out-of-core version of the merge in 'merge_clean_data': a partitioned hash join which holds only
+    one bucket of every input in memory. Buckets are written to 'strTempFolder'.
+    Uses config['files-merge'] keys 'out-of-core-buckets' and 'out-of-core-chunk-rows'.
+
+    (i) Titles and ratings are read in chunks and hash-partitioned on 'tconst'; every title keeps its
+        row number '_row' in the clean titles file
+    (ii) Per 'tconst' bucket titles and ratings are joined ('join_titles_and_ratings') and the result is
+         re-partitioned on the upper-case title; BOM and TN are read in chunks and partitioned the same way
+    (iii) Per title bucket revenue is combined ('combine_clean_bom_and_tn_revenue_data'), attached
+          ('merge_title_and_revenue') and the derived columns added. Both functions only relate rows
+          with the same title, so a title bucket gives the same rows as the whole data set.
+          The bucket is sorted by '_row' and written as a run
+    (iv) The runs are merged back in the original row order and streamed to the merged file
+         ('write_merged_clean_data_frames')
+    The merged file is byte-identical to the in-memory path. Returns the number of rows written.
+    If 'lstCubeCells' is a list, the aggregate cube cells of every streamed frame are appended to it
+    (see 'aggregate_cube_cells'); if 'dctSketches' is a dictionary, the group sketches are updated with every
+    streamed frame (see 'data_sketch.update_group_sketches').
+    If 'blnReport' is True the fan-out of the title join over all buckets is printed.
+    """
+    intNumBuckets = config['files-merge']['out-of-core-buckets']
+    intChunkRows = config['files-merge']['out-of-core-chunk-rows']
+
+    ### (i) Partition titles and ratings on 'tconst'
+    intNumTitles = 0
+    dfTitlesEmpty = None
+    for dfChunk in load_clean_imdb_title_basics(config, chunkSize=intChunkRows):
+        dfChunk.insert(0, '_row', np.arange(intNumTitles, intNumTitles + dfChunk.shape[0], dtype=np.int64))
+        intNumTitles += dfChunk.shape[0]
+        dfTitlesEmpty = dfChunk.iloc[:0]
+        append_frame_to_buckets(dfChunk, hash_partition_codes(dfChunk['tconst'], intNumBuckets), strTempFolder, 'titles')
+    dfRatingEmpty = None
+    for dfChunk in load_clean_imdb_title_ratings(config, chunkSize=intChunkRows):
+        dfRatingEmpty = dfChunk.iloc[:0]
+        append_frame_to_buckets(dfChunk, hash_partition_codes(dfChunk['tconst'], intNumBuckets), strTempFolder, 'ratings')
+
+    ### (ii) Join titles and ratings per 'tconst' bucket; re-partition on title
+    ### Data types of the joined buckets are combined as 'pd.concat' would (e.g. 'numvotes' becomes
+    ### float64 if any bucket has a title without rating), as in the in-memory join
+    lstSchemas = list()
+    for intBucket in range(intNumBuckets):
+        dfTitles = load_bucket(strTempFolder, 'titles', intBucket, dfTitlesEmpty)
+        if dfTitles.shape[0] == 0:
+            continue
+        dfRating = load_bucket(strTempFolder, 'ratings', intBucket, dfRatingEmpty)
+        df = join_titles_and_ratings(dfTitles, dfRating)
+        lstSchemas.append(df.iloc[:0])
+        append_frame_to_buckets(df, hash_partition_codes(df['title'], intNumBuckets), strTempFolder, 'joined')
+        del dfTitles, dfRating, df
+    if len(lstSchemas) == 0:
+        return 0
+    dctJoinedDataTypes = pd.concat(lstSchemas, axis=0).dtypes.to_dict()
+
+    dctRevenueEmpty = dict()
+    for (strName, funcLoad) in [('bom', load_clean_bom_movie_gross), ('tn', load_clean_tn_movie_gross)]:
+        for dfChunk in funcLoad(config, chunkSize=intChunkRows):
+            dctRevenueEmpty[strName] = dfChunk.iloc[:0]
+            arrBuckets = hash_partition_codes(dfChunk['title'].apply(str.upper), intNumBuckets)
+            append_frame_to_buckets(dfChunk, arrBuckets, strTempFolder, strName)
+
+    ### (iii) Revenue join per title bucket, written as runs sorted by '_row'
+    intJoinRows = 0
+    for intBucket in range(intNumBuckets):
+        df = load_bucket(strTempFolder, 'joined', intBucket, None)
+        if df is None:
+            continue
+        df = df.astype(dctJoinedDataTypes)
+        dfB = load_bucket(strTempFolder, 'bom', intBucket, dctRevenueEmpty['bom'])
+        dfT = load_bucket(strTempFolder, 'tn', intBucket, dctRevenueEmpty['tn'])
+        dfRevenue = combine_clean_bom_and_tn_revenue_data(config, dfB, dfT)
+        df, fltBlowup = merge_title_and_revenue(df, dfRevenue, config['files-merge']['revenue-year-window'])
+        intJoinRows += int(round(fltBlowup * df.shape[0]))
+        df = add_merged_derived_columns(config, df)
+        df = df.sort_values('_row', kind='stable')
+        for intStart in range(0, df.shape[0], intChunkRows):
+            with open(os.path.join(strTempFolder, f'run.{intBucket}.pkl'), mode='ab') as fileRun:
+                pickle.dump(df.iloc[intStart:intStart+intChunkRows], fileRun, protocol=pickle.HIGHEST_PROTOCOL)
+        del df, dfB, dfT, dfRevenue
+    if blnReport:
+        print(f"Title join fan-out: {intJoinRows} rows for {intNumTitles} titles (blowup factor {intJoinRows/max(1, intNumTitles):.4f})")
+
+    ### (iv) Stream the runs to the merged file in the original row order
+    iterFrames = merge_runs_by_row_number(strTempFolder, intNumBuckets, intNumTitles, intChunkRows)
+    if lstCubeCells is not None or dctSketches is not None:
+        def aggregate_streamed_frames(iterMerged):
+            for df in iterMerged:
+                if lstCubeCells is not None:
+                    lstCubeCells.append(aggregate_cube_cells(df, config['rating-numvotes-pertitle-min']))
+                if dctSketches is not None:
+                    data_sketch.update_group_sketches(config, dctSketches, df)
+                yield df
+        iterFrames = aggregate_streamed_frames(iterFrames)
+    return write_merged_clean_data_frames(config, iterFrames)
+
+### Data types of the merged data set columns in the NumPy column store; string columns are
+### stored as an offsets + bytes buffer. Columns with NaN values keep a floating point type.
+dctMergedNpyDataTypes = {'year':np.uint16,'runtime_minutes':np.uint16,'rating':np.float32,'numvotes':np.float32,
+                         'domestic_gross':np.float64,'foreign_gross':np.float64,'production_budget':np.float64,
+                         'revenue_year':np.float32,'revenue_candidates':np.uint16,'worldwide_gross':np.float64,
+                         'rating_times_numvotes':np.float64,'ratingsqrd_times_numvotes':np.float64,
+                         'profit':np.float64,'roi':np.float64,'profit_margin':np.float64,'valid_flags':np.uint8}
+
+def write_merged_npy_store(config, df):
+    """
+    Write the merged data set as a NumPy column store in folder config['files-merge']['npy-dir']:
+        '<col>.npy' -- numeric columns with the types of 'dctMergedNpyDataTypes'
+        '<col>.offsets.npy', '<col>.bytes.npy' -- string columns: UTF-8 bytes of all values
+                         concatenated, value i is bytes[offsets[i]:offsets[i+1]]
+        '<col>.nulls.npy' -- boolean null mask of a string column with missing values
+        'manifest.json' -- number of rows, column order, column kinds, data types and the fingerprint of the
+                           merged file the store was written from ('source', see 'utils.file_fingerprint')
+    The merged file must be written first.
+    """
+    strFolder = os.path.join(config['folders']['data-csv'], config['files-merge']['npy-dir'])
+    strMergedPath = os.path.join(config['folders']['data-csv'], config['files-merge']['clean-csv'])
+    os.makedirs(strFolder, exist_ok=True)
+    dctManifest = {'rows': int(df.shape[0]), 'columns': df.columns.to_list(), 'numeric': dict(), 'string': list(),
+                   'source': utils.file_fingerprint(strMergedPath)}
+    for col in df.columns:
+        if col in dctMergedNpyDataTypes:
+            arrValues = df[col].to_numpy(dtype=dctMergedNpyDataTypes[col])
+            np.save(os.path.join(strFolder, f'{col}.npy'), arrValues)
+            dctManifest['numeric'][col] = arrValues.dtype.str
+        else:
+            mskNull = df[col].isnull().to_numpy()
+            lstBytes = [b'' if blnNull else str(val).encode('utf-8') for (val, blnNull) in zip(df[col].to_numpy(), mskNull)]
+            arrOffsets = np.zeros(len(lstBytes)+1, dtype=np.int64)
+            np.cumsum([len(val) for val in lstBytes], out=arrOffsets[1:])
+            np.save(os.path.join(strFolder, f'{col}.offsets.npy'), arrOffsets)
+            np.save(os.path.join(strFolder, f'{col}.bytes.npy'), np.frombuffer(b''.join(lstBytes), dtype=np.uint8))
+            strNullsFile = os.path.join(strFolder, f'{col}.nulls.npy')
+            if mskNull.any():
+                np.save(strNullsFile, mskNull)
+            elif os.path.exists(strNullsFile):
+                os.remove(strNullsFile)
+            dctManifest['string'].append(col)
+    with open(os.path.join(strFolder, 'manifest.json'), mode='w', encoding='utf-8') as fileManifest:
+        json.dump(dctManifest, fileManifest)
+    return None
+
+def load_merged_npy_store(config, columns=None):
+    """
+    Load the NumPy column store written by 'write_merged_npy_store'.
+    Numeric columns are memory-mapped read-only ('np.load(mmap_mode='r')') and wrapped without a copy,
+    so processes loading the same store share one page-cached copy. String columns are decoded
+    from their byte buffers; request only the needed 'columns' to skip decoding the others.
+    Raises ValueError if the store was not written from the current merged file (see 'utils.file_fingerprint_matches').
+    """
+    strFolder = os.path.join(config['folders']['data-csv'], config['files-merge']['npy-dir'])
+    strMergedPath = os.path.join(config['folders']['data-csv'], config['files-merge']['clean-csv'])
+    with open(os.path.join(strFolder, 'manifest.json'), mode='r', encoding='utf-8') as fileManifest:
+        dctManifest = json.load(fileManifest)
+    if not utils.file_fingerprint_matches(dctManifest.get('source'), strMergedPath):
+        raise ValueError(f'The NumPy column store {strFolder} was not written from the current merged file {strMergedPath}; '
+                         f'run merge_clean_data(config, writeNpyStore=True)')
+    if columns is None:
+        columns = dctManifest['columns']
+
+    dctColumns = dict()
+    for col in columns:
+        if col in dctManifest['numeric']:
+            dctColumns[col] = np.load(os.path.join(strFolder, f'{col}.npy'), mmap_mode='r')
+        elif col in dctManifest['string']:
+            arrOffsets = np.load(os.path.join(strFolder, f'{col}.offsets.npy'), mmap_mode='r')
+            bytesValues = np.load(os.path.join(strFolder, f'{col}.bytes.npy'), mmap_mode='r').tobytes()
+            arrValues = np.array([bytesValues[i:j].decode('utf-8') for (i, j) in zip(arrOffsets[:-1], arrOffsets[1:])],
+                                 dtype=object)
+            strNullsFile = os.path.join(strFolder, f'{col}.nulls.npy')
+            if os.path.exists(strNullsFile):
+                arrValues[np.load(strNullsFile)] = np.nan
+            dctColumns[col] = arrValues
+        else:
+            raise KeyError(f'Column "{col}" is not in the NumPy column store {strFolder}')
+    return pd.DataFrame(dctColumns, columns=list(columns), copy=False)
+
+### Aggregate cube of the merged data set: dimensions of a cell and the additive measures of every cell.
+### Rating bin 0 holds titles without a valid rating (see 'dctValidFlagBits') or with fewer votes than the cube's
+### 'rating_numvotes_min'; bin k (1-10) holds ratings in (k-1, k].
+### Source 'none' holds titles without revenue; 'gross_positive' is True for a worldwide gross above 0.
+lstCubeDimensions = ['genres','year','rating_bin','source','gross_positive']
+lstCubeSources = ['none','bom','tn','bom+tn']
+lstCubeRevenueCols = ['domestic_gross','foreign_gross','worldwide_gross','production_budget','profit']
+lstCubeMeasures = ['titles'] + [f'{col}_{strStat}' for col in lstCubeRevenueCols for strStat in ['count','sum','sumsq']] + \
+                  ['rating_count','rating_sum','rating_sumsq','numvotes_sum',
+                   'rating_times_numvotes_sum','ratingsqrd_times_numvotes_sum']
+
+### Loaded aggregate cubes by file location (see 'load_aggregate_cube')
+dctAggregateCubeCache = dict()
+
+def aggregate_cube_cells(df, fltNumvotesMin):
+    """
+    Aggregate merged rows 'df' (with the derived columns of 'add_merged_derived_columns') into cube cells;
+    titles with fewer than 'fltNumvotesMin' votes (config['rating-numvotes-pertitle-min']) are in rating bin 0.
+    returns a DataFrame with one row per non-empty cell, columns 'lstCubeDimensions' + 'lstCubeMeasures'.
+    '<col>_count', '<col>_sum', '<col>_sumsq' are taken over the non-NaN values of the column; rating
+    measures over titles with rating and numvotes. All measures are sums, so cells of several parts of the
+    data set are combined by summing them again (see 'write_aggregate_cube').
+    """
+    arrFlags = df['valid_flags'].to_numpy(dtype=np.uint8)
+    arrRating = df['rating'].to_numpy(dtype=np.float64)
+    arrNumvotes = df['numvotes'].to_numpy(dtype=np.float64)
+    mskValidRating = ((arrFlags & dctValidFlagBits['rating']) > 0) & (arrNumvotes >= fltNumvotesMin)
+    arrRatingBin = np.where(mskValidRating, np.clip(np.ceil(np.nan_to_num(arrRating)), 1, 10), 0).astype(np.uint8)
+    dctCells = {'genres': df['genres'].to_numpy(dtype=object), 'year': df['year'].to_numpy(dtype=np.uint16),
+                'rating_bin': arrRatingBin, 'source': df['revenue_source'].fillna('none').to_numpy(dtype=object),
+                'gross_positive': (arrFlags & dctValidFlagBits['worldwide_gross_positive']) > 0,
+                'titles': np.ones(df.shape[0], dtype=np.float64)}
+    for col in lstCubeRevenueCols:
+        arrValues = df[col].to_numpy(dtype=np.float64)
+        mskValid = ~np.isnan(arrValues)
+        arrValues = np.where(mskValid, arrValues, 0.0)
+        dctCells[f'{col}_count'] = mskValid.astype(np.float64)
+        dctCells[f'{col}_sum'] = arrValues
+        dctCells[f'{col}_sumsq'] = arrValues * arrValues
+    mskRated = ~(np.isnan(arrRating) | np.isnan(arrNumvotes))
+    arrRating, arrNumvotes = np.where(mskRated, arrRating, 0.0), np.where(mskRated, arrNumvotes, 0.0)
+    dctCells['rating_count'] = mskRated.astype(np.float64)
+    dctCells['rating_sum'] = arrRating
+    dctCells['rating_sumsq'] = arrRating * arrRating
+    dctCells['numvotes_sum'] = arrNumvotes
+    dctCells['rating_times_numvotes_sum'] = arrRating * arrNumvotes
+    dctCells['ratingsqrd_times_numvotes_sum'] = arrRating * arrRating * arrNumvotes
+    return pd.DataFrame(dctCells).groupby(lstCubeDimensions, sort=False).sum().reset_index()
+
+def merged_fingerprint_arrays(config):
+    """
+    Fingerprint of the merged file (see 'utils.file_fingerprint') as NumPy scalars 'merged_bytes', 'merged_mtime_ns'
+    and 'merged_sha256', stored with the aggregates built from it (.npz)
+    """
+    dctFingerprint = utils.file_fingerprint(os.path.join(config['folders']['data-csv'], config['files-merge']['clean-csv']))
+    return {'merged_bytes': np.int64(dctFingerprint['bytes']), 'merged_mtime_ns': np.int64(dctFingerprint['mtime_ns']),
+            'merged_sha256': np.str_(dctFingerprint['sha256'])}
+
+def merged_fingerprint_arrays_match(config, dctArrays):
+    """
+    True if the fingerprint arrays of 'dctArrays' (see 'merged_fingerprint_arrays') match the current merged file
+    """
+    if 'merged_sha256' not in dctArrays:
+        return False
+    dctFingerprint = {'bytes': int(dctArrays['merged_bytes']), 'mtime_ns': int(dctArrays['merged_mtime_ns']),
+                      'sha256': str(dctArrays['merged_sha256'])}
+    return utils.file_fingerprint_matches(dctFingerprint, os.path.join(config['folders']['data-csv'],
+                                                                       config['files-merge']['clean-csv']))
+
+def write_aggregate_cube(config, lstCells):
+    """
+    Combine the cube cells 'lstCells' (outputs of 'aggregate_cube_cells') and write the sparse cube to
+    config['files-merge']['aggregate-cube'] (.npz): one entry per non-empty cell, dimensions as integer codes
+    ('genre' into 'genre_names', 'source' into 'source_names'), one float64 array per measure, and the fingerprint
+    of the merged file the cube was built from (see 'merged_fingerprint_arrays' and 'load_aggregate_cube') and
+    the vote threshold of its rating bins ('rating_numvotes_min').
+    """
+    dfCells = pd.concat(lstCells, axis=0).groupby(lstCubeDimensions, sort=True).sum().reset_index()
+    arrGenreCodes, idxGenres = pd.factorize(dfCells['genres'], sort=True)
+    dctArrays = {'genre_names': np.asarray(idxGenres, dtype=str), 'source_names': np.asarray(lstCubeSources, dtype=str),
+                 'genre': arrGenreCodes.astype(np.int32), 'year': dfCells['year'].to_numpy(dtype=np.uint16),
+                 'rating_bin': dfCells['rating_bin'].to_numpy(dtype=np.uint8),
+                 'source': dfCells['source'].map({s: i for (i, s) in enumerate(lstCubeSources)}).to_numpy(dtype=np.uint8),
+                 'gross_positive': dfCells['gross_positive'].to_numpy(dtype=bool),
+                 'rating_numvotes_min': np.float64(config['rating-numvotes-pertitle-min'])}
+    dctArrays.update(merged_fingerprint_arrays(config))
+    for strMeasure in lstCubeMeasures:
+        dctArrays[strMeasure] = dfCells[strMeasure].to_numpy(dtype=np.float64)
+    np.savez(os.path.join(config['folders']['data-csv'], config['files-merge']['aggregate-cube']), **dctArrays)
+    return None
+
+def load_aggregate_cube(config):
+    """
+    Load the aggregate cube written by 'write_aggregate_cube' as a dictionary of arrays.
+    Returns None if there is no cube or if it was built from a different merged file (the fingerprint of the
+    merged file differs, see 'merged_fingerprint_arrays_match') or with another vote threshold than
+    config['rating-numvotes-pertitle-min']. Loaded cubes are kept in memory until the cube file changes.
+    """
+    strFilePath = os.path.join(config['folders']['data-csv'], config['files-merge']['aggregate-cube'])
+    strMergedPath = os.path.join(config['folders']['data-csv'], config['files-merge']['clean-csv'])
+    if not (os.path.exists(strFilePath) and os.path.exists(strMergedPath)):
+        return None
+    intMtime = os.stat(strFilePath).st_mtime_ns
+    if dctAggregateCubeCache.get(strFilePath, (None, None))[0] != intMtime:
+        with np.load(strFilePath) as npzCube:
+            dctAggregateCubeCache[strFilePath] = (intMtime, {strKey: npzCube[strKey] for strKey in npzCube.files})
+    cube = dctAggregateCubeCache[strFilePath][1]
+    if not merged_fingerprint_arrays_match(config, cube):
+        return None
+    if float(cube.get('rating_numvotes_min', np.nan)) != float(config['rating-numvotes-pertitle-min']):
+        return None
+    return cube
+
+def rollup_aggregate_cube(cube, strBy='genres', yearRange=None, ratingValid=None, grossPositive=None, sources=None):
+    """
+    Roll up the cube cells to one row per value of 'strBy' ('genres', 'year', 'rating_bin' or 'source').
+
+    Arguments (cells are filtered before the roll-up; None keeps all):
+        'yearRange': (first year, last year), both included
+        'ratingValid': True for rating bins 1-10 (valid rating flag), False for bin 0
+        'grossPositive': True/False on the worldwide gross above 0 ('worldwide_gross_positive' flag)
+        'sources': list of revenue sources of 'lstCubeSources'
+    Returns a DataFrame with column 'strBy' and the summed 'lstCubeMeasures' for the groups with titles.
+    """
+    mskCells = np.ones(cube['titles'].shape[0], dtype=bool)
+    if yearRange is not None:
+        mskCells &= (cube['year'] >= yearRange[0]) & (cube['year'] <= yearRange[1])
+    if ratingValid is not None:
+        mskCells &= (cube['rating_bin'] > 0) == ratingValid
+    if grossPositive is not None:
+        mskCells &= cube['gross_positive'] == grossPositive
+    if sources is not None:
+        mskCells &= np.isin(cube['source'], [lstCubeSources.index(strSource) for strSource in sources])
+
+    if strBy == 'genres':
+        arrCodes, arrLabels = cube['genre'], cube['genre_names'].astype(object)
+    elif strBy == 'source':
+        arrCodes, arrLabels = cube['source'], cube['source_names'].astype(object)
+    elif strBy in ['year','rating_bin']:
+        arrLabels = np.unique(cube[strBy])
+        arrCodes = np.searchsorted(arrLabels, cube[strBy])
+    else:
+        raise ValueError(f'Argument "strBy" {strBy} must be one of "genres", "year", "rating_bin", "source"')
+    arrCodes = arrCodes[mskCells]
+    dctRollup = {strBy: arrLabels}
+    for strMeasure in lstCubeMeasures:
+        dctRollup[strMeasure] = np.bincount(arrCodes, weights=cube[strMeasure][mskCells], minlength=arrLabels.shape[0])
+    df = pd.DataFrame(dctRollup)
+    return df.loc[df['titles'] > 0].reset_index(drop=True)
+
+def rollup_mean_std(dfRollup, strCol):
+    """
+    Mean, sample standard deviation (ddof=1, NaN for fewer than 2 values) and count of column 'strCol'
+    ('domestic_gross', ..., 'rating') from the '<col>_count', '<col>_sum', '<col>_sumsq' measures of a roll-up
+    """
+    srCount = dfRollup[f'{strCol}_count']
+    srMean = dfRollup[f'{strCol}_sum'].div(srCount)
+    srVar = dfRollup[f'{strCol}_sumsq'].sub(dfRollup[f'{strCol}_sum'].mul(srMean)).div(srCount - 1)
+    srStd = srVar.clip(lower=0).pow(0.5).where(srCount > 1)
+    return srMean, srStd, srCount
+
+### Loaded genre co-occurrence matrices by file location (see 'load_genre_cooccurrence')
+dctGenreCooccurrenceCache = dict()
+
+def write_genre_cooccurrence(config, dctMatrices):
+    """
+    Write the genre co-occurrence matrices 'dctMatrices' (see 'data_analysis.genre_cooccurrence_matrices') to
+    config['files-merge']['genre-cooccurrence'] (.npz) with the fingerprint of the merged file they were built from
+    (see 'merged_fingerprint_arrays')
+    """
+    np.savez(os.path.join(config['folders']['data-csv'], config['files-merge']['genre-cooccurrence']),
+             **merged_fingerprint_arrays(config), **dctMatrices)
+    return None
+
+def load_genre_cooccurrence(config):
+    """
+    Load the genre co-occurrence matrices written by 'write_genre_cooccurrence' as a dictionary of arrays.
+    Returns None if there are no matrices or if they were built from a different merged file (the fingerprint
+    of the merged file differs, see 'merged_fingerprint_arrays_match'). Loaded matrices are kept in memory until
+    the file changes.
+    """
+    strFilePath = os.path.join(config['folders']['data-csv'], config['files-merge']['genre-cooccurrence'])
+    strMergedPath = os.path.join(config['folders']['data-csv'], config['files-merge']['clean-csv'])
+    if not (os.path.exists(strFilePath) and os.path.exists(strMergedPath)):
+        return None
+    intMtime = os.stat(strFilePath).st_mtime_ns
+    if dctGenreCooccurrenceCache.get(strFilePath, (None, None))[0] != intMtime:
+        with np.load(strFilePath) as npzMatrices:
+            dctGenreCooccurrenceCache[strFilePath] = (intMtime, {strKey: npzMatrices[strKey] for strKey in npzMatrices.files})
+    dctMatrices = dctGenreCooccurrenceCache[strFilePath][1]
+    if not merged_fingerprint_arrays_match(config, dctMatrices):
+        return None
+    return {strKey: arr for (strKey, arr) in dctMatrices.items() if not strKey.startswith('merged_')}
+
+def load_merged_clean_data(config, mmap=False, chunkSize=None, yearRange=None, fileLocation=''):
     """
     Load merged data set generated by function 'merge_clean_data(config):
     File columns: 'tconst', 'title' (CAPS), 'year', 'runtime_minutes', 'genres'
-                  'rating', 'numvotes', 'domestic_gross', 'foreign_gross'.
+                  'rating', 'numvotes', 'domestic_gross', 'foreign_gross', 'production_budget',
+                  revenue match columns 'revenue_source', 'revenue_year', 'revenue_candidates',
+                  'revenue_match' (see 'merge_title_and_revenue'),
+                  derived columns 'worldwide_gross', 'rating_times_numvotes',
+                  'ratingsqrd_times_numvotes', 'profit', 'roi', 'profit_margin', 'valid_flags' (see 'add_merged_derived_columns').
+    If 'mmap' is True, the data set is loaded from the NumPy column store with memory-mapped
+    numeric columns (see 'load_merged_npy_store'); 'rating' is then float32. The store is always loaded
+    whole from its folder, so 'mmap' cannot be combined with 'chunkSize', 'yearRange' or 'fileLocation'.
+    With 'chunkSize' set, returns an iterator of DataFrames of up to 'chunkSize' rows.
+    With 'yearRange' (first year, last year) set, only the matching year partitions are read
+    (see 'load_year_partitions'); 'fileLocation' overrides the file location.
     """
-    fileLocation = os.path.join(config['folders']['data-csv'], config['files-merge']['clean-csv'])
+    if mmap:
+        if chunkSize is not None or yearRange is not None or len(fileLocation) > 0:
+            raise ValueError('The NumPy column store is loaded whole: "mmap" cannot be combined with '
+                             '"chunkSize", "yearRange" or "fileLocation"')
+        return load_merged_npy_store(config)
+    if yearRange is not None:
+        return load_year_partitions(config, 'merged', yearRange, chunkSize)
+    if len(fileLocation) == 0:
+        fileLocation = os.path.join(config['folders']['data-csv'], config['files-merge']['clean-csv'])
     df = pd.read_csv(fileLocation,encoding='utf-8',engine='python',quotechar= '"',quoting = 0,
-                     dtype={'tconst':str,'title':str,'year':np.uint16,'runtime_minutes':np.uint16,'genres':str,
-                            'rating':np.float16,'numvotes':np.float32,'domestic_gross':np.float64,'foreign_gross':np.float64})
+                     dtype=dctMergedColDataTypes,chunksize=chunkSize)
     return df
 
+### Clean data sets which can be partitioned by release year: config keys of the clean file and loader.
+### 'clean.imdb.title.ratings.csv' has no release year and is not partitioned.
+dctYearPartitionedDatasets = {
+    'imdb-title-basics': {'file-keys': ['files-imdb','csv','clean-title-base'], 'loader': load_clean_imdb_title_basics},
+    'bom-movie-gross':   {'file-keys': ['files-bom','clean-csv'],               'loader': load_clean_bom_movie_gross},
+    'tn-movie-budgets':  {'file-keys': ['files-tn','clean-csv'],                'loader': load_clean_tn_movie_gross},
+    'merged':            {'file-keys': ['files-merge','clean-csv'],             'loader': load_merged_clean_data}
+}
+
+def read_year_partition_manifest(config):
+    """
+    Read the manifest of the year partitions (config['year-partitions']['folder']/manifest.json):
+    {'datasets': {dataset: {'source': fingerprint of the clean file (see 'utils.file_fingerprint'), 'columns': [...],
+                            'partitions': {year: {'file': path relative to the folder, 'rows': n}}}}}
+    Returns an empty manifest if none was written yet.
+    """
+    strFilePath = os.path.join(config['folders']['data-csv'], config['year-partitions']['folder'], 'manifest.json')
+    if not os.path.exists(strFilePath):
+        return {'datasets': dict()}
+    with open(strFilePath, mode='r', encoding='utf-8') as fileManifest:
+        return json.load(fileManifest)
+
+def partition_clean_file_by_year(config, strDataset, addOnly=None):
+    """
+    Split the clean file of 'strDataset' (a key of 'dctYearPartitionedDatasets') into one CSV file per
+    release year '<folder>/<dataset>/year=<year>.csv' and record the partitions in the manifest.
+    The file is read in chunks of config['year-partitions']['chunk-rows'] rows as text, so every
+    partition holds the same lines as the clean file, in the same order.
+
+    The manifest records the fingerprint and the columns of the clean file the partitions were split from.
+    If either differs from the current clean file (e.g. after a re-run of the "prep" or merge functions with
+    other thresholds or columns), all partitions of the data set are rewritten and years no longer in the
+    clean file are removed.
+    'addOnly' (default: config['year-partitions']['add-only']): if True and the clean file is unchanged, only
+    years without a partition file are written (nothing is read if every partition exists);
+    if False all partitions of the data set are rewritten.
+    Returns the sorted list of years written.
+    """
+    if addOnly is None:
+        addOnly = config['year-partitions']['add-only']
+    lstFileKeys = dctYearPartitionedDatasets[strDataset]['file-keys']
+    dctFiles = config
+    for strKey in lstFileKeys:
+        dctFiles = dctFiles[strKey]
+    strCleanFilePath = os.path.join(config['folders']['data-csv'], dctFiles)
+    strFolder = os.path.join(config['folders']['data-csv'], config['year-partitions']['folder'])
+    os.makedirs(os.path.join(strFolder, strDataset), exist_ok=True)
+
+    dctManifest = read_year_partition_manifest(config)
+    dctDataset = dctManifest['datasets'].get(strDataset, {'source': None, 'columns': list(), 'partitions': dict()})
+    lstColumns = pd.read_csv(strCleanFilePath, encoding='utf-8', nrows=0).columns.to_list()
+    blnCurrent = ( utils.file_fingerprint_matches(dctDataset.get('source'), strCleanFilePath) and \
+                   (dctDataset['columns'] == lstColumns) )
+    if addOnly and blnCurrent:
+        ### unchanged clean file: only partitions whose file is missing are written
+        intNumPartitions = len(dctDataset['partitions'])
+        dctDataset['partitions'] = {strYear: dctPartition for (strYear, dctPartition) in dctDataset['partitions'].items()
+                                    if os.path.exists(os.path.join(strFolder, dctPartition['file']))}
+        if intNumPartitions > 0 and len(dctDataset['partitions']) == intNumPartitions:
+            return list()
+    else:
+        for dctPartition in dctDataset['partitions'].values():
+            strPartitionPath = os.path.join(strFolder, dctPartition['file'])
+            if os.path.exists(strPartitionPath):
+                os.remove(strPartitionPath)
+        dctDataset['partitions'] = dict()
+    dctDataset['source'] = utils.file_fingerprint(strCleanFilePath)
+    dctDataset['columns'] = lstColumns
+
+    dctWritten = dict()
+    iterChunks = pd.read_csv(strCleanFilePath, encoding='utf-8', quotechar='"', quoting=0, dtype=str,
+                             keep_default_na=False, chunksize=config['year-partitions']['chunk-rows'])
+    for dfChunk in iterChunks:
+        for (strYear, dfYear) in dfChunk.groupby('year', sort=False):
+            if strYear in dctDataset['partitions']:
+                continue
+            strFile = os.path.join(strDataset, f'year={strYear}.csv')
+            blnNewFile = (strYear not in dctWritten)
+            with open(os.path.join(strFolder, strFile), mode='w' if blnNewFile else 'a', encoding='utf-8', newline='') as fileCSV:
+                dfYear.to_csv(fileCSV, index=False, header=blnNewFile, quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            dctWritten[strYear] = {'file': strFile, 'rows': dctWritten.get(strYear, {'rows': 0})['rows'] + dfYear.shape[0]}
+    dctDataset['partitions'].update(dctWritten)
+    dctDataset['partitions'] = dict(sorted(dctDataset['partitions'].items(), key=lambda tpl: int(tpl[0])))
+    dctManifest['datasets'][strDataset] = dctDataset
+
+    with open(os.path.join(strFolder, 'manifest.json'), mode='w', encoding='utf-8') as fileManifest:
+        json.dump(dctManifest, fileManifest, indent=4)
+    return sorted([int(strYear) for strYear in dctWritten])
+
+def year_partition_files(config, strDataset, yearRange):
+    """
+    Paths of the partitions of 'strDataset' with first year <= year <= last year of 'yearRange', in year order
+    """
+    dctDataset = read_year_partition_manifest(config)['datasets'].get(strDataset)
+    if dctDataset is None or len(dctDataset['partitions']) == 0:
+        raise ValueError(f'No year partitions of "{strDataset}"; see "partition_clean_file_by_year"')
+    strFolder = os.path.join(config['folders']['data-csv'], config['year-partitions']['folder'])
+    return [os.path.join(strFolder, dctPartition['file']) for (strYear, dctPartition) in dctDataset['partitions'].items()
+            if yearRange[0] <= int(strYear) <= yearRange[1]]
+
+def load_year_partitions(config, strDataset, yearRange, chunkSize=None):
+    """
+    Load the rows of 'strDataset' with release year in 'yearRange' (first year, last year), both included,
+    from the year partitions only. The data set's loader is used for every partition, so data types are the
+    same as for the whole clean file. With 'chunkSize' set, returns an iterator of DataFrames.
+    """
+    funcLoad = dctYearPartitionedDatasets[strDataset]['loader']
+    lstFiles = year_partition_files(config, strDataset, yearRange)
+    if chunkSize is not None:
+        return itertools.chain.from_iterable(funcLoad(config, chunkSize=chunkSize, fileLocation=strFile) for strFile in lstFiles)
+    if len(lstFiles) == 0:
+        ### no matching year: an empty frame with the data set's columns and types
+        strAnyFile = year_partition_files(config, strDataset, (0, np.iinfo(np.uint16).max))[0]
+        return funcLoad(config, fileLocation=strAnyFile).iloc[:0]
+    lstFrames = [funcLoad(config, fileLocation=strFile) for strFile in lstFiles]
+    return pd.concat(lstFrames, axis=0, ignore_index=True)
+
+def select_filter_mask(df, filters):
+    """
+    Evaluate 'filters' (see function 'select') on DataFrame 'df' and return a boolean mask
+    """
+    mskRows = pd.Series(True, index=df.index)
+    for tplFilter in filters:
+        col, op = tplFilter[0], tplFilter[1]
+        if op == 'notna':
+            mskRows &= df[col].notna()
+        elif op == 'isna':
+            mskRows &= df[col].isna()
+        elif op == 'in':
+            mskRows &= df[col].isin(tplFilter[2])
+        elif op == 'not in':
+            mskRows &= (df[col].isin(tplFilter[2])==False)
+        elif op == '==':
+            mskRows &= (df[col] == tplFilter[2])
+        elif op == '!=':
+            mskRows &= (df[col] != tplFilter[2])
+        elif op == '<':
+            mskRows &= (df[col] < tplFilter[2])
+        elif op == '<=':
+            mskRows &= (df[col] <= tplFilter[2])
+        elif op == '>':
+            mskRows &= (df[col] > tplFilter[2])
+        elif op == '>=':
+            mskRows &= (df[col] >= tplFilter[2])
+        elif op == 'allbits':
+            mskRows &= ((df[col].to_numpy() & tplFilter[2]) == tplFilter[2])
+        else:
+            raise ValueError(f'Unsupported filter operator "{op}" in filter {tplFilter}')
+    return mskRows
+
+def select_can_skip_row_group(dctRowGroup, filters):
+    """
+    Returns True if the row group statistics prove that no row of the group satisfies 'filters'
+    """
+    intRows = dctRowGroup['rows']
+    for tplFilter in filters:
+        col, op = tplFilter[0], tplFilter[1]
+        dctColStats = dctRowGroup['stats'][col]
+        if op == 'notna':
+            if dctColStats['nulls'] == intRows:
+                return True
+            continue
+        if op == 'isna':
+            if dctColStats['nulls'] == 0:
+                return True
+            continue
+        if dctColStats['nulls'] == intRows and op != '!=' and op != 'not in':
+            ### comparisons with NaN are False
+            return True
+        if 'min' not in dctColStats:
+            continue
+        fltMin, fltMax = dctColStats['min'], dctColStats['max']
+        if op == '==' and (tplFilter[2] < fltMin or tplFilter[2] > fltMax):
+            return True
+        if op == 'in' and all((val < fltMin or val > fltMax) for val in tplFilter[2]):
+            return True
+        if op == '<' and fltMin >= tplFilter[2]:
+            return True
+        if op == '<=' and fltMin > tplFilter[2]:
+            return True
+        if op == '>' and fltMax <= tplFilter[2]:
+            return True
+        if op == '>=' and fltMax < tplFilter[2]:
+            return True
+        if op == 'allbits' and fltMax < tplFilter[2]:
+            ### every row lacks at least one of the bits
+            return True
+    return False
+
+def select(config, columns=None, filters=None, yearRange=None):
+    """
+    Query the merged data set: returns a DataFrame with 'columns' for the rows satisfying all 'filters'.
+
+    Arguments:
+        'columns': list of column names (default: all columns)
+        'filters': list of tuples (column, operator, value) combined with logical AND.
+                   Operators: '==', '!=', '<', '<=', '>', '>=', 'in', 'not in' (value is a list),
+                   'notna', 'isna' (no value), 'allbits' (value is a bitmask, see 'valid_flags_filter').
+                   Example: [('numvotes','>=',100), ('rating','notna')]
+        'yearRange': optional (first year, last year); only the matching year partitions of the merged
+                     data set are read (see 'partition_clean_file_by_year')
+    Predicates and projection are pushed down to the storage layer: row groups whose index
+    statistics rule out the filters are not read, and only the requested and filtered columns
+    are parsed. Without a row-group index the file is scanned once with the same projection, in chunks
+    if the projected columns do not fit the memory budget (see 'plan_execution').
+    """
+    if filters is None:
+        filters = list()
+    strFilePath  = os.path.join(config['folders']['data-csv'], config['files-merge']['clean-csv'])
+    strIndexPath = os.path.join(config['folders']['data-csv'], config['files-merge']['clean-index'])
+
+    if yearRange is not None:
+        dctIndex = None
+        lstScanFiles = year_partition_files(config, 'merged', yearRange)
+        lstFileCols = read_year_partition_manifest(config)['datasets']['merged']['columns']
+    elif os.path.exists(strIndexPath):
+        with open(strIndexPath, mode='r', encoding='utf-8') as fileIndex:
+            dctIndex = json.load(fileIndex)
+        lstFileCols = dctIndex['columns']
+    else:
+        dctIndex = None
+        lstScanFiles = [strFilePath]
+        lstFileCols = pd.read_csv(strFilePath, nrows=0).columns.to_list()
+    if columns is None:
+        columns = lstFileCols
+    for col in list(columns) + [tplFilter[0] for tplFilter in filters]:
+        if col not in lstFileCols:
+            raise KeyError(f'Column "{col}" is not in the merged data set')
+
+    ### Parse projected columns and filter columns only
+    lstReadCols = [col for col in lstFileCols if (col in columns) or any(col == f[0] for f in filters)]
+    dctReadTypes = {col: dctMergedColDataTypes[col] for col in lstReadCols if col in dctMergedColDataTypes}
+    ### the C parser has no float16: parse as float32 and cast right after parsing
+    dctCastTypes = {col: t for (col, t) in dctReadTypes.items() if t == np.float16}
+    dctReadTypes.update({col: np.float32 for col in dctCastTypes})
+
+    lstFrames = list()
+    if dctIndex is None:
+        dctReadArgs = {'encoding': 'utf-8', 'quotechar': '"', 'quoting': 0, 'usecols': lstReadCols, 'dtype': dctReadTypes}
+        for strScanFile in lstScanFiles:
+            ### scans larger than the memory budget are filtered chunk by chunk
+            dctFootprint = estimate_csv_footprint(strScanFile, config['memory-budget']['sample-rows'], **dctReadArgs)
+            intChunkRows = plan_execution(config, 'select', dctFootprint)['chunk_rows']
+            if intChunkRows is None:
+                iterFrames = [pd.read_csv(strScanFile, **dctReadArgs)]
+            else:
+                iterFrames = pd.read_csv(strScanFile, chunksize=intChunkRows, **dctReadArgs)
+            for df in iterFrames:
+                df = df.astype(dctCastTypes)
+                lstFrames.append(df.loc[select_filter_mask(df, filters), list(columns)])
+    else:
+        with open(strFilePath, mode='rb') as fileCSV:
+            for dctRowGroup in dctIndex['row-groups']:
+                if select_can_skip_row_group(dctRowGroup, filters):
+                    continue
+                fileCSV.seek(dctRowGroup['offset'])
+                bytesGroup = fileCSV.read(dctRowGroup['length'])
+                df = pd.read_csv(io.BytesIO(bytesGroup), encoding='utf-8', header=None, names=lstFileCols,
+                                 quotechar='"', quoting=0, usecols=lstReadCols, dtype=dctReadTypes)
+                df = df.astype(dctCastTypes)
+                df = df.loc[select_filter_mask(df, filters), list(columns)]
+                lstFrames.append(df)
+    if len(lstFrames) == 0:
+        return pd.DataFrame({col: pd.Series(dtype=dctMergedColDataTypes.get(col, object)) for col in columns})
+    return pd.concat(lstFrames, axis=0).reset_index(drop=True)
+
 def support_function_one(example):
     """This one might read in the data from imdb and clean it"""
     return example
@@ -0,0 +1,260 @@
+"""
+Local chart-data server: loads the merged data set produced by "merge_clean_data(config)" once and
+serves the chart data functions of data_visualization.py as JSON to any number of notebooks.
+
+The server keeps one warm copy of the merged rows used by the charts and a genre index (integer code of
+every title's genre), answers requests on a thread per connection (ThreadingHTTPServer) and caches the
+JSON response of every distinct request (path and sorted query parameters), so repeated chart requests
+from several kernels are served from memory. It only listens on config['chart-server']['host'] (localhost).
+
+Endpoints (GET, parameters in the query string):
+    /health                         rows loaded and cache statistics
+    /genres                         genres with their number of titles
+    /top-genres-by-revenue          maxgenres, year_min, year_max
+    /top-genres-by-rating           maxgenres
+    /rating-interval-revenue        (none) title average worldwide gross per rating interval (a,b]
+    /scatter-runtime-revenue        genre (optional) runtime and worldwide gross of every title
+
+Run from the repository folder (the data folders of config.json are relative to it):
+    python code/data_server.py
+    python code/data_server.py --config ./config/config.json --port 8765
+In a notebook:
+    dctTop = data_server.fetch_chart_data(config, '/top-genres-by-revenue', maxgenres=10, year_min=2012)
+"""
+
+import sys
+import json
+import argparse
+import threading
+import collections
+import urllib.parse
+import urllib.request
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pandas as pd
+import numpy as np
+import data_preparation as dataprep
+import data_visualization as datavis
+import utils
+
+### Columns of the merged data set kept in memory by the server
+lstServerColumns = ['tconst','year','runtime_minutes','genres','rating','numvotes','domestic_gross','foreign_gross',
+                    'worldwide_gross','rating_times_numvotes','ratingsqrd_times_numvotes','valid_flags']
+
+### Rating intervals (a,b] of the rating-interval chart ('barchart_scatterplot_title_rating_and_revenue')
+lstRatingIntervals = [[1,2],[2,3],[3,4],[4,5],[5,6],[6,7],[7,8],[8,9]]
+
+def load_chart_server_data(config):
+    """
+    Load the merged data set once for all requests: returns {'df': merged rows ('lstServerColumns'),
+    'genre_codes': genre code of every row, 'genre_names': genre of every code, 'genre_counts': titles per code}
+    """
+    df = dataprep.select(config, lstServerColumns)
+    arrGenreCodes, idxGenreNames = pd.factorize(df['genres'])
+    return {'df': df, 'genre_codes': arrGenreCodes, 'genre_names': np.asarray(idxGenreNames, dtype=object),
+            'genre_counts': np.bincount(arrGenreCodes[arrGenreCodes >= 0], minlength=len(idxGenreNames))}
+
+def frame_to_records(df):
+    """
+    DataFrame rows as a list of dictionaries with NaN values as None (JSON null)
+    """
+    return df.astype(object).where(df.notna(), None).to_dict(orient='records')
+
+def get_query_param(dctParams, strName, funcType, default=None, minValue=None):
+    """
+    Value of query parameter 'strName' converted with 'funcType' ('default' if missing);
+    values below 'minValue' are invalid
+    """
+    if strName not in dctParams:
+        return default
+    try:
+        value = funcType(dctParams[strName])
+    except ValueError:
+        raise ValueError(f'Query parameter "{strName}" has an invalid value "{dctParams[strName]}"')
+    if minValue is not None and value < minValue:
+        raise ValueError(f'Query parameter "{strName}" has an invalid value "{dctParams[strName]}"; minimum is {minValue}')
+    return value
+
+def valid_rows(config, dctData, *lstFlagNames):
+    """
+    Mask of the warm rows with all validity bits 'lstFlagNames' set (see 'dataprep.valid_flags_filter');
+    with 'rating', titles also need config['rating-numvotes-pertitle-min'] votes (see 'dataprep.rating_numvotes_filter')
+    """
+    intBits = dataprep.valid_flags_filter(*lstFlagNames)[2]
+    mskRows = (dctData['df']['valid_flags'].to_numpy() & intBits) == intBits
+    if 'rating' in lstFlagNames:
+        mskRows &= (dctData['df']['numvotes'].to_numpy(dtype=np.float64) >= config['rating-numvotes-pertitle-min'])
+    return mskRows
+
+def chart_health(config, dctData, dctParams):
+    return {'rows': int(dctData['df'].shape[0]), 'genres': int(dctData['genre_names'].shape[0])}
+
+def chart_genres(config, dctData, dctParams):
+    df = pd.DataFrame({'genres': dctData['genre_names'], 'titles': dctData['genre_counts']})
+    return frame_to_records(df.sort_values(['titles','genres'], ascending=[False,True]))
+
+def chart_top_genres_by_revenue(config, dctData, dctParams):
+    """
+    Data of chart 'bar_chart_top_genres_by_revenue' for release years year_min..year_max
+    """
+    intMaxGenres = get_query_param(dctParams, 'maxgenres', int, 10, minValue=1)
+    intYearMin = get_query_param(dctParams, 'year_min', int, config['title-release-year-min'])
+    intYearMax = get_query_param(dctParams, 'year_max', int, config['title-release-year-max'])
+    df = dctData['df']
+    arrYear = df['year'].to_numpy()
+    dfGenreSums = datavis.genre_revenue_sums(config, df.loc[(arrYear >= intYearMin) & (arrYear <= intYearMax)])
+    srsW, srsD, srsF = datavis.top_genres_by_revenue(config, dfGenreSums, intMaxGenres)
+    return {strName: frame_to_records(srs.rename('gross').reset_index())
+            for (strName, srs) in [('worldwide', srsW), ('domestic', srsD), ('foreign', srsF)]}
+
+def chart_top_genres_by_rating(config, dctData, dctParams):
+    """
+    Data of chart 'bar_chart_top_genres_by_weightedavg_title_rating'
+    """
+    intMaxGenres = get_query_param(dctParams, 'maxgenres', int, 15, minValue=1)
+    df = datavis.genre_rating_sums(config, dctData['df'].loc[valid_rows(config, dctData, 'rating')])
+    df = df.assign(wavgrating=df['rating_times_numvotes'].div(df['numvotes']))
+    df['rating_wavgstdev'] = df['ratingsqrd_times_numvotes'].div(df['numvotes']).sub(df['wavgrating'].pow(2)).clip(lower=0).pow(0.5)
+    dctTopGenres = utils.select_topN_rows(df, ['wavgrating','rating_mean'], intMaxGenres, config)
+    lstCols = ['genres','genre_numtitles','numvotes','wavgrating','rating_wavgstdev','rating_mean','rating_std']
+    return {strRank: frame_to_records(dfTop.loc[:, lstCols]) for (strRank, dfTop) in dctTopGenres.items()}
+
+def chart_rating_interval_revenue(config, dctData, dctParams):
+    """
+    Data of the bar chart of 'barchart_scatterplot_title_rating_and_revenue' (error: standard error of the mean)
+    """
+    df = dctData['df']
+    df = df.loc[valid_rows(config, dctData, 'rating', 'worldwide_gross_positive') & (df['worldwide_gross'] < 100e9).to_numpy()]
+    dctAvg = datavis.compute_revenue_mean_stdev_for_rating_interval(df, lstRatingIntervals, 'rating', 'worldwide_gross', 1e6)
+    dfIntervals = pd.DataFrame({'interval_low': [lst[0] for lst in lstRatingIntervals],
+                                'interval_high': [lst[1] for lst in lstRatingIntervals],
+                                'avg_musd': dctAvg['avg'], 'sem_musd': dctAvg['std']})
+    return frame_to_records(dfIntervals)
+
+def chart_scatter_runtime_revenue(config, dctData, dctParams):
+    """
+    Data of 'scatterplot_title_runtime_and_revenue' (all titles or the titles of one genre)
+    """
+    strGenre = get_query_param(dctParams, 'genre', str)
+    df = dctData['df']
+    mskRows = valid_rows(config, dctData, 'worldwide_gross_positive') & df['runtime_minutes'].notna().to_numpy()
+    if strGenre is not None:
+        arrMatch = np.flatnonzero(dctData['genre_names'] == strGenre)
+        if arrMatch.shape[0] == 0:
+            raise KeyError(f'Genre "{strGenre}" is not in the merged data set')
+        mskRows &= (dctData['genre_codes'] == arrMatch[0])
+    return {'runtime_minutes': df['runtime_minutes'].to_numpy(dtype=np.float64)[mskRows].tolist(),
+            'worldwide_gross': df['worldwide_gross'].to_numpy(dtype=np.float64)[mskRows].tolist()}
+
+### Endpoint paths and their chart data functions (config, warm data, query parameters) -> JSON value
+dctChartEndpoints = {
+    '/health': chart_health,
+    '/genres': chart_genres,
+    '/top-genres-by-revenue': chart_top_genres_by_revenue,
+    '/top-genres-by-rating': chart_top_genres_by_rating,
+    '/rating-interval-revenue': chart_rating_interval_revenue,
+    '/scatter-runtime-revenue': chart_scatter_runtime_revenue
+}
+
+class ChartDataRequestHandler(BaseHTTPRequestHandler):
+    """
+    Request handler; the server object carries 'config', 'chart_data', 'response_cache' (OrderedDict
+    of JSON bytes, least recently used first), 'cache_lock' and 'cache_stats'
+    """
+    def do_GET(self):
+        urlParts = urllib.parse.urlsplit(self.path)
+        dctParams = {strKey: lstValues[-1] for (strKey, lstValues) in urllib.parse.parse_qs(urlParts.query).items()}
+        if urlParts.path not in dctChartEndpoints:
+            self.send_json(404, json.dumps({'error': f'Unknown endpoint "{urlParts.path}"',
+                                            'endpoints': list(dctChartEndpoints)}).encode('utf-8'))
+            return
+        server = self.server
+        if urlParts.path == '/health':
+            dctHealth = chart_health(server.config, server.chart_data, dctParams)
+            with server.cache_lock:
+                dctHealth.update(server.cache_stats, cached=len(server.response_cache))
+            self.send_json(200, json.dumps(dctHealth).encode('utf-8'))
+            return
+        tplKey = (urlParts.path, tuple(sorted(dctParams.items())))
+        with server.cache_lock:
+            bytesBody = server.response_cache.get(tplKey)
+            if bytesBody is not None:
+                server.response_cache.move_to_end(tplKey)
+                server.cache_stats['hits'] += 1
+        if bytesBody is None:
+            try:
+                value = dctChartEndpoints[urlParts.path](server.config, server.chart_data, dctParams)
+            except (ValueError, KeyError) as err:
+                self.send_json(400, json.dumps({'error': str(err.args[0])}).encode('utf-8'))
+                return
+            bytesBody = json.dumps(value).encode('utf-8')
+            with server.cache_lock:
+                server.cache_stats['misses'] += 1
+                server.response_cache[tplKey] = bytesBody
+                while len(server.response_cache) > server.config['chart-server']['cache-entries']:
+                    server.response_cache.popitem(last=False)
+        self.send_json(200, bytesBody)
+
+    def send_json(self, intStatus, bytesBody):
+        self.send_response(intStatus)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(bytesBody)))
+        self.end_headers()
+        self.wfile.write(bytesBody)
+
+    def log_message(self, format, *args):
+        if self.server.config['chart-server']['log-requests']:
+            super().log_message(format, *args)
+
+def create_chart_server(config, port=None):
+    """
+    Load the merged data set and create the server (not started) on config['chart-server']['host'] and
+    'port' (default config['chart-server']['port']; 0 picks a free port, see 'server.server_address').
+    """
+    if port is None:
+        port = config['chart-server']['port']
+    server = ThreadingHTTPServer((config['chart-server']['host'], port), ChartDataRequestHandler)
+    server.daemon_threads = True
+    server.config = config
+    server.chart_data = load_chart_server_data(config)
+    server.response_cache = collections.OrderedDict()
+    server.cache_lock = threading.Lock()
+    server.cache_stats = {'hits': 0, 'misses': 0}
+    return server
+
+def serve_chart_data(config, port=None):
+    """
+    Run the chart-data server until interrupted (Ctrl-C)
+    """
+    server = create_chart_server(config, port)
+    print(f"Serving chart data for {server.chart_data['df'].shape[0]} titles on "
+          f"http://{server.server_address[0]}:{server.server_address[1]}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return None
+
+def fetch_chart_data(config, strEndpoint, port=None, **dctParams):
+    """
+    Client helper: request 'strEndpoint' (e.g. '/top-genres-by-revenue') with query parameters 'dctParams'
+    from the local chart-data server and return the decoded JSON value
+    """
+    if port is None:
+        port = config['chart-server']['port']
+    strQuery = urllib.parse.urlencode({strKey: value for (strKey, value) in dctParams.items() if value is not None})
+    strUrl = f"http://{config['chart-server']['host']}:{port}{strEndpoint}" + (f'?{strQuery}' if strQuery else '')
+    with urllib.request.urlopen(strUrl, timeout=config['chart-server']['timeout-seconds']) as response:
+        return json.loads(response.read().decode('utf-8'))
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve chart data of the merged data set on localhost')
+    parser.add_argument('--config', default='./config/config.json', help='project config file')
+    parser.add_argument('--port', type=int, default=None, help="port (default: config['chart-server']['port'])")
+    args = parser.parse_args()
+    serve_chart_data(utils.load_json_config_from_file(args.config), args.port)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,313 @@
+"""
+This module keeps small mergeable sketches of the merged data set produced by "merge_clean_data(config)"
+(see data_preparation.py): approximate quantiles (medians, p90, p99) of the heavy-tailed revenue columns
+and approximate distinct title counts, per group of rows (e.g. per genre and release year).
+
+## Quantile sketch (KLL)
+Values are kept in levels of compactors; an item of level h stands for 2**h values. When a level holds
+more items than its capacity (config['sketches']['quantile-k'] for the top level, 2/3 of the level above for
+the levels below), it is sorted and every second item moves up one level. The rank error is about 1.7/k
+of the number of values (k=200: below 1%), independent of the number of values. Minimum, maximum and the
+number of values are kept exactly.
+
+## Distinct-count sketch (HyperLogLog)
+Keys (e.g. 'tconst') are hashed to 64 bits; the first p bits (config['sketches']['distinct-precision'])
+select one of 2**p registers, which keeps the maximum position of the first set bit of the other bits.
+The relative standard error is 1.04/sqrt(2**p) (p=10: 3.3%); small counts are nearly exact (linear counting).
+
+## Group sketches
+Sketches are plain dictionaries of NumPy arrays: they are updated chunk by chunk ('update_group_sketches'),
+merged across chunks, partitions and workers ('merge_group_sketches'), rolled up to coarser groups
+('rollup_group_sketches') and pickled. Merging sketches gives the same accuracy as one sketch of all values.
+
+Example:
+    dctSketches = new_group_sketches()
+    for df in data_preparation.load_merged_clean_data(config, chunkSize=100000):
+        update_group_sketches(config, dctSketches, df)
+    dfQuantiles = group_sketch_quantiles(rollup_group_sketches(dctSketches, 'genres'), 'worldwide_gross', [0.5,0.9,0.99])
+"""
+
+import os
+import pickle
+import pandas as pd
+import numpy as np
+import utils
+
+### Ratio of the capacities of two neighbouring levels of the quantile sketch
+fltQuantileLevelRatio = 2/3
+
+### Group columns of the sketches written by 'merge_clean_data' and the key column of the distinct counts
+lstSketchGroupCols = ['genres','year']
+strSketchKeyCol = 'tconst'
+
+### Loaded group sketches by file location (see 'load_group_sketches')
+dctGroupSketchCache = dict()
+
+def new_quantile_sketch(intK=200):
+    """
+    Empty quantile sketch: {'k': top level capacity, 'n': number of values, 'min', 'max', 'levels': list of
+    float64 arrays (level h items weigh 2**h)}
+    """
+    return {'k': int(intK), 'n': 0, 'min': np.inf, 'max': -np.inf, 'levels': [np.empty(0, dtype=np.float64)]}
+
+def quantile_level_capacity(intK, intNumLevels, intLevel):
+    return max(2, int(np.ceil(intK * fltQuantileLevelRatio ** (intNumLevels - intLevel - 1))))
+
+def compact_quantile_sketch(sketch):
+    """
+    Compact the levels of 'sketch' (in place) until every level is within its capacity.
+    A full level is sorted; with an odd number of items the smallest stays, and of the other items every
+    second one moves up a level. The offset (first or second item) alternates by the number of values,
+    which keeps the compactions of a level from consistently dropping its smaller or larger items.
+    """
+    lstLevels = sketch['levels']
+    intLevel = 0
+    while intLevel < len(lstLevels):
+        arrItems = lstLevels[intLevel]
+        if arrItems.shape[0] > quantile_level_capacity(sketch['k'], len(lstLevels), intLevel):
+            arrItems = np.sort(arrItems)
+            intKeep = arrItems.shape[0] % 2
+            intOffset = (sketch['n'] >> intLevel) & 1
+            if intLevel + 1 == len(lstLevels):
+                lstLevels.append(np.empty(0, dtype=np.float64))
+            lstLevels[intLevel + 1] = np.concatenate([lstLevels[intLevel + 1], arrItems[intKeep + intOffset::2]])
+            lstLevels[intLevel] = arrItems[:intKeep]
+            ### capacities of the lower levels shrink when a level is added: check them again
+            intLevel = 0
+            continue
+        intLevel += 1
+    return sketch
+
+def update_quantile_sketch(sketch, arrValues):
+    """
+    Add the values 'arrValues' (NaN values are skipped) to 'sketch' (in place); returns the sketch
+    """
+    arrValues = np.asarray(arrValues, dtype=np.float64)
+    arrValues = arrValues[~np.isnan(arrValues)]
+    if arrValues.shape[0] == 0:
+        return sketch
+    sketch['n'] += int(arrValues.shape[0])
+    sketch['min'] = min(sketch['min'], float(arrValues.min()))
+    sketch['max'] = max(sketch['max'], float(arrValues.max()))
+    sketch['levels'][0] = np.concatenate([sketch['levels'][0], arrValues])
+    return compact_quantile_sketch(sketch)
+
+def merge_quantile_sketches(sketchA, sketchB):
+    """
+    New quantile sketch of the values of both sketches (same 'k')
+    """
+    if sketchA['k'] != sketchB['k']:
+        raise ValueError(f'Quantile sketches with different k ({sketchA["k"]}, {sketchB["k"]}) cannot be merged')
+    intNumLevels = max(len(sketchA['levels']), len(sketchB['levels']))
+    lstLevels = [np.concatenate([sketch['levels'][intLevel] for sketch in [sketchA, sketchB]
+                                 if intLevel < len(sketch['levels'])]) for intLevel in range(intNumLevels)]
+    sketch = {'k': sketchA['k'], 'n': sketchA['n'] + sketchB['n'], 'min': min(sketchA['min'], sketchB['min']),
+              'max': max(sketchA['max'], sketchB['max']), 'levels': lstLevels}
+    return compact_quantile_sketch(sketch)
+
+def quantile_sketch_values(sketch, lstQuantiles):
+    """
+    Approximate quantiles 'lstQuantiles' (values in [0,1]) of the values of 'sketch' as a float64 array:
+    the smallest item whose cumulative weight reaches q times the number of values.
+    Quantiles 0 and 1 are the exact minimum and maximum; NaN for an empty sketch.
+    """
+    arrQuantiles = np.asarray(lstQuantiles, dtype=np.float64)
+    if np.any((arrQuantiles < 0) | (arrQuantiles > 1)):
+        raise ValueError(f'Quantiles {list(lstQuantiles)} must be between 0 and 1')
+    if sketch['n'] == 0:
+        return np.full(arrQuantiles.shape[0], np.nan)
+    arrItems = np.concatenate(sketch['levels'])
+    arrWeights = np.concatenate([np.full(arrLevel.shape[0], 2.0 ** intLevel)
+                                 for (intLevel, arrLevel) in enumerate(sketch['levels'])])
+    arrOrder = np.argsort(arrItems, kind='stable')
+    arrItems, arrCumWeights = arrItems[arrOrder], np.cumsum(arrWeights[arrOrder])
+    ### compaction keeps the total weight: the last cumulative weight is 'n'
+    arrRanks = arrQuantiles * arrCumWeights[-1]
+    arrValues = arrItems[np.minimum(np.searchsorted(arrCumWeights, arrRanks, side='left'), arrItems.shape[0] - 1)]
+    arrValues = np.where(arrQuantiles == 0, sketch['min'], arrValues)
+    return np.where(arrQuantiles == 1, sketch['max'], arrValues)
+
+def new_distinct_sketch(intPrecision=12):
+    """
+    Empty distinct-count sketch: {'p': precision, 'registers': 2**p uint8 registers}
+    """
+    if not 4 <= intPrecision <= 18:
+        raise ValueError(f'Distinct sketch precision {intPrecision} must be between 4 and 18')
+    return {'p': int(intPrecision), 'registers': np.zeros(2 ** intPrecision, dtype=np.uint8)}
+
+def hash_sketch_keys(arrKeys):
+    """
+    64-bit hashes of the keys 'arrKeys' (stable across processes and runs)
+    """
+    return pd.util.hash_array(np.asarray(arrKeys, dtype=object))
+
+def update_distinct_sketch(sketch, arrKeys):
+    """
+    Add the keys 'arrKeys' (missing keys are skipped) to 'sketch' (in place); returns the sketch
+    """
+    arrKeys = np.asarray(arrKeys, dtype=object)
+    arrKeys = arrKeys[pd.notna(arrKeys)]
+    if arrKeys.shape[0] == 0:
+        return sketch
+    intPrecision = sketch['p']
+    arrHashes = hash_sketch_keys(arrKeys)
+    arrRegisters = (arrHashes >> np.uint64(64 - intPrecision)).astype(np.int64)
+    ### rank: position of the first set bit of the remaining (64 - p) bits, (64 - p + 1) if none is set
+    arrBits = arrHashes & np.uint64((1 << (64 - intPrecision)) - 1)
+    arrBitLength = np.zeros(arrBits.shape[0], dtype=np.int64)
+    for intShift in [32, 16, 8, 4, 2, 1]:
+        mskHigh = arrBits >= np.uint64(1 << intShift)
+        arrBits[mskHigh] >>= np.uint64(intShift)
+        arrBitLength[mskHigh] += intShift
+    arrBitLength += (arrBits > 0)
+    arrRanks = (64 - intPrecision - arrBitLength + 1).astype(np.uint8)
+    np.maximum.at(sketch['registers'], arrRegisters, arrRanks)
+    return sketch
+
+def merge_distinct_sketches(sketchA, sketchB):
+    """
+    New distinct-count sketch of the keys of both sketches (same precision)
+    """
+    if sketchA['p'] != sketchB['p']:
+        raise ValueError(f'Distinct sketches with different precision ({sketchA["p"]}, {sketchB["p"]}) cannot be merged')
+    return {'p': sketchA['p'], 'registers': np.maximum(sketchA['registers'], sketchB['registers'])}
+
+def distinct_sketch_count(sketch):
+    """
+    Approximate number of distinct keys added to 'sketch' (linear counting for small counts)
+    """
+    intNumRegisters = sketch['registers'].shape[0]
+    fltAlpha = 0.7213 / (1 + 1.079 / intNumRegisters)
+    fltEstimate = fltAlpha * intNumRegisters ** 2 / np.sum(np.ldexp(1.0, -sketch['registers'].astype(np.int64)))
+    intZeros = int(np.count_nonzero(sketch['registers'] == 0))
+    if fltEstimate <= 2.5 * intNumRegisters and intZeros > 0:
+        fltEstimate = intNumRegisters * np.log(intNumRegisters / intZeros)
+    return float(fltEstimate)
+
+def new_group_sketches():
+    """
+    Empty group sketches: {group key tuple: {'quantiles': {column: quantile sketch}, 'distinct': distinct sketch}}
+    """
+    return dict()
+
+def update_group_sketches(config, dctSketches, df, lstGroupCols=None, lstValueCols=None, strKeyCol=None):
+    """
+    Add the rows 'df' to the group sketches 'dctSketches' (in place); rows with a missing group value are skipped.
+
+    Arguments:
+        'lstGroupCols': group columns (default: 'lstSketchGroupCols')
+        'lstValueCols': columns with quantile sketches (default: config['sketches']['value-columns'])
+        'strKeyCol': column with the distinct-count sketch (default: 'strSketchKeyCol')
+    Sketch sizes are config['sketches'] 'quantile-k' and 'distinct-precision'.
+    """
+    if lstGroupCols is None:
+        lstGroupCols = lstSketchGroupCols
+    if lstValueCols is None:
+        lstValueCols = config['sketches']['value-columns']
+    if strKeyCol is None:
+        strKeyCol = strSketchKeyCol
+    ### row positions of every group; columns are converted to arrays once for all groups
+    dctValues = {col: df[col].to_numpy(dtype=np.float64) for col in lstValueCols}
+    arrKeys = df[strKeyCol].to_numpy(dtype=object)
+    for (tplGroup, arrRows) in df.groupby(lstGroupCols, sort=False).indices.items():
+        tplGroup = tplGroup if isinstance(tplGroup, tuple) else (tplGroup,)
+        tplGroup = tuple(val.item() if isinstance(val, np.generic) else val for val in tplGroup)
+        if tplGroup not in dctSketches:
+            dctSketches[tplGroup] = {'quantiles': {col: new_quantile_sketch(config['sketches']['quantile-k'])
+                                                   for col in lstValueCols},
+                                     'distinct': new_distinct_sketch(config['sketches']['distinct-precision'])}
+        dctGroup = dctSketches[tplGroup]
+        for col in lstValueCols:
+            update_quantile_sketch(dctGroup['quantiles'][col], dctValues[col][arrRows])
+        update_distinct_sketch(dctGroup['distinct'], arrKeys[arrRows])
+    return dctSketches
+
+def merge_group_sketch(dctGroupA, dctGroupB):
+    return {'quantiles': {col: merge_quantile_sketches(dctGroupA['quantiles'][col], dctGroupB['quantiles'][col])
+                          for col in dctGroupA['quantiles']},
+            'distinct': merge_distinct_sketches(dctGroupA['distinct'], dctGroupB['distinct'])}
+
+def merge_group_sketches(*lstSketches):
+    """
+    New group sketches with the groups of all 'lstSketches' (e.g. of several chunks, partitions or workers);
+    sketches of the same group are merged
+    """
+    dctMerged = new_group_sketches()
+    for dctSketches in lstSketches:
+        for (tplGroup, dctGroup) in dctSketches.items():
+            dctMerged[tplGroup] = dctGroup if tplGroup not in dctMerged else merge_group_sketch(dctMerged[tplGroup], dctGroup)
+    return dctMerged
+
+def rollup_group_sketches(dctSketches, strBy='genres', lstGroupCols=None, yearRange=None):
+    """
+    Merge the group sketches into one sketch per value of group column 'strBy'.
+    'yearRange' (first year, last year), both included, keeps only the groups of those years
+    (group column 'year'). Returns {(value,): group sketch}.
+    """
+    if lstGroupCols is None:
+        lstGroupCols = lstSketchGroupCols
+    if strBy not in lstGroupCols:
+        raise ValueError(f'Argument "strBy" {strBy} must be one of {lstGroupCols}')
+    intBy = lstGroupCols.index(strBy)
+    intYear = lstGroupCols.index('year') if yearRange is not None else None
+    dctRollup = new_group_sketches()
+    for (tplGroup, dctGroup) in dctSketches.items():
+        if intYear is not None and not yearRange[0] <= tplGroup[intYear] <= yearRange[1]:
+            continue
+        tplKey = (tplGroup[intBy],)
+        dctRollup[tplKey] = dctGroup if tplKey not in dctRollup else merge_group_sketch(dctRollup[tplKey], dctGroup)
+    return dctRollup
+
+def group_sketch_quantiles(dctSketches, strCol, lstQuantiles, lstGroupCols=None):
+    """
+    Approximate quantiles of column 'strCol' per group: returns a DataFrame with the group columns,
+    'count' (values of 'strCol'), 'distinct_titles' (approximate distinct keys), 'min', 'max' and
+    one column per quantile ('q0.5', 'q0.9', ...). 'lstGroupCols' names the group columns
+    (default: 'lstSketchGroupCols', or ['<strBy>'] for a single-column roll-up).
+    """
+    lstRows = list()
+    for (tplGroup, dctGroup) in dctSketches.items():
+        sketch = dctGroup['quantiles'][strCol]
+        lstRows.append(list(tplGroup) + [sketch['n'], distinct_sketch_count(dctGroup['distinct']),
+                                         sketch['min'] if sketch['n'] > 0 else np.nan,
+                                         sketch['max'] if sketch['n'] > 0 else np.nan] +
+                       quantile_sketch_values(sketch, lstQuantiles).tolist())
+    if lstGroupCols is None:
+        intNumGroupCols = len(next(iter(dctSketches))) if len(dctSketches) > 0 else len(lstSketchGroupCols)
+        lstGroupCols = lstSketchGroupCols if intNumGroupCols == len(lstSketchGroupCols) else ['group']
+    lstCols = list(lstGroupCols) + ['count','distinct_titles','min','max'] + [f'q{q:g}' for q in lstQuantiles]
+    return pd.DataFrame(lstRows, columns=lstCols)
+
+def group_sketches_file_location(config):
+    return os.path.join(config['folders']['data-csv'], config['files-merge']['sketches'])
+
+def write_group_sketches(config, dctSketches):
+    """
+    Pickle the group sketches to config['files-merge']['sketches'] with the fingerprint of the merged file they
+    were built from ('utils.file_fingerprint', see 'load_group_sketches')
+    """
+    strMergedPath = os.path.join(config['folders']['data-csv'], config['files-merge']['clean-csv'])
+    with open(group_sketches_file_location(config), mode='wb') as fileSketches:
+        pickle.dump({'merged_fingerprint': utils.file_fingerprint(strMergedPath), 'group_cols': lstSketchGroupCols,
+                     'sketches': dctSketches}, fileSketches, protocol=pickle.HIGHEST_PROTOCOL)
+    return None
+
+def load_group_sketches(config):
+    """
+    Load the group sketches written by 'write_group_sketches'.
+    Returns None if there are no sketches or if they were built from a different merged file (the fingerprint
+    of the merged file differs, see 'utils.file_fingerprint_matches'). Loaded sketches are kept in memory until
+    the file changes.
+    """
+    strFilePath = group_sketches_file_location(config)
+    strMergedPath = os.path.join(config['folders']['data-csv'], config['files-merge']['clean-csv'])
+    if not (os.path.exists(strFilePath) and os.path.exists(strMergedPath)):
+        return None
+    intMtime = os.stat(strFilePath).st_mtime_ns
+    if dctGroupSketchCache.get(strFilePath, (None, None))[0] != intMtime:
+        with open(strFilePath, mode='rb') as fileSketches:
+            dctGroupSketchCache[strFilePath] = (intMtime, pickle.load(fileSketches))
+    dctStored = dctGroupSketchCache[strFilePath][1]
+    if not utils.file_fingerprint_matches(dctStored.get('merged_fingerprint'), strMergedPath):
+        return None
+    return dctStored['sketches']
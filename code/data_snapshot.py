@@ -0,0 +1,244 @@
+"""
+This module keeps versioned snapshots of the clean data files written by
+"prepare_clean_data(config)" and "merge_clean_data(config)" (see data_preparation.py).
+
+## Content-addressed chunks
+Every file is cut into chunks of whole lines. A line ends a chunk when the hash of its content is
+divisible by config['snapshots']['chunk-rows-avg'] (plus a cut every 'chunk-rows-max' lines), so the
+chunk boundaries depend on the data and not on row positions: an inserted or removed title only
+changes the chunk it falls into. The header line is a chunk of its own. Chunks are stored once under
+the SHA-256 of their bytes (zlib compressed), and a snapshot is a manifest listing the chunks of each
+file. Snapshots of unchanged or slightly changed data therefore share almost all their chunks.
+
+## Diffs
+'diff_snapshots' compares two snapshots of one file keyed by 'tconst' (or other key columns). Rows of
+chunks present in both snapshots are identical and are skipped; only the other chunks are parsed and
+joined on the key.
+
+Example:
+    strOld = data_snapshot.create_snapshot(config, 'before threshold change')
+    ... prepare_clean_data(config); merge_clean_data(config) ...
+    strNew = data_snapshot.create_snapshot(config, 'after threshold change')
+    dfDiff = data_snapshot.diff_snapshots(config, strOld, strNew, 'merged')
+"""
+
+import io
+import os
+import json
+import zlib
+import hashlib
+import datetime
+import pandas as pd
+import numpy as np
+
+### Files kept in a snapshot: config keys of the file name (folder config['folders']['data-csv'])
+dctSnapshotFiles = {
+    'imdb-title-basics':  ['files-imdb','csv','clean-title-base'],
+    'imdb-title-ratings': ['files-imdb','csv','clean-title-rate'],
+    'bom-movie-gross':    ['files-bom','clean-csv'],
+    'tn-movie-budgets':   ['files-tn','clean-csv'],
+    'merged':             ['files-merge','clean-csv'],
+    'merged-index':       ['files-merge','clean-index']
+}
+
+def snapshot_file_location(config, strFileKey):
+    """
+    Location of the clean file 'strFileKey' (a key of 'dctSnapshotFiles')
+    """
+    strFileName = config
+    for strKey in dctSnapshotFiles[strFileKey]:
+        strFileName = strFileName[strKey]
+    return os.path.join(config['folders']['data-csv'], strFileName)
+
+def snapshot_folder(config):
+    return os.path.join(config['folders']['data-csv'], config['snapshots']['folder'])
+
+def chunk_file_location(config, strChunkHash):
+    return os.path.join(snapshot_folder(config), 'chunks', strChunkHash[:2], f'{strChunkHash}.z')
+
+def split_content_defined_chunks(bytesData, intAvgRows, intMaxRows):
+    """
+    Byte offsets of the chunk ends of 'bytesData' (whole lines; the first line is its own chunk).
+    A line ends a chunk if its hash is divisible by 'intAvgRows'; chunks are cut after 'intMaxRows' lines.
+    """
+    arrLineEnds = np.flatnonzero(np.frombuffer(bytesData, dtype=np.uint8) == ord('\n')) + 1
+    if arrLineEnds.shape[0] == 0 or arrLineEnds[-1] != len(bytesData):
+        arrLineEnds = np.append(arrLineEnds, len(bytesData))
+    if len(bytesData) == 0:
+        return np.zeros(0, dtype=np.int64)
+    ### hash of every body line (header excluded)
+    arrLines = np.array(bytesData[arrLineEnds[0]:].decode('utf-8').split('\n')[:arrLineEnds.shape[0]-1], dtype=object)
+    arrHash = pd.util.hash_array(arrLines)
+    arrCuts = np.flatnonzero(arrHash % np.uint64(intAvgRows) == 0) + 1
+    arrCuts = np.concatenate([[0], arrCuts, [arrLines.shape[0]]])
+    ### cut long runs every 'intMaxRows' lines
+    lstCuts = [np.arange(intStart, intEnd, intMaxRows) for (intStart, intEnd) in zip(arrCuts[:-1], arrCuts[1:])]
+    arrCuts = np.unique(np.concatenate(lstCuts + [arrCuts[-1:]]))
+    ### line numbers (body) to byte offsets; header line 0 is one chunk
+    return np.concatenate([arrLineEnds[:1], arrLineEnds[arrCuts[arrCuts > 0]]]).astype(np.int64)
+
+def write_chunk(config, bytesChunk):
+    """
+    Store 'bytesChunk' under its SHA-256 unless it is already stored. Returns the hash.
+    """
+    strChunkHash = hashlib.sha256(bytesChunk).hexdigest()
+    strFilePath = chunk_file_location(config, strChunkHash)
+    if not os.path.exists(strFilePath):
+        os.makedirs(os.path.dirname(strFilePath), exist_ok=True)
+        strTempPath = strFilePath + '.tmp'
+        with open(strTempPath, mode='wb') as fileChunk:
+            fileChunk.write(zlib.compress(bytesChunk, 1))
+        os.replace(strTempPath, strFilePath)
+    return strChunkHash
+
+def read_chunk(config, strChunkHash):
+    with open(chunk_file_location(config, strChunkHash), mode='rb') as fileChunk:
+        return zlib.decompress(fileChunk.read())
+
+def create_snapshot(config, strLabel=''):
+    """
+    Snapshot the current clean files ('dctSnapshotFiles'; missing files are skipped).
+    Only chunks not stored by an earlier snapshot are written.
+    Returns the snapshot id "<UTC time>-<hash prefix>".
+    """
+    dctConfig = config['snapshots']
+    dctFiles = dict()
+    intNewBytes = 0
+    for strFileKey in dctSnapshotFiles:
+        strFilePath = snapshot_file_location(config, strFileKey)
+        if not os.path.exists(strFilePath):
+            continue
+        with open(strFilePath, mode='rb') as fileData:
+            bytesData = fileData.read()
+        arrChunkEnds = split_content_defined_chunks(bytesData, dctConfig['chunk-rows-avg'], dctConfig['chunk-rows-max'])
+        lstChunks = list()
+        intStart = 0
+        for intEnd in arrChunkEnds:
+            blnNew = not os.path.exists(chunk_file_location(config, hashlib.sha256(bytesData[intStart:intEnd]).hexdigest()))
+            lstChunks.append(write_chunk(config, bytesData[intStart:intEnd]))
+            intNewBytes += (intEnd - intStart) if blnNew else 0
+            intStart = intEnd
+        dctFiles[strFileKey] = {'file': os.path.basename(strFilePath), 'bytes': len(bytesData),
+                                'sha256': hashlib.sha256(bytesData).hexdigest(), 'chunks': lstChunks}
+
+    strCreated = datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%dT%H%M%S')
+    strManifest = json.dumps(dctFiles, sort_keys=True)
+    strSnapshotId = f'{strCreated}-{hashlib.sha256(strManifest.encode("utf-8")).hexdigest()[:8]}'
+    dctManifest = {'id': strSnapshotId, 'created': strCreated, 'label': strLabel,
+                   'new-bytes': int(intNewBytes), 'files': dctFiles}
+    os.makedirs(os.path.join(snapshot_folder(config), 'manifests'), exist_ok=True)
+    with open(os.path.join(snapshot_folder(config), 'manifests', f'{strSnapshotId}.json'), mode='w', encoding='utf-8') as fileManifest:
+        json.dump(dctManifest, fileManifest, indent=4)
+    return strSnapshotId
+
+def read_snapshot_manifest(config, strSnapshotId):
+    strFilePath = os.path.join(snapshot_folder(config), 'manifests', f'{strSnapshotId}.json')
+    if not os.path.exists(strFilePath):
+        raise ValueError(f'Snapshot "{strSnapshotId}" does not exist in {snapshot_folder(config)}')
+    with open(strFilePath, mode='r', encoding='utf-8') as fileManifest:
+        return json.load(fileManifest)
+
+def list_snapshots(config):
+    """
+    Returns a DataFrame with one row per snapshot: 'id', 'created', 'label', 'files',
+    'bytes' (size of the files) and 'new_bytes' (bytes of the chunks first stored by the snapshot)
+    """
+    strFolder = os.path.join(snapshot_folder(config), 'manifests')
+    lstRows = list()
+    if os.path.exists(strFolder):
+        for strFileName in sorted(os.listdir(strFolder)):
+            dctManifest = read_snapshot_manifest(config, strFileName[:-len('.json')])
+            lstRows.append({'id': dctManifest['id'], 'created': dctManifest['created'], 'label': dctManifest['label'],
+                            'files': len(dctManifest['files']),
+                            'bytes': sum([dctFile['bytes'] for dctFile in dctManifest['files'].values()]),
+                            'new_bytes': dctManifest['new-bytes']})
+    return pd.DataFrame(lstRows, columns=['id','created','label','files','bytes','new_bytes'])
+
+def read_snapshot_file(config, strSnapshotId, strFileKey):
+    """
+    Bytes of file 'strFileKey' in snapshot 'strSnapshotId'
+    """
+    dctFile = read_snapshot_manifest(config, strSnapshotId)['files'][strFileKey]
+    return b''.join([read_chunk(config, strChunkHash) for strChunkHash in dctFile['chunks']])
+
+def restore_snapshot(config, strSnapshotId, lstFileKeys=None):
+    """
+    Roll back the clean files to snapshot 'strSnapshotId' ('lstFileKeys': default all files of the snapshot).
+    Each restored file is checked against the SHA-256 recorded in the snapshot.
+    """
+    dctManifest = read_snapshot_manifest(config, strSnapshotId)
+    if lstFileKeys is None:
+        lstFileKeys = list(dctManifest['files'])
+    for strFileKey in lstFileKeys:
+        bytesData = read_snapshot_file(config, strSnapshotId, strFileKey)
+        if hashlib.sha256(bytesData).hexdigest() != dctManifest['files'][strFileKey]['sha256']:
+            raise ValueError(f'Snapshot "{strSnapshotId}": file "{strFileKey}" does not match its checksum')
+        with open(snapshot_file_location(config, strFileKey), mode='wb') as fileData:
+            fileData.write(bytesData)
+    return None
+
+def delete_snapshot(config, strSnapshotId):
+    """
+    Delete snapshot 'strSnapshotId' and the chunks no other snapshot refers to.
+    Returns the number of chunks removed.
+    """
+    read_snapshot_manifest(config, strSnapshotId)
+    os.remove(os.path.join(snapshot_folder(config), 'manifests', f'{strSnapshotId}.json'))
+    setReferenced = set()
+    for strOtherId in list_snapshots(config)['id']:
+        for dctFile in read_snapshot_manifest(config, strOtherId)['files'].values():
+            setReferenced.update(dctFile['chunks'])
+    intRemoved = 0
+    strChunkFolder = os.path.join(snapshot_folder(config), 'chunks')
+    for strSubFolder in os.listdir(strChunkFolder):
+        for strFileName in os.listdir(os.path.join(strChunkFolder, strSubFolder)):
+            if strFileName[:-len('.z')] not in setReferenced:
+                os.remove(os.path.join(strChunkFolder, strSubFolder, strFileName))
+                intRemoved += 1
+    return intRemoved
+
+def diff_snapshots(config, strSnapshotA, strSnapshotB, strFileKey='merged', lstKeyCols=None):
+    """
+    Rows added, removed and changed in file 'strFileKey' from snapshot 'strSnapshotA' to 'strSnapshotB'.
+
+    Arguments:
+        'lstKeyCols': columns identifying a row (default ['tconst']; e.g. ['title','year'] for the BOM
+                      and TN files). Keys are expected to be unique within a file.
+    Only chunks which are not in both snapshots are read: a shared chunk holds the same rows in both.
+    Rows are compared as text (the values written to the file).
+    Returns a DataFrame sorted by key with the key columns, 'change' ('added', 'removed', 'changed') and
+    'changed_columns' (comma-separated names of the columns whose values differ; empty unless 'changed').
+    """
+    if lstKeyCols is None:
+        lstKeyCols = ['tconst']
+    lstChunksA = read_snapshot_manifest(config, strSnapshotA)['files'][strFileKey]['chunks']
+    lstChunksB = read_snapshot_manifest(config, strSnapshotB)['files'][strFileKey]['chunks']
+    setShared = set(lstChunksA[1:]) & set(lstChunksB[1:])
+
+    def load_unshared_rows(lstChunks):
+        ### header chunk + chunks not shared with the other snapshot, parsed as text
+        bytesData = b''.join([read_chunk(config, lstChunks[0])] +
+                             [read_chunk(config, h) for h in lstChunks[1:] if h not in setShared])
+        return pd.read_csv(io.BytesIO(bytesData), encoding='utf-8', dtype=str, keep_default_na=False)
+
+    dfA = load_unshared_rows(lstChunksA)
+    dfB = load_unshared_rows(lstChunksB)
+    lstCompareCols = [col for col in dfA.columns if col in dfB.columns and col not in lstKeyCols]
+    dfA['_row_hash'] = pd.util.hash_pandas_object(dfA.loc[:, lstCompareCols], index=False).to_numpy()
+    dfB['_row_hash'] = pd.util.hash_pandas_object(dfB.loc[:, lstCompareCols], index=False).to_numpy()
+
+    df = pd.merge(dfA, dfB, how='outer', on=lstKeyCols, suffixes=('_a','_b'), indicator=True)
+    mskChanged = (df['_merge'] == 'both') & (df['_row_hash_a'] != df['_row_hash_b'])
+    df = df.loc[(df['_merge'] != 'both') | mskChanged]
+    mskChanged = mskChanged.loc[df.index].to_numpy()
+    df['change'] = df['_merge'].map({'left_only':'removed','right_only':'added','both':'changed'}).astype(str)
+
+    ### names of the changed columns, one vectorized comparison per column
+    arrChangedCols = np.full(df.shape[0], '', dtype=object)
+    for col in lstCompareCols:
+        mskCol = mskChanged & (df[f'{col}_a'].to_numpy() != df[f'{col}_b'].to_numpy())
+        arrChangedCols[mskCol] = arrChangedCols[mskCol] + np.where(arrChangedCols[mskCol] == '', '', ',') + col
+    df['changed_columns'] = arrChangedCols
+
+    df = df.loc[:, lstKeyCols + ['change','changed_columns']].sort_values(lstKeyCols, kind='stable')
+    return df.reset_index(drop=True)
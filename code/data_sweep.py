@@ -0,0 +1,317 @@
+"""
+This module evaluates many variants of the config thresholds in one run.
+
+The thresholds
+    'title-release-year-min', 'title-release-year-max',
+    'runtime-minutes-min', 'runtime-minutes-max',
+    'rating-votes-min', 'rating-numvotes-pertitle-min'
+are applied by the "prep" functions before the clean files are written, so every variant
+would normally need a full run of "prepare_clean_data(config)" and "merge_clean_data(config)".
+Here the raw files are cleaned once without the threshold filters ('load_sweep_data').
+Which title gets a revenue row depends on the titles and revenue rows left by the filters, so
+the revenue is matched once per combination of the thresholds applied before the merge
+('lstSweepMatchKeys', see 'match_sweep_revenue'); every variant of that combination is then
+evaluated as a set of vectorized masks over the shared arrays ('sweep_config_thresholds').
+Match groups are spread over a process pool. 'compare_sweep_with_pipeline' checks the variant
+of the current config against the merged data set.
+
+Example:
+    dctGrid = {'title-release-year-min': [2010, 2012, 2014], 'runtime-minutes-min': [25, 60, 90]}
+    dfSweep = data_sweep.sweep_config_thresholds(config, dctGrid)
+"""
+
+import os
+import itertools
+import concurrent.futures
+import pandas as pd
+import numpy as np
+import data_preparation as dataprep
+
+### Config keys which can be varied by the sweep
+lstSweepConfigKeys = ['title-release-year-min', 'title-release-year-max',
+                      'runtime-minutes-min', 'runtime-minutes-max',
+                      'rating-votes-min', 'rating-numvotes-pertitle-min']
+
+### Config keys applied before titles are matched to revenue: titles (year, runtime), ratings (votes;
+### 'numvotes' breaks ties between titles claiming the same revenue row) and revenue rows (year)
+lstSweepMatchKeys = ['title-release-year-min', 'title-release-year-max',
+                     'runtime-minutes-min', 'runtime-minutes-max', 'rating-votes-min']
+
+### Statistics of 'evaluate_sweep_variant' compared by 'compare_sweep_with_pipeline'
+lstSweepStatCols = ['title_count', 'revenue_title_count', 'worldwide_gross_sum', 'worldwide_gross_mean',
+                    'rating_title_count', 'rating_numvotes_sum', 'wavgrating',
+                    'budget_title_count', 'production_budget_sum', 'roi']
+
+### Shared data of a worker process (set by 'init_sweep_worker')
+dctSweepWorkerData = dict()
+
+def load_sweep_data(config):
+    """
+    Clean the raw IMDB, BOM and TN files without the threshold filters. No clean file is written.
+    Returns the tuple
+        (titles joined with ratings: 'tconst', 'title' (CAPS), 'year', 'runtime_minutes', 'genres', 'rating', 'numvotes';
+         combined revenue of all release years, see 'dataprep.combine_clean_bom_and_tn_revenue_data')
+    Titles are matched to revenue per variant, see 'match_sweep_revenue'.
+    """
+    dfTitles = dataprep.prep_imdb_title_basics(config, applyThresholds=False, writeFile=False)
+    if not isinstance(dfTitles, pd.DataFrame):
+        ### parsed in chunks under the memory budget: only the clean chunks are kept
+        dfTitles = pd.concat(list(dfTitles), axis=0)
+    dfRating = dataprep.prep_imdb_title_ratings(config, applyThresholds=False, writeFile=False)
+    dfB = dataprep.prep_bom_movie_gross(config, applyThresholds=False, writeFile=False)
+    dfT = dataprep.prep_tn_movie_budgets(config, applyThresholds=False, writeFile=False)
+    ### same data types as the loaders of the clean files
+    dfB = dfB.astype({'year':np.uint16,'domestic_gross':np.uint64,'foreign_gross':np.uint64})
+    dfT = dfT.astype({'year':np.uint16,'domestic_gross':np.uint64,'foreign_gross':np.uint64})
+    dfRevenue = dataprep.combine_clean_bom_and_tn_revenue_data(config, dfB, dfT)
+    df = dataprep.join_titles_and_ratings(dfTitles, dfRating).reset_index(drop=True)
+    return df, dfRevenue
+
+def sweep_data_to_arrays(tplSweepData, intYearWindow):
+    """
+    Convert the output of 'load_sweep_data' to the dictionary of data shared by the workers:
+    NumPy arrays of the titles ('year', 'runtime_minutes', 'rating', 'numvotes'; genres as integer codes
+    'genre_codes' with names in 'genre_names'), the frames matched per variant ('titles', 'revenue') and
+    the year window of the match 'revenue_year_window' (config['files-merge']['revenue-year-window']).
+    """
+    df, dfRevenue = tplSweepData
+    arrGenreCodes, idxGenreNames = pd.factorize(df['genres'])
+    dctArrays = {
+        'genre_codes': arrGenreCodes.astype(np.int32),
+        'genre_names': np.asarray(idxGenreNames, dtype=object),
+        'year': df['year'].to_numpy(dtype=np.float64),
+        'runtime_minutes': df['runtime_minutes'].to_numpy(dtype=np.float64),
+        'rating': df['rating'].to_numpy(dtype=np.float64),
+        'numvotes': df['numvotes'].to_numpy(dtype=np.float64),
+        'titles': df.loc[:, ['tconst','title','year']],
+        'revenue': dfRevenue,
+        'revenue_year_window': intYearWindow
+    }
+    return dctArrays
+
+def init_sweep_worker(dctArrays):
+    """
+    Process pool initializer: keep the shared data in the worker for all its variants
+    """
+    dctSweepWorkerData.clear()
+    dctSweepWorkerData.update(dctArrays)
+    return None
+
+def title_threshold_mask(dctArrays, dctVariant):
+    """
+    Titles kept by 'prep_imdb_title_basics' with the year and runtime thresholds of 'dctVariant'
+    """
+    arrYear = dctArrays['year']
+    arrRuntime = dctArrays['runtime_minutes']
+    return ( (arrYear >= dctVariant['title-release-year-min']) & (arrYear <= dctVariant['title-release-year-max']) & \
+             (arrRuntime >= dctVariant['runtime-minutes-min']) & (arrRuntime <= dctVariant['runtime-minutes-max']) & \
+             (dctArrays['genre_codes'] >= 0) )
+
+def match_sweep_revenue(dctArrays, dctVariant):
+    """
+    Match titles to revenue as 'merge_clean_data' does with the thresholds 'lstSweepMatchKeys' of 'dctVariant':
+    only titles within the year and runtime bounds, revenue rows within the year bounds and ratings with
+    enough votes take part in 'dataprep.merge_title_and_revenue'.
+    Returns {'worldwide_gross', 'production_budget'}: arrays over all titles, NaN for titles without revenue
+    or outside the bounds.
+    """
+    mskTitle = title_threshold_mask(dctArrays, dctVariant)
+    ### ratings below 'rating-votes-min' are dropped before the join, so their titles have no votes
+    arrNumvotes = dctArrays['numvotes'][mskTitle]
+    arrNumvotes = np.where(arrNumvotes >= dctVariant['rating-votes-min'], arrNumvotes, np.nan)
+    dfTitles = dctArrays['titles'].loc[mskTitle].assign(numvotes=arrNumvotes)
+    dfRevenue = dctArrays['revenue']
+    mskRevenueYear = ( (dfRevenue['year'] >= dctVariant['title-release-year-min']) & \
+                       (dfRevenue['year'] <= dctVariant['title-release-year-max']) )
+    dfMatched, fltBlowup = dataprep.merge_title_and_revenue(dfTitles, dfRevenue.loc[mskRevenueYear],
+                                                            dctArrays['revenue_year_window'])
+
+    dctRevenue = dict()
+    dctRevenue['worldwide_gross'] = np.full(mskTitle.shape[0], np.nan)
+    dctRevenue['worldwide_gross'][mskTitle] = dfMatched['domestic_gross'].add(dfMatched['foreign_gross'], fill_value=0)
+    dctRevenue['production_budget'] = np.full(mskTitle.shape[0], np.nan)
+    dctRevenue['production_budget'][mskTitle] = dfMatched['production_budget']
+    return dctRevenue
+
+def evaluate_sweep_variant(dctArrays, dctRevenue, dctVariant):
+    """
+    Evaluate one threshold variant as masks over the shared arrays, with the revenue 'dctRevenue' matched
+    for its thresholds (see 'match_sweep_revenue').
+    Returns a DataFrame with one row per genre:
+        'genres', 'title_count', 'revenue_title_count', 'worldwide_gross_sum', 'worldwide_gross_mean',
+        'rating_title_count', 'rating_numvotes_sum', 'wavgrating',
+        'budget_title_count', 'production_budget_sum', 'roi' (pooled over the titles with a known budget)
+    Genres with no title in the variant are dropped.
+    """
+    arrCodes = dctArrays['genre_codes']
+    intNumGenres = len(dctArrays['genre_names'])
+    arrRating = dctArrays['rating']
+    arrNumvotes = dctArrays['numvotes']
+    arrGross = dctRevenue['worldwide_gross']
+    arrBudget = dctRevenue['production_budget']
+
+    ### Title thresholds (prep_imdb_title_basics)
+    mskTitle = title_threshold_mask(dctArrays, dctVariant)
+    ### Titles with matched revenue; revenue rows are within the year bounds (NaN comparisons are False)
+    mskRevenue = ( mskTitle & (np.isnan(arrGross)==False) )
+    ### Ratings kept by prep_imdb_title_ratings and used by the charts
+    fltNumvotesMin = max(dctVariant['rating-votes-min'], dctVariant['rating-numvotes-pertitle-min'])
+    mskRating = ( mskTitle & (np.isnan(arrRating)==False) & (arrNumvotes >= fltNumvotesMin) )
+    ### Revenue titles with a known production budget (NaN comparison is False)
+    mskBudget = ( mskRevenue & (arrBudget > 0) )
+
+    arrTitleCount = np.bincount(arrCodes[mskTitle], minlength=intNumGenres)
+    arrRevenueCount = np.bincount(arrCodes[mskRevenue], minlength=intNumGenres)
+    arrRevenueSum = np.bincount(arrCodes[mskRevenue], weights=arrGross[mskRevenue], minlength=intNumGenres)
+    arrRatingCount = np.bincount(arrCodes[mskRating], minlength=intNumGenres)
+    arrNumvotesSum = np.bincount(arrCodes[mskRating], weights=arrNumvotes[mskRating], minlength=intNumGenres)
+    arrRatingVotesSum = np.bincount(arrCodes[mskRating], weights=arrRating[mskRating]*arrNumvotes[mskRating],
+                                    minlength=intNumGenres)
+    arrBudgetCount = np.bincount(arrCodes[mskBudget], minlength=intNumGenres)
+    arrBudgetSum = np.bincount(arrCodes[mskBudget], weights=arrBudget[mskBudget], minlength=intNumGenres)
+    arrBudgetGrossSum = np.bincount(arrCodes[mskBudget], weights=arrGross[mskBudget], minlength=intNumGenres)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        df = pd.DataFrame({'genres': dctArrays['genre_names'],
+                           'title_count': arrTitleCount,
+                           'revenue_title_count': arrRevenueCount,
+                           'worldwide_gross_sum': arrRevenueSum,
+                           'worldwide_gross_mean': arrRevenueSum / arrRevenueCount,
+                           'rating_title_count': arrRatingCount,
+                           'rating_numvotes_sum': arrNumvotesSum,
+                           'wavgrating': arrRatingVotesSum / arrNumvotesSum,
+                           'budget_title_count': arrBudgetCount,
+                           'production_budget_sum': arrBudgetSum,
+                           'roi': (arrBudgetGrossSum - arrBudgetSum) / arrBudgetSum})
+    return df.loc[df['title_count'] > 0]
+
+def evaluate_sweep_variants_in_worker(lstVariants):
+    """
+    Worker task: evaluate a list of (variant id, variant) pairs with the same match thresholds
+    ('lstSweepMatchKeys') against the worker's shared data; the revenue is matched once for all of them
+    """
+    dctRevenue = match_sweep_revenue(dctSweepWorkerData, lstVariants[0][1])
+    lstFrames = list()
+    for (intVariant, dctVariant) in lstVariants:
+        df = evaluate_sweep_variant(dctSweepWorkerData, dctRevenue, dctVariant)
+        df.insert(0, 'variant', intVariant)
+        lstFrames.append(df)
+    return lstFrames
+
+def generate_sweep_variants(config, dctGrid):
+    """
+    Expand 'dctGrid' {config key: list of values} into a list of variants (dictionaries over
+    'lstSweepConfigKeys'). Keys missing from 'dctGrid' keep their config value.
+    """
+    for strKey in dctGrid:
+        if strKey not in lstSweepConfigKeys:
+            raise KeyError(f'"{strKey}" cannot be swept; valid keys: {lstSweepConfigKeys}')
+    lstValueLists = [list(dctGrid.get(strKey, [config[strKey]])) for strKey in lstSweepConfigKeys]
+    return [dict(zip(lstSweepConfigKeys, tplValues)) for tplValues in itertools.product(*lstValueLists)]
+
+def group_sweep_variants(lstVariants):
+    """
+    Group the (variant id, variant) pairs of 'lstVariants' by their match thresholds ('lstSweepMatchKeys').
+    Returns a list of groups in order of first appearance.
+    """
+    dctGroups = dict()
+    for (intVariant, dctVariant) in enumerate(lstVariants):
+        tplMatch = tuple(dctVariant[strKey] for strKey in lstSweepMatchKeys)
+        dctGroups.setdefault(tplMatch, list()).append((intVariant, dctVariant))
+    return list(dctGroups.values())
+
+def sweep_config_thresholds(config, dctGrid, tplSweepData=None, numWorkers=None):
+    """
+    Evaluate every combination of thresholds in 'dctGrid' and return per-variant genre statistics.
+
+    Arguments:
+        'config': project config; its values are used for keys not in 'dctGrid'
+        'dctGrid': {config key: list of values}, keys from 'lstSweepConfigKeys'
+        'tplSweepData': optional output of 'load_sweep_data(config)' to reuse between sweeps
+        'numWorkers': number of worker processes (default: os.cpu_count()); 1 runs in-process
+    Returns a DataFrame with one row per (variant, genre): the variant id, the threshold values
+    of the variant and the statistics from 'evaluate_sweep_variant'.
+    """
+    lstVariants = generate_sweep_variants(config, dctGrid)
+    if tplSweepData is None:
+        tplSweepData = load_sweep_data(config)
+    dctArrays = sweep_data_to_arrays(tplSweepData, config['files-merge']['revenue-year-window'])
+    ### one task per match group: titles are matched to revenue once per task
+    lstTasks = group_sweep_variants(lstVariants)
+    if numWorkers is None:
+        numWorkers = os.cpu_count() or 1
+    numWorkers = max(1, min(numWorkers, len(lstTasks)))
+
+    lstFrames = list()
+    if numWorkers == 1:
+        init_sweep_worker(dctArrays)
+        for lstTask in lstTasks:
+            lstFrames.extend(evaluate_sweep_variants_in_worker(lstTask))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=numWorkers, initializer=init_sweep_worker,
+                                                    initargs=(dctArrays,)) as executor:
+            for lstTaskFrames in executor.map(evaluate_sweep_variants_in_worker, lstTasks):
+                lstFrames.extend(lstTaskFrames)
+
+    dfVariants = pd.DataFrame(lstVariants)
+    dfVariants.insert(0, 'variant', range(len(lstVariants)))
+    df = pd.concat(lstFrames, axis=0, ignore_index=True)
+    df = pd.merge(dfVariants, df, how='inner', on='variant').sort_values(['variant'], kind='stable')
+    return df.reset_index(drop=True)
+
+def pipeline_genre_statistics(config):
+    """
+    The statistics of 'evaluate_sweep_variant' computed with pandas from the merged data set written by
+    'merge_clean_data(config)'. Returns a DataFrame with one row per genre.
+    """
+    strFilePath = os.path.join(config['folders']['data-csv'], config['files-merge']['clean-csv'])
+    df = pd.read_csv(strFilePath, encoding='utf-8', usecols=['genres','rating','numvotes','worldwide_gross','production_budget'],
+                     dtype={'genres':str,'rating':np.float64,'numvotes':np.float64,
+                            'worldwide_gross':np.float64,'production_budget':np.float64})
+    fltNumvotesMin = max(config['rating-votes-min'], config['rating-numvotes-pertitle-min'])
+    mskRevenue = df['worldwide_gross'].notna()
+    mskRating = ( df['rating'].notna() & (df['numvotes'] >= fltNumvotesMin) )
+    mskBudget = ( mskRevenue & (df['production_budget'] > 0) )
+    df = df.assign(title=1,
+                   revenue=mskRevenue.astype(np.int64), gross=df['worldwide_gross'].where(mskRevenue, 0),
+                   rated=mskRating.astype(np.int64), votes=df['numvotes'].where(mskRating, 0),
+                   rating_votes=(df['rating']*df['numvotes']).where(mskRating, 0),
+                   budgeted=mskBudget.astype(np.int64), budget=df['production_budget'].where(mskBudget, 0),
+                   budget_gross=df['worldwide_gross'].where(mskBudget, 0))
+    dfSums = df.groupby('genres', sort=False)[['title','revenue','gross','rated','votes','rating_votes',
+                                                'budgeted','budget','budget_gross']].sum()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        dfStats = pd.DataFrame({'genres': dfSums.index,
+                                'title_count': dfSums['title'].to_numpy(),
+                                'revenue_title_count': dfSums['revenue'].to_numpy(),
+                                'worldwide_gross_sum': dfSums['gross'].to_numpy(),
+                                'worldwide_gross_mean': (dfSums['gross'] / dfSums['revenue']).to_numpy(),
+                                'rating_title_count': dfSums['rated'].to_numpy(),
+                                'rating_numvotes_sum': dfSums['votes'].to_numpy(),
+                                'wavgrating': (dfSums['rating_votes'] / dfSums['votes']).to_numpy(),
+                                'budget_title_count': dfSums['budgeted'].to_numpy(),
+                                'production_budget_sum': dfSums['budget'].to_numpy(),
+                                'roi': ((dfSums['budget_gross'] - dfSums['budget']) / dfSums['budget']).to_numpy()})
+    return dfStats
+
+def compare_sweep_with_pipeline(config, tplSweepData=None, fltRelTol=1e-6):
+    """
+    Check the sweep against the pipeline: the variant of the current config must give the statistics of the
+    merged data set written by 'prepare_clean_data(config)' and 'merge_clean_data(config)'.
+    Counts must be equal; sums and ratios may differ by 'fltRelTol' (ratings are parsed as float32
+    by 'prep_imdb_title_ratings' and written as text to the clean file).
+    Returns the genres with any differing statistic (empty if the sweep reproduces the pipeline):
+    columns 'genres', then '<statistic>_sweep' and '<statistic>_pipeline'.
+    """
+    dfSweep = sweep_config_thresholds(config, dict(), tplSweepData, numWorkers=1)
+    dfSweep = dfSweep.loc[:, ['genres'] + lstSweepStatCols]
+    df = pd.merge(dfSweep, pipeline_genre_statistics(config), how='outer', on='genres',
+                  suffixes=('_sweep','_pipeline'))
+    mskDiffer = np.zeros(df.shape[0], dtype=bool)
+    for col in lstSweepStatCols:
+        arrSweep = df[f'{col}_sweep'].to_numpy(dtype=np.float64)
+        arrPipeline = df[f'{col}_pipeline'].to_numpy(dtype=np.float64)
+        fltTol = 0.0 if col.endswith('_count') else fltRelTol
+        mskDiffer |= (np.isclose(arrSweep, arrPipeline, rtol=fltTol, atol=0.0, equal_nan=True)==False)
+    lstCols = ['genres'] + [f'{col}_{strSide}' for col in lstSweepStatCols for strSide in ['sweep','pipeline']]
+    return df.loc[mskDiffer, lstCols].reset_index(drop=True)
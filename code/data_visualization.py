@@ -10,102 +10,357 @@ Columns:
     'genres' - title assigned genre (may contain multi-genre entry)
     'domestic_gross' - revenue in the US market;
     'foreign_gross' - revenue in the entire foreign gross revenue;
+    'production_budget' - TN production budget (NaN if unknown);
+Derived columns materialized at merge time (see 'data_preparation.add_merged_derived_columns'):
+    'worldwide_gross' - domestic plus foreign gross revenue;
+    'rating_times_numvotes', 'ratingsqrd_times_numvotes' - terms of the vote-weighted rating;
+    'profit', 'roi', 'profit_margin' - profitability against the production budget;
+    'valid_flags' - validity bitmask used with 'data_preparation.valid_flags_filter'
+Genre-level charts answer from the aggregate cube (see 'data_preparation.rollup_aggregate_cube') when
+"merge_clean_data" wrote one for the current merged file, and from the title-level rows otherwise.
+Approximate genre quantiles (median, p90, p99) come from the sketches of data_sketch.py.
 """
 
-from cProfile import label
-from cmath import isnan
 import os
 import csv
-from sys import ps2
-from tracemalloc import stop
-from turtle import color, right
-import matplotlib.pyplot as plt
+import concurrent.futures
+from multiprocessing import shared_memory
 import pandas as pd
 import numpy as np
 import data_preparation as dataprep
+import data_analysis as dataanalysis
+import data_sketch
+import utils
 
-def bar_chart_top_genres_by_revenue(config, maxgenres = 10):
+### matplotlib.pyplot is imported on first chart render (see 'load_pyplot'), so that
+### workers which only call the chart data functions do not pay the backend start-up cost
+plt = None
+
+def load_pyplot():
     """
+    Import 'matplotlib.pyplot' on first use and return the module.
+    Chart functions call this before drawing; data-only functions never do.
     """
-    if maxgenres > config['charts']['bar-number-upperbound']:
-        raise ValueError(f'Argument "maxgenres" {maxgenres} exceeds upper bound value of {config["charts"]["bar-number-upperbound"]}')
+    global plt
+    if plt is None:
+        import matplotlib.pyplot
+        plt = matplotlib.pyplot
+    return plt
+
+### Chart templates: a figure with its axes and artists is built once per layout and cached;
+### drawing a new variant of the chart (another genre, another year range) only updates the
+### artists in place (bar widths, scatter offsets, tick labels, label texts) before rendering.
+### Template keys are (chart name, layout parameters).
+dctChartTemplates = dict()
+
+def get_chart_template(tplKey, funcBuild, *args):
+    """
+    Return the cached template 'tplKey'; build it with 'funcBuild(*args)' on first use
+    or when its figure was closed (e.g. by 'plt.show' in a notebook)
+    """
+    plt = load_pyplot()
+    template = dctChartTemplates.get(tplKey)
+    if template is None or not plt.fignum_exists(template['fig'].number):
+        template = funcBuild(*args)
+        dctChartTemplates[tplKey] = template
+    return template
+
+def clear_chart_templates():
+    """
+    Close the figures of all cached templates and empty the cache
+    """
+    plt = load_pyplot()
+    for template in dctChartTemplates.values():
+        plt.close(template['fig'])
+    dctChartTemplates.clear()
+    return None
 
-    ### Load merged data
-    df = dataprep.load_merged_clean_data(config)
-    df['worldwide_gross'] = df['domestic_gross'].add(df['foreign_gross'], fill_value=0)
-    dfW = df.loc[(np.isnan(df['worldwide_gross'])==False),['tconst','title','year','genres','worldwide_gross']]
-    dfD = df.loc[(np.isnan(df['domestic_gross'])==False), ['tconst','title','year','genres','domestic_gross']]
-    dfF = df.loc[(np.isnan(df['foreign_gross'])==False),  ['tconst','title','year','genres','foreign_gross']]
-
-    ### Get sums by genres
-    srsW=dfW.groupby('genres')['worldwide_gross'].sum().sort_values(ascending=False).iloc[range(maxgenres)]
-    srsD=dfD.groupby('genres')['domestic_gross'].sum().sort_values(ascending=False).iloc[range(maxgenres)]
-    srsF=dfF.groupby('genres')['foreign_gross'].sum().sort_values(ascending=False).iloc[range(maxgenres)]
-    fltRightXLimit = max( [srsW.div(1e9).max(),srsD.div(1e9).max(),srsF.div(1e9).max()] ) + 1.5
+def build_barh_template(intNumAxes, intNumBars, tplFigSize, lstColors, lstLegendLabels, fltScale, strLabelFmt):
+    """
+    Template of 'intNumAxes' stacked horizontal bar charts with 'intNumBars' bars each and edge labels.
+    Values are divided by 'fltScale' (e.g. 1e9 for $b) and labels formatted with 'strLabelFmt'.
+    """
+    plt = load_pyplot()
+    fig, arrAx = plt.subplots(nrows=intNumAxes,ncols=1,figsize=tplFigSize,squeeze=False)
+    arrY = np.arange(intNumBars)
+    lstBars, lstLabels = list(), list()
+    for (i, ax) in enumerate(arrAx[:,0]):
+        bars = ax.barh(arrY, np.zeros(intNumBars), label=lstLegendLabels[i], color=lstColors[i])
+        ax.set_yticks(arrY)
+        ax.invert_yaxis()
+        ax.legend(loc='lower right')
+        lstLabels.append(ax.bar_label(bars,label_type='edge',fmt=strLabelFmt))
+        lstBars.append(bars)
+    return {'fig': fig, 'axes': list(arrAx[:,0]), 'bars': lstBars, 'labels': lstLabels,
+            'scale': fltScale, 'fmt': strLabelFmt, 'layout-done': False}
+
+def update_barh_template(template, intAxis, srValues, fltRightXLimit):
+    """
+    Set the bars of axis 'intAxis' to 'srValues' (index: bar names, unscaled values) in place.
+    Bars beyond the length of 'srValues' are emptied.
+    """
+    ax = template['axes'][intAxis]
+    arrValues = srValues.to_numpy(dtype=np.float64) / template['scale']
+    lstNames = [str(name) for name in srValues.index]
+    for (i, (rect, text)) in enumerate(zip(template['bars'][intAxis], template['labels'][intAxis])):
+        fltWidth = arrValues[i] if i < arrValues.shape[0] else 0.0
+        rect.set_width(fltWidth)
+        text.xy = (fltWidth, rect.get_y() + rect.get_height()/2)
+        text.set_text(template['fmt'] % fltWidth if i < arrValues.shape[0] else '')
+    lstNames.extend([''] * (len(template['bars'][intAxis]) - len(lstNames)))
+    ax.set_yticklabels(lstNames)
+    ax.set_xlim(left=0, right=fltRightXLimit)
+    return None
 
-    ### Generage plot
-    fig, ax = plt.subplots(nrows=3,ncols=1,figsize=(10,8))
+def build_scatter_template(tplFigSize, strXLabel, strYLabel, fltScale, fltMarkerSize, blnAgg=False):
+    """
+    Template of a single scatter plot; y values are divided by 'fltScale'.
+    With 'blnAgg' the figure is a plain Agg figure outside pyplot (for saving to files in worker
+    processes): it is not cached by 'get_chart_template' and cannot be shown.
+    """
+    if blnAgg:
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        fig = Figure(figsize=tplFigSize)
+        FigureCanvasAgg(fig)
+        ax = fig.subplots(nrows=1,ncols=1)
+    else:
+        plt = load_pyplot()
+        fig, ax = plt.subplots(nrows=1,ncols=1,figsize=tplFigSize)
+    scatter = ax.scatter(np.zeros(0), np.zeros(0), s=fltMarkerSize)
+    ### regression overlay, empty until 'update_scatter_fit_line' sets it
+    fitLine, = ax.plot(np.zeros(0), np.zeros(0), color='r', linewidth=1.5)
+    ax.set_xlabel(strXLabel)
+    ax.set_ylabel(strYLabel)
+    return {'fig': fig, 'axes': [ax], 'scatter': scatter, 'fit-line': fitLine, 'scale': fltScale, 'layout-done': False}
+
+def update_scatter_template(template, arrX, arrY, strTitle):
+    """
+    Replace the points of the scatter plot in place and fit the axis limits to them.
+    The regression overlay of the previous variant is cleared.
+    """
+    ax = template['axes'][0]
+    template['fit-line'].set_data(np.zeros(0), np.zeros(0))
+    if ax.get_legend() is not None:
+        ax.get_legend().remove()
+    arrX = np.asarray(arrX, dtype=np.float64)
+    arrY = np.asarray(arrY, dtype=np.float64) / template['scale']
+    template['scatter'].set_offsets(np.column_stack([arrX, arrY]))
+    if arrX.shape[0] > 0:
+        for (funcSetLim, arrValues) in [(ax.set_xlim, arrX), (ax.set_ylim, arrY)]:
+            fltMin, fltMax = arrValues.min(), arrValues.max()
+            fltMargin = 0.05 * (fltMax - fltMin) if fltMax > fltMin else 1.0
+            funcSetLim(fltMin - fltMargin, fltMax + fltMargin)
+    ax.set_title(strTitle)
+    return None
 
-    p0=ax[0].barh(srsW.index, srsW.div(1e9).values, label='Worldwide Gross ($b)', color='red')
-    ax[0].invert_yaxis()
-    ax[0].bar_label(p0,label_type='edge',fmt='%.1f')
-    ax[0].set_title(f'2010-2019: Top {str(maxgenres)} Genres by Gross Revenue')
-    ax[0].set_xlim(right=fltRightXLimit)
-    ax[0].legend()
+def regression_line_points(srFit, strXColName, tplXLim, intNumPoints=50):
+    """
+    Points of a fitted line (row 'srFit' of 'dataanalysis.fit_group_regression' with regressor 'strXColName')
+    over the x range 'tplXLim'; a log-response fit ('log_y') is drawn as the curve exp(a + b*x)
+    """
+    arrX = np.linspace(tplXLim[0], tplXLim[1], intNumPoints)
+    arrY = srFit['coef_intercept'] + srFit[f'coef_{strXColName}'] * arrX
+    return arrX, (np.exp(arrY) if srFit['log_y'] else arrY)
 
+def regression_line_label(srFit):
+    strModel = 'log-OLS' if srFit['log_y'] else 'OLS'
+    return f"{strModel} fit (R²={srFit['r2']:.2f}, n={srFit['count']})"
 
-    p1=ax[1].barh(srsD.index, srsD.div(1e9).values, label='Domestic Gross ($b)',color='orange')
-    ax[1].invert_yaxis()
-    ax[1].bar_label(p1,label_type='edge',fmt='%.1f')
-    ax[1].set_xlim(right=fltRightXLimit)
-    ax[1].legend()
+def update_scatter_fit_line(template, srFit, strXColName):
+    """
+    Draw the fitted line 'srFit' (see 'regression_line_points') over the current x range of the scatter template
+    """
+    ax = template['axes'][0]
+    if np.isnan(srFit['coef_intercept']):
+        return None
+    arrX, arrY = regression_line_points(srFit, strXColName, ax.get_xlim())
+    template['fit-line'].set_data(arrX, arrY / template['scale'])
+    template['fit-line'].set_label(regression_line_label(srFit))
+    ax.legend(handles=[template['fit-line']], loc='upper right', fontsize='small')
+    return None
 
-    p2=ax[2].barh(srsF.index, srsF.div(1e9).values, label='Foreign Gross ($b)',color='green')
-    ax[2].invert_yaxis()
-    ax[2].bar_label(p2,label_type='edge',fmt='%.1f')
-    ax[2].set_xlim(right=fltRightXLimit)
-    ax[2].legend()
+def render_chart_template(template, strFilePath=None):
+    """
+    Show the template figure, or save it to 'strFilePath'. The layout is computed on the first render only.
+    """
+    if not template['layout-done']:
+        ### tight layout applied once as fixed subplot parameters; 'fig.tight_layout()' would leave a
+        ### layout engine on the figure, and every save would then draw the figure twice
+        from matplotlib.layout_engine import TightLayoutEngine
+        TightLayoutEngine().execute(template['fig'])
+        template['layout-done'] = True
+    if strFilePath is None:
+        plt = load_pyplot()
+        plt.show()
+    else:
+        template['fig'].savefig(strFilePath)
+    return None
 
-    fig.tight_layout()
-    plt.show()
+def genre_revenue_sums(config, df=None, yearRange=None):
+    """
+    Total worldwide, domestic, and foreign gross revenue per genre: columns 'genres', '<col>' (sum) and
+    '<col>_count' (titles with a value) for each gross column.
+    From the titles in 'df' (columns 'genres', 'domestic_gross', 'foreign_gross', 'worldwide_gross') if given,
+    else from the aggregate cube, else from the merged data set; 'yearRange' restricts the release years.
+    """
+    lstGrossCols = ['worldwide_gross','domestic_gross','foreign_gross']
+    cube = dataprep.load_aggregate_cube(config) if df is None else None
+    if cube is not None:
+        df = dataprep.rollup_aggregate_cube(cube, 'genres', yearRange=yearRange)
+        return df.rename(columns={f'{col}_sum': col for col in lstGrossCols}) \
+                 .loc[:, ['genres'] + lstGrossCols + [f'{col}_count' for col in lstGrossCols]]
+    if df is None:
+        lstFilters = list() if yearRange is None else [('year','>=',yearRange[0]), ('year','<=',yearRange[1])]
+        df = dataprep.select(config, ['tconst','genres'] + lstGrossCols, lstFilters)
+    dfGrouped = df.groupby('genres')
+    df = dfGrouped[lstGrossCols].sum()
+    df = df.join(dfGrouped[lstGrossCols].count().add_suffix('_count'))
+    return df.reset_index()
+
+def top_genres_by_revenue(config, dfGenreSums, maxgenres = 10):
+    """
+    Top genres by total worldwide, domestic, and foreign gross revenue from the genre sums
+    'dfGenreSums' (see 'genre_revenue_sums').
+    Returns three Series (worldwide, domestic, foreign) of genre sums indexed by genre, in descending order.
+    """
+    ### Genres with at least one title with a value
+    dfW = dfGenreSums.loc[dfGenreSums['worldwide_gross_count'] > 0, ['genres','worldwide_gross']]
+    dfD = dfGenreSums.loc[dfGenreSums['domestic_gross_count'] > 0, ['genres','domestic_gross']]
+    dfF = dfGenreSums.loc[dfGenreSums['foreign_gross_count'] > 0, ['genres','foreign_gross']]
+    srsW=utils.select_topN_rows(dfW,['worldwide_gross'],maxgenres,config)['worldwide_gross'].set_index('genres')['worldwide_gross']
+    srsD=utils.select_topN_rows(dfD,['domestic_gross'],maxgenres,config)['domestic_gross'].set_index('genres')['domestic_gross']
+    srsF=utils.select_topN_rows(dfF,['foreign_gross'],maxgenres,config)['foreign_gross'].set_index('genres')['foreign_gross']
+    return srsW, srsD, srsF
+
+def draw_top_genres_by_revenue(config, dfGenreSums, maxgenres, strPeriod, strFilePath=None):
+    """
+    Draw chart 'bar_chart_top_genres_by_revenue' for the genre sums 'dfGenreSums' (see 'genre_revenue_sums')
+    on its cached template and show it (or save it to 'strFilePath')
+    """
+    srsW, srsD, srsF = top_genres_by_revenue(config, dfGenreSums, maxgenres)
+    fltRightXLimit = max( [srsW.div(1e9).max(),srsD.div(1e9).max(),srsF.div(1e9).max()] ) + 1.5
+    if np.isnan(fltRightXLimit):
+        fltRightXLimit = 1.5
+
+    template = get_chart_template(('top_genres_by_revenue', maxgenres), build_barh_template, 3, maxgenres, (10,8),
+                                  ['red','orange','green'],
+                                  ['Worldwide Gross ($b)','Domestic Gross ($b)','Foreign Gross ($b)'], 1e9, '%.1f')
+    for (i, srs) in enumerate([srsW, srsD, srsF]):
+        update_barh_template(template, i, srs, fltRightXLimit)
+    template['axes'][0].set_title(f'{strPeriod}: Top {str(maxgenres)} Genres by Gross Revenue')
+    render_chart_template(template, strFilePath)
+    return None
+
+def bar_chart_top_genres_by_revenue(config, maxgenres = 10):
+    """
+    Bar charts of the top genres by total worldwide, domestic, and foreign gross revenue
+    """
+    if maxgenres > config['charts']['bar-number-upperbound']:
+        raise ValueError(f'Argument "maxgenres" {maxgenres} exceeds upper bound value of {config["charts"]["bar-number-upperbound"]}')
+
+    ### Genre sums from the aggregate cube or the merged data
+    draw_top_genres_by_revenue(config, genre_revenue_sums(config), maxgenres, '2010-2019')
 
     return None
 
-def bar_chart_top_genres_by_avgrevenue_pertitle(config, maxgenres = 10):
+def batch_bar_chart_top_genres_by_revenue(config, lstYearRanges, maxgenres = 10):
     """
+    Render chart 'bar_chart_top_genres_by_revenue' for every (first year, last year) of 'lstYearRanges'
+    to files "Barchart_Top<N>GenresByGrossRevenue_<first>-<last>.png" in the images folder.
+    Year ranges are rolled up from the aggregate cube if there is one; otherwise the merged data is
+    loaded once. All variants are drawn on one cached template.
+    Returns the list of file paths.
     """
     if maxgenres > config['charts']['bar-number-upperbound']:
         raise ValueError(f'Argument "maxgenres" {maxgenres} exceeds upper bound value of {config["charts"]["bar-number-upperbound"]}')
 
-    ### Load merged data
-    df = dataprep.load_merged_clean_data(config)
-    df['worldwide_gross'] = df['domestic_gross'].add(df['foreign_gross'], fill_value=0)
-    dfW = df.loc[(np.isnan(df['worldwide_gross'])==False),['tconst','title','year','genres','worldwide_gross']]
-    dfD = df.loc[(np.isnan(df['domestic_gross'])==False), ['tconst','title','year','genres','domestic_gross']]
-    dfF = df.loc[(np.isnan(df['foreign_gross'])==False),  ['tconst','title','year','genres','foreign_gross']]
-
-    ### Get sums by genres
-    dfW= dfW.groupby('genres')['worldwide_gross'].agg(['mean','std','count']).reset_index()
-    dfW= dfW.loc[dfW['count'] >= config['charts']['min-titles-per-genre']] \
-            .sort_values('mean',ascending=False).iloc[range(maxgenres)]
-    dfD= dfD.groupby('genres')['domestic_gross'].agg(['mean','std','count']).reset_index()
-    dfD= dfD.loc[dfD['count'] >= config['charts']['min-titles-per-genre']] \
-            .sort_values('mean',ascending=False).iloc[range(maxgenres)] 
-    dfF= dfF.groupby('genres')['foreign_gross'].agg(['mean','std','count']).reset_index()
-    dfF= dfF.loc[dfF['count'] >= config['charts']['min-titles-per-genre']] \
-            .sort_values('mean',ascending=False).iloc[range(maxgenres)]
+    df = None
+    if dataprep.load_aggregate_cube(config) is None:
+        df = dataprep.select(config, ['tconst','year','genres','domestic_gross','foreign_gross','worldwide_gross'])
+        arrYear = df['year'].to_numpy()
+    os.makedirs(config['folders']['images'], exist_ok=True)
+    lstFilePaths = list()
+    for (intFirstYear, intLastYear) in lstYearRanges:
+        if df is None:
+            dfGenreSums = genre_revenue_sums(config, yearRange=(intFirstYear, intLastYear))
+        else:
+            dfGenreSums = genre_revenue_sums(config, df.loc[(arrYear >= intFirstYear) & (arrYear <= intLastYear)])
+        strFilePath = os.path.join(config['folders']['images'],
+                                   f'Barchart_Top{maxgenres}GenresByGrossRevenue_{intFirstYear}-{intLastYear}.png')
+        draw_top_genres_by_revenue(config, dfGenreSums, maxgenres, f'{intFirstYear}-{intLastYear}', strFilePath)
+        lstFilePaths.append(strFilePath)
+    return lstFilePaths
+
+def genre_avgrevenue_error_bars(config, dfTitles, dfGenres, strRevenueColName, errorMode='sem'):
+    """
+    Error bars (in $m) and bar labels for the top genres 'dfGenres' (columns 'genres','mean','std','count')
+    of chart 'bar_chart_top_genres_by_avgrevenue_pertitle'. 'dfTitles' holds the title-level revenue.
+    errorMode 'sem': standard error of the mean, std/sqrt(n)
+    errorMode 'bootstrap': percentile confidence interval (config['bootstrap']), see 'data_analysis.bootstrap_genre_mean_ci'
+    """
+    if errorMode == 'sem':
+        errGrossRevenue = dfGenres['std'].div(np.sqrt(dfGenres['count'])).div(1e6)
+        zipTriple = zip(dfGenres['mean'].div(1e6).to_list(),errGrossRevenue.to_list(),dfGenres['count'])
+        lstBarLabels = [f'{m:.0f}±{e:.0f}|title cnt: {n}' for (m,e,n) in zipTriple]
+    elif errorMode == 'bootstrap':
+        dfCI = dataanalysis.bootstrap_genre_mean_ci(dfTitles.loc[dfTitles['genres'].isin(dfGenres['genres'])],
+                                                    strRevenueColName, config)
+        dfCI = dfCI.set_index('genres').loc[dfGenres['genres']]
+        errGrossRevenue = np.vstack([(dfCI['mean'] - dfCI['ci_low']).div(1e6).to_numpy(),
+                                     (dfCI['ci_high'] - dfCI['mean']).div(1e6).to_numpy()])
+        zipQuad = zip(dfCI['mean'].div(1e6).to_list(),dfCI['ci_low'].div(1e6).to_list(),
+                      dfCI['ci_high'].div(1e6).to_list(),dfCI['count'])
+        lstBarLabels = [f'{m:.0f} [{l:.0f},{h:.0f}]|title cnt: {n}' for (m,l,h,n) in zipQuad]
+    else:
+        raise ValueError(f'Argument "errorMode" {errorMode} must be "sem" or "bootstrap"')
+
+    return errGrossRevenue, lstBarLabels
+
+def bar_chart_top_genres_by_avgrevenue_pertitle(config, maxgenres = 10, errorMode = 'sem'):
+    """
+    Bar charts of the top genres by average worldwide, domestic, and foreign gross revenue per title.
+    Error bars: errorMode 'sem' -- standard error of the mean; 'bootstrap' -- bootstrap percentile
+    confidence interval (see 'genre_avgrevenue_error_bars')
+    """
+    if maxgenres > config['charts']['bar-number-upperbound']:
+        raise ValueError(f'Argument "maxgenres" {maxgenres} exceeds upper bound value of {config["charts"]["bar-number-upperbound"]}')
+
+    ### Genre mean, std and count from the aggregate cube; title-level data is still needed for bootstrap errors
+    cube = dataprep.load_aggregate_cube(config)
+    dfWTitles, dfDTitles, dfFTitles = None, None, None
+    if cube is None or errorMode == 'bootstrap':
+        ### Load merged data
+        df = dataprep.select(config, ['tconst','genres','domestic_gross','foreign_gross','worldwide_gross'])
+        dfWTitles = df.loc[(np.isnan(df['worldwide_gross'])==False),['tconst','genres','worldwide_gross']]
+        dfDTitles = df.loc[(np.isnan(df['domestic_gross'])==False), ['tconst','genres','domestic_gross']]
+        dfFTitles = df.loc[(np.isnan(df['foreign_gross'])==False),  ['tconst','genres','foreign_gross']]
+
+    lstGenreStats = list()
+    if cube is not None:
+        dfRollup = dataprep.rollup_aggregate_cube(cube, 'genres')
+    for (strCol, dfTitles) in [('worldwide_gross',dfWTitles), ('domestic_gross',dfDTitles), ('foreign_gross',dfFTitles)]:
+        if cube is not None:
+            srMean, srStd, srCount = dataprep.rollup_mean_std(dfRollup, strCol)
+            dfGenre = pd.DataFrame({'genres': dfRollup['genres'], 'mean': srMean, 'std': srStd,
+                                    'count': srCount.astype(np.int64)})
+            dfGenre = dfGenre.loc[dfGenre['count'] > 0]
+        else:
+            dfGenre = dfTitles.groupby('genres')[strCol].agg(['mean','std','count']).reset_index()
+        lstGenreStats.append(utils.select_topN_rows(dfGenre.loc[dfGenre['count'] >= config['charts']['min-titles-per-genre']],
+                                                    ['mean'],maxgenres,config)['mean'])
+    dfW, dfD, dfF = lstGenreStats
  
     ### Generage plot
+    plt = load_pyplot()
     fig, ax = plt.subplots(nrows=3,ncols=1,figsize=(10,8))
     fltRightXLimit = max([  dfD['mean'].div(1e6).max(), \
                             dfF['mean'].div(1e6).max(), \
                             dfW['mean'].div(1e6).max()]) + 220
 
     ### Row 0: worldwide gross
-    df = dfW.copy()
-    errGrossRevenue = df['std'].div(np.sqrt(df['count'])).div(1e6)
-    zipTriple = zip(df['mean'].div(1e6).to_list(),errGrossRevenue.to_list(),df['count'])
-    lstBarLabels = [f'{m:.0f}±{e:.0f}|title cnt: {n}' for (m,e,n) in zipTriple]
+    df = dfW
+    errGrossRevenue, lstBarLabels = genre_avgrevenue_error_bars(config, dfWTitles, df, 'worldwide_gross', errorMode)
 
     p0=ax[0].barh(df['genres'], df['mean'].div(1e6).values, xerr=errGrossRevenue, label='Worldwide Average ($m)', color='red')
     ax[0].invert_yaxis()
@@ -115,10 +370,8 @@ def bar_chart_top_genres_by_avgrevenue_pertitle(config, maxgenres = 10):
     ax[0].legend()
 
     ### Row 1: domestic gross
-    df = dfD.copy()
-    errGrossRevenue = df['std'].div(np.sqrt(df['count'])).div(1e6)
-    zipTriple = zip(df['mean'].div(1e6).to_list(),errGrossRevenue.to_list(),df['count'])
-    lstBarLabels = [f'{m:.0f}±{e:.0f}|title cnt: {n}' for (m,e,n) in zipTriple]
+    df = dfD
+    errGrossRevenue, lstBarLabels = genre_avgrevenue_error_bars(config, dfDTitles, df, 'domestic_gross', errorMode)
 
     p1=ax[1].barh(df['genres'], df['mean'].div(1e6).values, xerr=errGrossRevenue, label='Domestic Average ($m)', color='orange')
     ax[1].invert_yaxis()
@@ -127,10 +380,8 @@ def bar_chart_top_genres_by_avgrevenue_pertitle(config, maxgenres = 10):
     ax[1].legend()
 
     ### Row 2: foreign gross
-    df = dfF.copy()
-    errGrossRevenue = df['std'].div(np.sqrt(df['count'])).div(1e6)
-    zipTriple = zip(df['mean'].div(1e6).to_list(),errGrossRevenue.to_list(),df['count'])
-    lstBarLabels = [f'{m:.0f}±{e:.0f}|title cnt: {n}' for (m,e,n) in zipTriple]
+    df = dfF
+    errGrossRevenue, lstBarLabels = genre_avgrevenue_error_bars(config, dfFTitles, df, 'foreign_gross', errorMode)
 
     p2=ax[2].barh(df['genres'], df['mean'].div(1e6).values, xerr=errGrossRevenue,label='Foreign Average ($m)', color='green')
     ax[2].invert_yaxis()
@@ -144,22 +395,32 @@ def bar_chart_top_genres_by_avgrevenue_pertitle(config, maxgenres = 10):
 
     return None
 
-def bar_chart_top_genres_by_weightedavg_title_rating(config, maxgenres = 15):
+def genre_rating_sums(config, df=None):
     """
-    Compute weighted average title rating (weighted by numvotes) of each genre, weighted average title standard deviation
-    of each genre. Contruct a horizontal bar chart 
+    Rating sums per genre of the titles with a valid rating (see 'dataprep.valid_flags_filter'):
+    columns 'genres', 'ratingsqrd_times_numvotes', 'rating_times_numvotes', 'numvotes' (sums),
+    'genre_numtitles', 'rating_mean', 'rating_std'; genres with at least config['titles-per-genre-min'] titles.
+    From the titles in 'df' (valid ratings only) if given, else rolled up from the aggregate cube if there
+    is one, else from the merged data set.
     """
-    if maxgenres > config['charts']['bar-number-upperbound']:
-        raise ValueError(f'Argument "maxgenres" {maxgenres} exceeds upper bound value of {config["charts"]["bar-number-upperbound"]}')
+    cube = dataprep.load_aggregate_cube(config) if df is None else None
+    if cube is not None:
+        dfRollup = dataprep.rollup_aggregate_cube(cube, 'genres', ratingValid=True)
+        srMean, srStd, srCount = dataprep.rollup_mean_std(dfRollup, 'rating')
+        dfGroupByGenre = pd.DataFrame({'genres': dfRollup['genres'],
+                                       'ratingsqrd_times_numvotes': dfRollup['ratingsqrd_times_numvotes_sum'],
+                                       'rating_times_numvotes': dfRollup['rating_times_numvotes_sum'],
+                                       'numvotes': dfRollup['numvotes_sum'],
+                                       'genre_numtitles': dfRollup['titles'].astype(np.int64),
+                                       'rating_mean': srMean, 'rating_std': srStd})
+        return dfGroupByGenre.loc[dfGroupByGenre['genre_numtitles']>=config['titles-per-genre-min']]
 
     ### Load merged data
-    df = dataprep.load_merged_clean_data(config)
-    df = df.loc[(np.isnan(df['rating'])==False), ['tconst','title','genres','rating','numvotes']]
-    df = df.loc[df['numvotes']>=config['rating-numvotes-pertitle-min']].copy()
+    if df is None:
+        df = dataprep.select(config, ['tconst','genres','rating','numvotes','rating_times_numvotes','ratingsqrd_times_numvotes'],
+                             [dataprep.valid_flags_filter('rating'), dataprep.rating_numvotes_filter(config)])
 
     ### Compute weighted average of title ratings per genre
-    df['rating_times_numvotes'] = df['rating'].mul(df['numvotes'])
-    df['ratingsqrd_times_numvotes'] = (df['rating'].mul(df['rating'])).mul(df['numvotes'])
     dfGroupByGenre = df.groupby('genres')[['ratingsqrd_times_numvotes','rating_times_numvotes','numvotes']] \
                        .agg(np.sum).reset_index()
     dfGroupByGenreTitleCounts = df.groupby('genres')['tconst'].count().reset_index()
@@ -170,10 +431,19 @@ def bar_chart_top_genres_by_weightedavg_title_rating(config, maxgenres = 15):
 
     dfGroupByGenre = pd.merge(dfGroupByGenre,dfGroupByGenreTitleCounts,on='genres')
     dfGroupByGenre = pd.merge(dfGroupByGenre,dfGroupByGenreTitleRating,on='genres')
-    dfGroupByGenre = dfGroupByGenre.loc[dfGroupByGenre['genre_numtitles']>=config['titles-per-genre-min']]
-    ### Delete df to release memory
-    del df
-    
+    return dfGroupByGenre.loc[dfGroupByGenre['genre_numtitles']>=config['titles-per-genre-min']]
+
+def bar_chart_top_genres_by_weightedavg_title_rating(config, maxgenres = 15):
+    """
+    Compute weighted average title rating (weighted by numvotes) of each genre, weighted average title standard deviation
+    of each genre. Contruct a horizontal bar chart 
+    """
+    if maxgenres > config['charts']['bar-number-upperbound']:
+        raise ValueError(f'Argument "maxgenres" {maxgenres} exceeds upper bound value of {config["charts"]["bar-number-upperbound"]}')
+
+    ### Weighted rating per genre from the aggregate cube or the merged data
+    dfGroupByGenre = genre_rating_sums(config)
+
     ### Compute weigthed (by numvotes) average rating
     dfGroupByGenre['wavgrating']     = dfGroupByGenre['rating_times_numvotes'].div(dfGroupByGenre['numvotes'])
     ### Compute first and second terms of weighted average standard deviation
@@ -186,15 +456,17 @@ def bar_chart_top_genres_by_weightedavg_title_rating(config, maxgenres = 15):
     dfGroupByGenre['rating_wavgstdev'] = dfGroupByGenre['rating_wavgstdev'].apply(np.sqrt)
  
     ### rename to df for ease of reference
-    df = dfGroupByGenre.copy()
+    df = dfGroupByGenre
     del dfGroupByGenre
  
     ### Generage plot
+    plt = load_pyplot()
     fig, ax = plt.subplots(nrows=2,ncols=1,figsize=(10,8))
     fltRightXLimit = max(df['wavgrating'].to_list()) + 3.5
 
     ### Axis 0: Plot rating weighted by numvotes
-    df0 = df.sort_values('wavgrating',ascending=False).iloc[range(maxgenres)]
+    dctTopGenres = utils.select_topN_rows(df,['wavgrating','rating_mean'],maxgenres,config)
+    df0 = dctTopGenres['wavgrating']
     errGrossRevenue = df0['rating_wavgstdev']
     zipTriple = zip(df0['wavgrating'].to_list(),errGrossRevenue.to_list(),df0['genresum_numvotes'])
     lstBarLabels = [f'{m:0.1f}±{e:0.2f} | votes: {n/1e3:0.0f}e3' for (m,e,n) in zipTriple]
@@ -205,7 +477,7 @@ def bar_chart_top_genres_by_weightedavg_title_rating(config, maxgenres = 15):
     ax[0].set_xlim(right=fltRightXLimit)
 
     ### Axis 1: Plot average rating across titles in a genre
-    df1 = df.sort_values('rating_mean',ascending=False).iloc[range(maxgenres)]
+    df1 = dctTopGenres['rating_mean']
     zipTriple = zip(df1['rating_mean'].to_list(),df1['rating_std'].to_list(),df1['genresum_numvotes'])
     lstBarLabels = [f'{m:0.1f}±{e:0.2f} | votes: {n/1e3:0.0f}e3' for (m,e,n) in zipTriple]
     p1=ax[1].barh(df1['genres'], df1['rating_mean'].values, xerr=df1['rating_std'])
@@ -220,36 +492,44 @@ def bar_chart_top_genres_by_weightedavg_title_rating(config, maxgenres = 15):
 
     return None
 
-def barchart_scatterplot_title_rating_and_revenue(config):
+def barchart_scatterplot_title_rating_and_revenue(config, errorMode = 'sem', fitLine = None):
     """
+    Bar chart of title average revenue by rating interval and scatter plot of title rating v revenue.
+    Error bars: errorMode 'sem' or 'bootstrap' (see 'compute_revenue_mean_stdev_for_rating_interval')
+    With 'fitLine' (default: config['charts']['regression-overlay']) the OLS fit of revenue on rating is
+    drawn over the scatter plot (see 'title_regression_fit').
     """
+    if fitLine is None:
+        fitLine = config['charts']['regression-overlay']
     ### Load merged data
-    df = dataprep.load_merged_clean_data(config)
-    df = df.loc[ :, ['tconst','title','genres','rating','numvotes','domestic_gross','foreign_gross']]
-    df['worldwide_gross'] = df['domestic_gross'].add(df['foreign_gross'], fill_value=0)
-    mskValidGross = (df['worldwide_gross'].isna()==False)
-    mskValidRating = (df['rating'].isna()==False)
-    mskValidNumvotes = ( (df['numvotes'].isna() == False) & (df['numvotes'] >= config['rating-numvotes-pertitle-min']) )
-    ### INCLUDED for Testing Purposes and Sensitivity Analysis
-    ### mskValidNumvotes = ( (df['numvotes'].isna() == False) & (df['numvotes'] >= 0) )
-
-    mskValidRevenue = ( (df['worldwide_gross'] > 0) & (df['worldwide_gross'] < 100e9))
-    mskValidRows = (mskValidGross & mskValidRating & mskValidNumvotes & mskValidRevenue)
-    df = df.loc[mskValidRows]
+    ### Valid rows: rating with numvotes >= 'rating-numvotes-pertitle-min', worldwide gross in (0, 100e9)
+    ### INCLUDED for Testing Purposes and Sensitivity Analysis: replace the 'rating' flag and vote filter with
+    ### filters [('rating','notna'), ('numvotes','notna')]
+    df = dataprep.select(config, ['tconst','genres','rating','numvotes','domestic_gross','foreign_gross','worldwide_gross'],
+                         [dataprep.valid_flags_filter('rating','worldwide_gross_positive'), dataprep.rating_numvotes_filter(config),
+                          ('worldwide_gross','<',100e9)])
     dfTitleLevel = df
     
     ### GENERATE PLOT: Title Level Data
+    plt = load_pyplot()
     fig, ax = plt.subplots(nrows=2,ncols=1,figsize=(10,8))
 
     ### Axis 0: BAR CHART: Title Avg Revenue across Rating Intervals
     lstIntervalSet = [[1,2],[2,3],[3,4],[4,5],[5,6],[6,7],[7,8],[8,9]]
     dctAvgRatingByInterval = compute_revenue_mean_stdev_for_rating_interval(dfTitleLevel,lstIntervalSet,\
-        'rating','worldwide_gross',1e6)
+        'rating','worldwide_gross',1e6,errorMode,config)
 
     lstBarXTicks = list(map(lambda lstInt: sum(lstInt)/len(lstInt), lstIntervalSet))
-    zipTuple = zip(dctAvgRatingByInterval['avg'],dctAvgRatingByInterval['std'])
-    lstBarLabels = [f'{m:0.1f}±{e:0.1f}' for (m,e) in zipTuple]
-    p0=ax[0].bar(lstBarXTicks, dctAvgRatingByInterval['avg'], yerr=dctAvgRatingByInterval['std'])
+    if errorMode == 'bootstrap':
+        errRevenue = np.vstack([np.subtract(dctAvgRatingByInterval['avg'],dctAvgRatingByInterval['ci_low']),
+                                np.subtract(dctAvgRatingByInterval['ci_high'],dctAvgRatingByInterval['avg'])])
+        zipTuple = zip(dctAvgRatingByInterval['avg'],dctAvgRatingByInterval['ci_low'],dctAvgRatingByInterval['ci_high'])
+        lstBarLabels = [f'{m:0.1f} [{l:0.1f},{h:0.1f}]' for (m,l,h) in zipTuple]
+    else:
+        errRevenue = dctAvgRatingByInterval['std']
+        zipTuple = zip(dctAvgRatingByInterval['avg'],dctAvgRatingByInterval['std'])
+        lstBarLabels = [f'{m:0.1f}±{e:0.1f}' for (m,e) in zipTuple]
+    p0=ax[0].bar(lstBarXTicks, dctAvgRatingByInterval['avg'], yerr=errRevenue)
     ax[0].bar_label(p0,labels=lstBarLabels,label_type='edge',color='m')
     ax[0].set_title(f'2010-2019: Title Average Revenue By Rating Interval')
     ax[0].set_ylim(top=np.max(dctAvgRatingByInterval['avg'])+75)
@@ -261,6 +541,11 @@ def barchart_scatterplot_title_rating_and_revenue(config):
     ax[1].set_ylabel('Revenue ($mm)')
     ax[1].set_title(f'2010-2019: Title Rating v Title Revenue')
     ax[1].set_xlim(left=lstIntervalSet[0][0],right=lstIntervalSet[-1][1])
+    if fitLine:
+        srFit = title_regression_fit(config, dfTitleLevel, 'rating', 'worldwide_gross').iloc[0]
+        arrX, arrY = regression_line_points(srFit, 'rating', ax[1].get_xlim())
+        ax[1].plot(arrX, arrY / 1e6, color='r', linewidth=1.5, label=regression_line_label(srFit))
+        ax[1].legend(loc='upper left', fontsize='small')
 
     plt.show()
     ### END OF PLOT
@@ -271,34 +556,41 @@ def barchart_scatterplot_genre_rating_and_revenue(config):
     """
     """
     ### Load merged data
-    df = dataprep.load_merged_clean_data(config)
-    df = df.loc[ :, ['tconst','title','genres','rating','numvotes','domestic_gross','foreign_gross']]
-    df['worldwide_gross'] = df['domestic_gross'].add(df['foreign_gross'], fill_value=0)
-    mskValidGross = (df['worldwide_gross'].isna()==False)
-    mskValidRating = (df['rating'].isna()==False)
-    mskValidNumvotes = ( (df['numvotes'].isna() == False) & (df['numvotes'] >= config['rating-numvotes-pertitle-min']) )
-    ### INCLUDED for Testing Purposes and Sensitivity Analysis
-    ### mskValidNumvotes = ( (df['numvotes'].isna() == False) & (df['numvotes'] >= 0) )
-
-    mskValidRevenue = (df['worldwide_gross'] > 0)
-    mskValidRows = (mskValidGross & mskValidRating & mskValidNumvotes & mskValidRevenue)
-    df = df.loc[mskValidRows]
-    
-    ### Compute weighted average of title ratings per genre
-    df['rating_times_numvotes'] = df['rating'].mul(df['numvotes'])
-    dfGroupByGenre = df.groupby('genres')[['rating_times_numvotes','numvotes','worldwide_gross','domestic_gross','foreign_gross']] \
-                       .agg(np.sum).reset_index()
-    dfGroupByGenreTitleCounts = df.groupby('genres')['tconst'].count().reset_index()
-    dfGroupByGenreTitleCounts.rename(columns={'tconst':'genre_numtitles'}, inplace=True)
-
-    dfGroupByGenreTitleRating = df.groupby('genres')['rating'].agg(['mean']).reset_index()
-    dfGroupByGenreTitleRating.rename(columns={'mean':'rating_mean'}, inplace=True)
-
-    dfGroupByGenre = pd.merge(dfGroupByGenre,dfGroupByGenreTitleCounts,how='inner',on='genres')
-    dfGroupByGenre = pd.merge(dfGroupByGenre,dfGroupByGenreTitleRating,how='inner',on='genres')
+    ### Valid rows: rating with numvotes >= 'rating-numvotes-pertitle-min', worldwide gross above 0
+    ### INCLUDED for Testing Purposes and Sensitivity Analysis: replace the 'rating' flag and vote filter with
+    ### filters [('rating','notna'), ('numvotes','notna')]
+    cube = dataprep.load_aggregate_cube(config)
+    if cube is not None:
+        ### Roll up the cells with a valid rating and a positive worldwide gross
+        dfRollup = dataprep.rollup_aggregate_cube(cube, 'genres', ratingValid=True, grossPositive=True)
+        dfGroupByGenre = pd.DataFrame({'genres': dfRollup['genres'],
+                                       'rating_times_numvotes': dfRollup['rating_times_numvotes_sum'],
+                                       'numvotes': dfRollup['numvotes_sum'],
+                                       'worldwide_gross': dfRollup['worldwide_gross_sum'],
+                                       'domestic_gross': dfRollup['domestic_gross_sum'],
+                                       'foreign_gross': dfRollup['foreign_gross_sum'],
+                                       'genre_numtitles': dfRollup['titles'].astype(np.int64),
+                                       'rating_mean': dfRollup['rating_sum'].div(dfRollup['rating_count'])})
+    else:
+        df = dataprep.select(config, ['tconst','genres','rating','numvotes','rating_times_numvotes',
+                                      'domestic_gross','foreign_gross','worldwide_gross'],
+                             [dataprep.valid_flags_filter('rating','worldwide_gross_positive'),
+                              dataprep.rating_numvotes_filter(config)])
+
+        ### Compute weighted average of title ratings per genre
+        dfGroupByGenre = df.groupby('genres')[['rating_times_numvotes','numvotes','worldwide_gross','domestic_gross','foreign_gross']] \
+                           .agg(np.sum).reset_index()
+        dfGroupByGenreTitleCounts = df.groupby('genres')['tconst'].count().reset_index()
+        dfGroupByGenreTitleCounts.rename(columns={'tconst':'genre_numtitles'}, inplace=True)
+
+        dfGroupByGenreTitleRating = df.groupby('genres')['rating'].agg(['mean']).reset_index()
+        dfGroupByGenreTitleRating.rename(columns={'mean':'rating_mean'}, inplace=True)
+
+        dfGroupByGenre = pd.merge(dfGroupByGenre,dfGroupByGenreTitleCounts,how='inner',on='genres')
+        dfGroupByGenre = pd.merge(dfGroupByGenre,dfGroupByGenreTitleRating,how='inner',on='genres')
+        ### Delete df to release memory
+        del df
     dfGroupByGenre = dfGroupByGenre.loc[dfGroupByGenre['genre_numtitles']>=config['titles-per-genre-min']]
-    ### Delete df to release memory
-    del df
     
     ### Compute weigthed (by numvotes) average rating
     dfGroupByGenre['wavgrating'] = dfGroupByGenre['rating_times_numvotes'].div(dfGroupByGenre['numvotes'])
@@ -306,6 +598,7 @@ def barchart_scatterplot_genre_rating_and_revenue(config):
     del dfGroupByGenre
 
     ### GENERATE PLOT: Genre Level Data
+    plt = load_pyplot()
     fig, ax = plt.subplots(nrows=2,ncols=1,figsize=(10,8))
 
     ### Axis 0: BAR CHART: Genre Avg Revenue across Weighted Avg Ratings 
@@ -337,10 +630,23 @@ def barchart_scatterplot_genre_rating_and_revenue(config):
 
     return None
 
-def compute_revenue_mean_stdev_for_rating_interval(df, lstIntervalSet, strRatingColName, strRevenueColName, fltOrderOfMagnitude):
+def compute_revenue_mean_stdev_for_rating_interval(df, lstIntervalSet, strRatingColName, strRevenueColName, fltOrderOfMagnitude,
+                                                   errorMode='sem', config=None):
     """
     Compute average revenue for a rating interval of type (a,b]. All data cleaning has taken place, no NaNs
+    errorMode 'sem': 'std' is the standard error of the mean
+    errorMode 'bootstrap': 'std' is half the width of the bootstrap percentile confidence interval
+                           (config['bootstrap']); interval bounds are returned as 'ci_low' and 'ci_high'
     """
+    if errorMode == 'bootstrap':
+        dfCI = dataanalysis.bootstrap_rating_interval_mean_ci(df, lstIntervalSet, strRatingColName, strRevenueColName, config)
+        return {'avg': dfCI['mean'].div(fltOrderOfMagnitude).to_list(),
+                'std': dfCI['ci_high'].sub(dfCI['ci_low']).div(2*fltOrderOfMagnitude).to_list(),
+                'ci_low': dfCI['ci_low'].div(fltOrderOfMagnitude).to_list(),
+                'ci_high': dfCI['ci_high'].div(fltOrderOfMagnitude).to_list()}
+    elif errorMode != 'sem':
+        raise ValueError(f'Argument "errorMode" {errorMode} must be "sem" or "bootstrap"')
+
     lstAvg = list()
     lstStd = list()
     for lstInterval in lstIntervalSet:
@@ -353,45 +659,67 @@ def compute_revenue_mean_stdev_for_rating_interval(df, lstIntervalSet, strRating
     
     return {'avg':lstAvg,'std':lstStd}
 
-def scatterplot_title_runtime_and_revenue(config):
-    ### Load merged data
-    df = dataprep.load_merged_clean_data(config)
-    df = df.loc[ :, ['tconst','title','domestic_gross','foreign_gross','runtime_minutes']]
-    df['worldwide_gross'] = df['domestic_gross'].add(df['foreign_gross'], fill_value=0)
-    mskValidRevenue = ((df['worldwide_gross'].isna()==False) & (df['worldwide_gross']>0))
-    mskValidRuntime = (df['runtime_minutes'].isna()==False)
-    mskValidRows = (mskValidRevenue & mskValidRuntime)
-    df = df.loc[mskValidRows]
-
-    ### GENERATE PLOT: Genre Level Data
-    fig, ax = plt.subplots(nrows=1,ncols=1,figsize=(6,4))
-
-    ### Axis 0: BAR CHART: Genre Avg Revenue across Weighted Avg Ratings 
-    ###                    X-Axis: Rating Intervals Defined by Genre Weighted Avg Rating
-    ###                    Y-Axis: Average Genre Revenue
-
-    ### Axis 1: SCATTER PLOT: Runtime_minutes and revenue
-    p0=ax.scatter(df['runtime_minutes'], df['worldwide_gross'].div(1e9),s=7)
-    ax.set_xlabel('runtime in minutes')
-    ax.set_ylabel('revenue ($bb)')
-    ax.set_title(f'2010-2019: Title Runtime v Title Worlwide Revenue')
+def title_regression_fit(config, df, strXColName, strYColName, strGroupColName=None, logY=None):
+    """
+    Regression overlay of a title-level chart: OLS fit of 'strYColName' on 'strXColName' over the titles
+    'df', per value of 'strGroupColName' if given (see 'dataanalysis.fit_group_regression').
+    'logY' (default: config['charts']['regression-log-revenue'] for revenue columns) fits log(y).
+    """
+    if logY is None:
+        logY = config['charts']['regression-log-revenue'] and strYColName.endswith('_gross')
+    return dataanalysis.fit_group_regression(df, strXColName, strYColName, strGroupColName, logY)
 
-    plt.tight_layout()
-    plt.show()
+def genre_runtime_revenue_regression(config, logY=None):
+    """
+    Runtime v worldwide gross OLS fits of all genres at once (titles with a positive worldwide gross), for
+    genres with at least config['charts']['min-titles-per-genre'] titles. Returns the frame of
+    'dataanalysis.fit_group_regression' ('genres', 'count', 'coef_intercept', 'coef_runtime_minutes', 'se_*', 'r2', ...)
+    sorted by 'r2'.
+    """
+    df = dataprep.select(config, ['tconst','genres','worldwide_gross','runtime_minutes'],
+                         [dataprep.valid_flags_filter('worldwide_gross_positive'), ('runtime_minutes','notna'),
+                          ('genres','notna')])
+    dfFit = title_regression_fit(config, df, 'runtime_minutes', 'worldwide_gross', 'genres', logY)
+    dfFit = dfFit.loc[dfFit['count'] >= config['charts']['min-titles-per-genre']]
+    return dfFit.sort_values('r2', ascending=False, na_position='last').reset_index(drop=True)
+
+def scatterplot_title_runtime_and_revenue(config, fitLine=None):
+    """
+    Scatter plot of title runtime v worldwide gross; with 'fitLine' (default: config['charts']['regression-overlay'])
+    the OLS fit is drawn over the points (see 'title_regression_fit')
+    """
+    if fitLine is None:
+        fitLine = config['charts']['regression-overlay']
+    ### Load merged data
+    df = dataprep.select(config, ['tconst','worldwide_gross','runtime_minutes'],
+                         [dataprep.valid_flags_filter('worldwide_gross_positive'), ('runtime_minutes','notna')])
+
+    ### GENERATE PLOT: SCATTER PLOT: Runtime_minutes and revenue (cached template)
+    template = get_chart_template(('runtime_revenue', (6,4)), build_scatter_template, (6,4),
+                                  'runtime in minutes', 'revenue ($bb)', 1e9, 7)
+    update_scatter_template(template, df['runtime_minutes'], df['worldwide_gross'],
+                            f'2010-2019: Title Runtime v Title Worlwide Revenue')
+    if fitLine:
+        update_scatter_fit_line(template, title_regression_fit(config, df, 'runtime_minutes', 'worldwide_gross').iloc[0],
+                                'runtime_minutes')
+    render_chart_template(template)
 
     return None
 
-def scatterplot_title_runtime_and_rating(config):
+def scatterplot_title_runtime_and_rating(config, fitLine=None):
+    """
+    Scatter plot of title runtime v rating; with 'fitLine' (default: config['charts']['regression-overlay'])
+    the OLS fit is drawn over the points
+    """
+    if fitLine is None:
+        fitLine = config['charts']['regression-overlay']
     ### Load merged data
-    df = dataprep.load_merged_clean_data(config)
-    df = df.loc[ :, ['tconst','title','rating','numvotes','runtime_minutes']]
-    mskValidRating = ((df['rating'].isna()==False) & (df['numvotes'].isna()==False) & \
-                      (df['numvotes']>=config['rating-numvotes-pertitle-min']))
-    mskValidRuntime = (df['runtime_minutes'].isna()==False)
-    mskValidRows = (mskValidRating & mskValidRuntime)
-    df = df.loc[mskValidRows]
+    df = dataprep.select(config, ['tconst','rating','numvotes','runtime_minutes'],
+                         [dataprep.valid_flags_filter('rating'), dataprep.rating_numvotes_filter(config),
+                          ('runtime_minutes','notna')])
 
     ### GENERATE PLOT: Genre Level Data
+    plt = load_pyplot()
     fig, ax = plt.subplots(nrows=1,ncols=1,figsize=(6,4))
 
     ### Axis 0: BAR CHART: Genre Avg Revenue across Weighted Avg Ratings 
@@ -400,6 +728,11 @@ def scatterplot_title_runtime_and_rating(config):
 
     ### Axis 1: SCATTER PLOT: Runtime_minutes and revenue
     p0=ax.scatter(df['runtime_minutes'], df['rating'],s=7)
+    if fitLine:
+        srFit = title_regression_fit(config, df, 'runtime_minutes', 'rating').iloc[0]
+        arrX, arrY = regression_line_points(srFit, 'runtime_minutes', ax.get_xlim())
+        ax.plot(arrX, arrY, color='r', linewidth=1.5, label=regression_line_label(srFit))
+        ax.legend(loc='upper right', fontsize='small')
     ax.set_xlabel('runtime in minutes')
     ax.set_ylabel('rating (1-10)')
     ax.set_title(f'2010-2019: Title Runtime v Title Rating')
@@ -410,69 +743,186 @@ def scatterplot_title_runtime_and_rating(config):
     return None
 
 
-def scatterplot_title_runtime_and_revenue_bygenre(config, genreNameList, scatterPlotTitle=''):
+def scatterplot_title_runtime_and_revenue_bygenre(config, genreNameList, scatterPlotTitle='', fitLine=None):
+    """
+    Scatter plot of title runtime v worldwide gross of the genres 'genreNameList'; with 'fitLine' (default:
+    config['charts']['regression-overlay']) one OLS fit of all their titles is drawn over the points
+    """
+    if fitLine is None:
+        fitLine = config['charts']['regression-overlay']
+    ### a single genre entry may be passed as a string, e.g. 'Mystery,Thriller'
+    if isinstance(genreNameList, str):
+        genreNameList = [genreNameList]
     ### Load merged data
-    df = dataprep.load_merged_clean_data(config)
-    df = df.loc[ :, ['tconst','title','genres','domestic_gross','foreign_gross','runtime_minutes']]
-    df = df.loc[(df['genres'].isna()==False)]
-    mskGenreNameList = (df['genres']==genreNameList[0])
-    for genreName in genreNameList:
-        mskGenreNameList = (mskGenreNameList | (df['genres']==genreName))
-    df = df.loc[(mskGenreNameList)]
-    df['worldwide_gross'] = df['domestic_gross'].add(df['foreign_gross'], fill_value=0)
-    mskValidRevenue = ((df['worldwide_gross'].isna()==False) & (df['worldwide_gross']>0))
-    mskValidRuntime = (df['runtime_minutes'].isna()==False)
-    mskValidRows = (mskValidRevenue & mskValidRuntime)
-    df = df.loc[mskValidRows]
-
-    ### GENERATE PLOT: Genre Level Data
-    fig, ax = plt.subplots(nrows=1,ncols=1,figsize=(8,4))
+    df = dataprep.select(config, ['tconst','genres','worldwide_gross','runtime_minutes'],
+                         [('genres','in',list(genreNameList)), dataprep.valid_flags_filter('worldwide_gross_positive'),
+                          ('runtime_minutes','notna')])
 
-    ### Axis 0: BAR CHART: Genre Avg Revenue across Weighted Avg Ratings 
-    ###                    X-Axis: Rating Intervals Defined by Genre Weighted Avg Rating
-    ###                    Y-Axis: Average Genre Revenue
-
-    ### Axis 1: SCATTER PLOT: Runtime_minutes and revenue
-    p0=ax.scatter(df['runtime_minutes'], df['worldwide_gross'].div(1e9),s=7)
-    ax.set_xlabel('runtime in minutes')
-    ax.set_ylabel('revenue ($bb)')
+    ### GENERATE PLOT: SCATTER PLOT: Runtime_minutes and revenue (cached template)
     if len(genreNameList) == 1:
-        ax.set_title(f'{genreNameList[0]} in 2010-2019: Title Runtime v Title Revenue')
+        strTitle = f'{genreNameList[0]} in 2010-2019: Title Runtime v Title Revenue'
+    elif len(scatterPlotTitle) < 1:
+        strTitle = f'Top {len(genreNameList)} Genres by Rating in 2010-19: Title Runtime v Revenue'
     else:
-        if len(scatterPlotTitle) < 1:
-            ax.set_title(f'Top {len(genreNameList)} Genres by Rating in 2010-19: Title Runtime v Revenue')
-        else:
-            ax.set_title(scatterPlotTitle)
+        strTitle = scatterPlotTitle
+    template = get_chart_template(('runtime_revenue', (8,4)), build_scatter_template, (8,4),
+                                  'runtime in minutes', 'revenue ($bb)', 1e9, 7)
+    update_scatter_template(template, df['runtime_minutes'], df['worldwide_gross'], strTitle)
+    if fitLine:
+        update_scatter_fit_line(template, title_regression_fit(config, df, 'runtime_minutes', 'worldwide_gross').iloc[0],
+                                'runtime_minutes')
+    render_chart_template(template)
 
-    plt.show()
+    return None
+
+def batch_scatterplot_title_runtime_and_revenue_bygenre(config, genreNameList, fitLine=None):
+    """
+    Render chart 'scatterplot_title_runtime_and_revenue_bygenre' for every genre of 'genreNameList'
+    to files "Scatterplot_Runtime_Revenue_<genre>.png" in the images folder.
+    The merged data is loaded once, titles are split by genre in one pass over the genre codes,
+    and all genres are drawn on one cached template. With 'fitLine' (default: config['charts']['regression-overlay'])
+    the OLS fits of all genres are computed at once ('dataanalysis.fit_group_regression') and drawn on their panels.
+    Returns the list of file paths.
+    """
+    if fitLine is None:
+        fitLine = config['charts']['regression-overlay']
+    dctArrays, arrBounds = load_runtime_revenue_bygenre(config, genreNameList)
+    if fitLine:
+        dfTitles = pd.DataFrame({'genre': np.repeat(np.arange(len(genreNameList)), np.diff(arrBounds)),
+                                 'runtime_minutes': dctArrays['runtime_minutes'],
+                                 'worldwide_gross': dctArrays['worldwide_gross']})
+        dfFit = title_regression_fit(config, dfTitles, 'runtime_minutes', 'worldwide_gross', 'genre').set_index('genre')
+
+    template = get_chart_template(('runtime_revenue', (8,4)), build_scatter_template, (8,4),
+                                  'runtime in minutes', 'revenue ($bb)', 1e9, 7)
+    os.makedirs(config['folders']['images'], exist_ok=True)
+    lstFilePaths = list()
+    for (i, strGenre) in enumerate(genreNameList):
+        sl = slice(arrBounds[i], arrBounds[i+1])
+        update_scatter_template(template, dctArrays['runtime_minutes'][sl], dctArrays['worldwide_gross'][sl],
+                                f'{strGenre} in 2010-2019: Title Runtime v Title Revenue')
+        if fitLine and i in dfFit.index:
+            update_scatter_fit_line(template, dfFit.loc[i], 'runtime_minutes')
+        strFilePath = runtime_revenue_bygenre_file_path(config, strGenre)
+        render_chart_template(template, strFilePath)
+        lstFilePaths.append(strFilePath)
+    return lstFilePaths
+
+def runtime_revenue_bygenre_file_path(config, strGenre):
+    """
+    Image file of the runtime v revenue chart of one genre: "Scatterplot_Runtime_Revenue_<genre>.png"
+    """
+    strFileName = 'Scatterplot_Runtime_Revenue_' + ''.join(c if c.isalnum() else '_' for c in strGenre) + '.png'
+    return os.path.join(config['folders']['images'], strFileName)
 
+def load_runtime_revenue_bygenre(config, genreNameList):
+    """
+    Load runtime and worldwide gross of the titles of 'genreNameList' and group them by genre in one pass:
+    genres are converted to categorical codes (position in 'genreNameList') and titles are sorted by code.
+    Returns ({'runtime_minutes': array, 'worldwide_gross': array} sorted by genre, arrBounds) where the
+    titles of genreNameList[i] are at positions arrBounds[i]:arrBounds[i+1].
+    """
+    df = dataprep.select(config, ['tconst','genres','worldwide_gross','runtime_minutes'],
+                         [('genres','in',list(genreNameList)), dataprep.valid_flags_filter('worldwide_gross_positive'),
+                          ('runtime_minutes','notna')])
+    arrCodes = pd.Categorical(df['genres'], categories=list(genreNameList)).codes
+    arrOrder = np.argsort(arrCodes, kind='stable')
+    arrBounds = np.searchsorted(arrCodes[arrOrder], np.arange(len(genreNameList) + 1))
+    dctArrays = {'runtime_minutes': df['runtime_minutes'].to_numpy(dtype=np.float64)[arrOrder],
+                 'worldwide_gross': df['worldwide_gross'].to_numpy(dtype=np.float64)[arrOrder]}
+    return dctArrays, arrBounds
+
+### Shared arrays and chart template of a panel worker process (set by 'init_panel_worker')
+dctPanelWorkerData = dict()
+
+def init_panel_worker(dctSharedArrays):
+    """
+    Process pool initializer: attach to the shared memory blocks {name: (block name, shape, dtype)}
+    created by 'scatterpanels_title_runtime_and_revenue_bygenre' and wrap them as NumPy arrays (no copy)
+    """
+    dctPanelWorkerData.clear()
+    dctPanelWorkerData['shm'] = list()
+    for (strName, (strBlockName, tplShape, strDataType)) in dctSharedArrays.items():
+        shm = shared_memory.SharedMemory(name=strBlockName)
+        dctPanelWorkerData['shm'].append(shm)
+        dctPanelWorkerData[strName] = np.ndarray(tplShape, dtype=strDataType, buffer=shm.buf)
     return None
 
+def render_genre_panels_in_worker(lstTasks):
+    """
+    Worker task: render (genre index, genre, file path) panels from the shared arrays.
+    Every worker draws all its panels on one Agg figure template.
+    """
+    if 'template' not in dctPanelWorkerData:
+        dctPanelWorkerData['template'] = build_scatter_template((8,4), 'runtime in minutes', 'revenue ($bb)', 1e9, 7, blnAgg=True)
+    template = dctPanelWorkerData['template']
+    arrBounds = dctPanelWorkerData['bounds']
+    for (i, strGenre, strFilePath) in lstTasks:
+        sl = slice(arrBounds[i], arrBounds[i+1])
+        update_scatter_template(template, dctPanelWorkerData['runtime_minutes'][sl], dctPanelWorkerData['worldwide_gross'][sl],
+                                f'{strGenre} in 2010-2019: Title Runtime v Title Revenue')
+        render_chart_template(template, strFilePath)
+    return [tplTask[2] for tplTask in lstTasks]
+
+def scatterpanels_title_runtime_and_revenue_bygenre(config, genreNameList=None, maxGenres=10, numWorkers=None):
+    """
+    One runtime v revenue panel per genre (see 'scatterplot_title_runtime_and_revenue_bygenre'), rendered
+    to "Scatterplot_Runtime_Revenue_<genre>.png" in the images folder by a pool of worker processes.
+
+    Arguments:
+        'genreNameList': genres to draw (default: 'list_topN_genres_byrevenue(config, maxGenres)')
+        'numWorkers': number of worker processes (default: os.cpu_count()); 1 renders in-process
+    Titles are grouped by genre once ('load_runtime_revenue_bygenre') and the grouped arrays are placed in
+    shared memory, so workers read the data without copies or pickling. Workers draw on Agg figures
+    without pyplot. Returns the list of file paths in the order of 'genreNameList'.
+    """
+    if genreNameList is None:
+        genreNameList = list_topN_genres_byrevenue(config, maxGenres)
+    if isinstance(genreNameList, str):
+        genreNameList = [genreNameList]
+    dctArrays, arrBounds = load_runtime_revenue_bygenre(config, genreNameList)
+    dctArrays['bounds'] = arrBounds.astype(np.int64)
+
+    os.makedirs(config['folders']['images'], exist_ok=True)
+    lstTasks = [(i, strGenre, runtime_revenue_bygenre_file_path(config, strGenre)) for (i, strGenre) in enumerate(genreNameList)]
+    if numWorkers is None:
+        numWorkers = os.cpu_count() or 1
+    numWorkers = max(1, min(numWorkers, len(lstTasks)))
+
+    ### Copy the grouped arrays to shared memory blocks once
+    lstBlocks = list()
+    dctSharedArrays = dict()
+    try:
+        for (strName, arr) in dctArrays.items():
+            shm = shared_memory.SharedMemory(create=True, size=max(1, arr.nbytes))
+            lstBlocks.append(shm)
+            np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[:] = arr
+            dctSharedArrays[strName] = (shm.name, arr.shape, arr.dtype.str)
+
+        lstFilePaths = list()
+        if numWorkers == 1:
+            init_panel_worker(dctSharedArrays)
+            lstFilePaths = render_genre_panels_in_worker(lstTasks)
+            dctPanelWorkerData.clear()
+        else:
+            lstChunks = [lstTasks[i::numWorkers] for i in range(numWorkers)]
+            with concurrent.futures.ProcessPoolExecutor(max_workers=numWorkers, initializer=init_panel_worker,
+                                                        initargs=(dctSharedArrays,)) as executor:
+                for lstChunkFilePaths in executor.map(render_genre_panels_in_worker, lstChunks):
+                    lstFilePaths.extend(lstChunkFilePaths)
+            lstFilePaths = [tplTask[2] for tplTask in lstTasks]
+    finally:
+        for shm in lstBlocks:
+            shm.close()
+            shm.unlink()
+    return lstFilePaths
+
 def list_topN_genres_by_rating(config, maxGenres=20):
     lstGenres = list()
 
-    ### Load merged data
-    df = dataprep.load_merged_clean_data(config)
-    df = df.loc[(np.isnan(df['rating'])==False), ['tconst','title','genres','rating','numvotes']]
-    df = df.loc[df['numvotes']>=config['rating-numvotes-pertitle-min']].copy()
-
-    ### Compute weighted average of title ratings per genre
-    df['rating_times_numvotes'] = df['rating'].mul(df['numvotes'])
-    df['ratingsqrd_times_numvotes'] = (df['rating'].mul(df['rating'])).mul(df['numvotes'])
-    dfGroupByGenre = df.groupby('genres')[['ratingsqrd_times_numvotes','rating_times_numvotes','numvotes']] \
-                       .agg(np.sum).reset_index()
-    dfGroupByGenreTitleCounts = df.groupby('genres')['tconst'].count().reset_index()
-    dfGroupByGenreTitleCounts.rename(columns={'tconst':'genre_numtitles'}, inplace=True)
-
-    dfGroupByGenreTitleRating = df.groupby('genres')['rating'].agg(['mean','std']).reset_index()
-    dfGroupByGenreTitleRating.rename(columns={'mean':'rating_mean','std':'rating_std'}, inplace=True)
+    ### Weighted rating per genre from the aggregate cube or the merged data
+    dfGroupByGenre = genre_rating_sums(config)
 
-    dfGroupByGenre = pd.merge(dfGroupByGenre,dfGroupByGenreTitleCounts,on='genres')
-    dfGroupByGenre = pd.merge(dfGroupByGenre,dfGroupByGenreTitleRating,on='genres')
-    dfGroupByGenre = dfGroupByGenre.loc[dfGroupByGenre['genre_numtitles']>=config['titles-per-genre-min']]
-    ### Delete df to release memory
-    del df
-    
     ### Compute weigthed (by numvotes) average rating
     dfGroupByGenre['wavgrating']     = dfGroupByGenre['rating_times_numvotes'].div(dfGroupByGenre['numvotes'])
     ### Compute first and second terms of weighted average standard deviation
@@ -485,10 +935,11 @@ def list_topN_genres_by_rating(config, maxGenres=20):
     dfGroupByGenre['rating_wavgstdev'] = dfGroupByGenre['rating_wavgstdev'].apply(np.sqrt)
  
     ### rename to df for ease of reference
-    df = dfGroupByGenre.copy()
+    df = dfGroupByGenre
     del dfGroupByGenre
-    df0 = df.sort_values('wavgrating',ascending=False).iloc[range(maxGenres)]
-    df1 = df.sort_values('rating_mean',ascending=False).iloc[range(maxGenres)]
+    dctTopGenres = utils.select_topN_rows(df,['wavgrating','rating_mean'],maxGenres,config)
+    df0 = dctTopGenres['wavgrating']
+    df1 = dctTopGenres['rating_mean']
 
     list0 = df0['genres'].to_list()
     list1 = df1['genres'].to_list()
@@ -502,25 +953,16 @@ def list_topN_genres_byrevenue(config, maxGenres=10):
     """
     """
     lstGenres = list()
-    ### Load merged data
-    df = dataprep.load_merged_clean_data(config)
-    df = df.loc[ :, ['tconst','genres','domestic_gross','foreign_gross']]
-    df['worldwide_gross'] = df['domestic_gross'].add(df['foreign_gross'], fill_value=0)
-    mskValidGross = ( (df['worldwide_gross'].isna()==False) & (df['genres'].isna()==False) )
-    df = df.loc[mskValidGross]
-
-    dfGrpByGenreRevenueSum = df.groupby('genres')['worldwide_gross'].agg(np.sum).reset_index()
-    dfGrpByGenreRevenueSum.rename(columns={'worldwide_gross':'genretot_worldwide_gross'},inplace=True)
-
-    dfGrpByGenreTitleCount = df.groupby('genres')['tconst'].count().reset_index()
-    dfGrpByGenreTitleCount.rename(columns={'tconst':'genretot_title_count'}, inplace=True)
-
-    df = pd.merge(dfGrpByGenreRevenueSum,dfGrpByGenreTitleCount,on='genres',how='inner')
+    ### Worldwide gross sums and title counts per genre (aggregate cube or merged data)
+    df = genre_revenue_sums(config)
+    df = df.loc[df['worldwide_gross_count'] > 0, ['genres','worldwide_gross','worldwide_gross_count']]
+    df = df.rename(columns={'worldwide_gross':'genretot_worldwide_gross','worldwide_gross_count':'genretot_title_count'})
     df['genreavg_worldwide_gross_pertitle'] = df['genretot_worldwide_gross'].div(df['genretot_title_count'])
-    df.sort_values('genretot_worldwide_gross', ascending=False, inplace=True)
-    lstGenresByTotGross = df['genres'].iloc[range(maxGenres)].to_list()
-    df.sort_values('genreavg_worldwide_gross_pertitle',inplace=True)
-    lstGenresByAvgGross = df['genres'].iloc[range(maxGenres)].to_list()
+    ### top genres by total and by average gross per title (both descending)
+    dctTopGenres = utils.select_topN_rows(df,['genretot_worldwide_gross','genreavg_worldwide_gross_pertitle'],
+                                          maxGenres,config)
+    lstGenresByTotGross = dctTopGenres['genretot_worldwide_gross']['genres'].to_list()
+    lstGenresByAvgGross = dctTopGenres['genreavg_worldwide_gross_pertitle']['genres'].to_list()
 
     lstGenres = lstGenresByTotGross
     lstGenres.extend(lstGenresByAvgGross)
@@ -529,4 +971,171 @@ def list_topN_genres_byrevenue(config, maxGenres=10):
     return list(lstGenres)
 
 
-    return lstGenres
\ No newline at end of file
+    return lstGenres
+
+def genre_roi_aggregates(config, df=None):
+    """
+    Profitability per genre of the titles with a known production budget and worldwide gross.
+    'df' (optional) is the merged data set or a part of it; by default it is loaded with 'dataprep.select'.
+    Returns a DataFrame with one row per genre with at least config['titles-per-genre-min'] such titles:
+        'genre_numtitles', 'genresum_production_budget', 'genresum_worldwide_gross', 'genresum_profit',
+        'genre_roi' -- pooled return on investment: sum of profits / sum of budgets
+        'roi_mean', 'roi_median', 'profit_margin_mean', 'profitable_share' (share of titles with profit > 0)
+    """
+    lstCols = ['tconst','genres','production_budget','worldwide_gross','profit','roi','profit_margin']
+    if df is None:
+        df = dataprep.select(config, lstCols, [dataprep.valid_flags_filter('production_budget','worldwide_gross'),
+                                                ('genres','notna')])
+    else:
+        df = df.loc[df['production_budget'].notna() & df['worldwide_gross'].notna() & df['genres'].notna(), lstCols]
+
+    dfGroupByGenre = df.groupby('genres').agg(genre_numtitles=('tconst','count'),
+                                              genresum_production_budget=('production_budget','sum'),
+                                              genresum_worldwide_gross=('worldwide_gross','sum'),
+                                              genresum_profit=('profit','sum'),
+                                              roi_mean=('roi','mean'),
+                                              roi_median=('roi','median'),
+                                              profit_margin_mean=('profit_margin','mean'))
+    dfGroupByGenre['profitable_share'] = (df['profit'] > 0).groupby(df['genres']).mean()
+    dfGroupByGenre['genre_roi'] = dfGroupByGenre['genresum_profit'].div(dfGroupByGenre['genresum_production_budget'])
+    dfGroupByGenre = dfGroupByGenre.loc[dfGroupByGenre['genre_numtitles']>=config['titles-per-genre-min']]
+    return dfGroupByGenre.reset_index()
+
+def list_topN_genres_by_roi(config, maxGenres=10):
+    """
+    Top genres by pooled and by median return on investment (see 'genre_roi_aggregates')
+    """
+    df = genre_roi_aggregates(config)
+    dctTopGenres = utils.select_topN_rows(df,['genre_roi','roi_median'],maxGenres,config)
+    lstGenres = dctTopGenres['genre_roi']['genres'].to_list()
+    lstGenres.extend(dctTopGenres['roi_median']['genres'].to_list())
+    return list(set(lstGenres))
+
+def genre_revenue_quantiles(config, strCol='worldwide_gross', lstQuantiles=None, yearRange=None, df=None):
+    """
+    Approximate quantiles of revenue column 'strCol' per genre (default quantiles 0.5, 0.9, 0.99), without
+    sorting the titles of every genre: from the group sketches written by "merge_clean_data" (see
+    'data_sketch.load_group_sketches'), else from sketches of the merged data set read in chunks of
+    config['files-merge']['out-of-core-chunk-rows'] rows, or of the titles in 'df' if given.
+    'yearRange' (first year, last year) restricts the release years.
+    Returns a DataFrame with columns 'genres', 'count', 'distinct_titles', 'min', 'max', 'q0.5', ...
+    (see 'data_sketch.group_sketch_quantiles'), in descending order of the first quantile.
+    """
+    if lstQuantiles is None:
+        lstQuantiles = [0.5, 0.9, 0.99]
+    dctSketches = data_sketch.load_group_sketches(config) if df is None else None
+    if dctSketches is not None and len(dctSketches) > 0 and strCol not in next(iter(dctSketches.values()))['quantiles']:
+        dctSketches = None
+    if dctSketches is None:
+        dctSketches = data_sketch.new_group_sketches()
+        iterFrames = [df] if df is not None else \
+            dataprep.load_merged_clean_data(config, chunkSize=config['files-merge']['out-of-core-chunk-rows'])
+        for dfChunk in iterFrames:
+            data_sketch.update_group_sketches(config, dctSketches, dfChunk, lstValueCols=[strCol])
+    dctSketches = data_sketch.rollup_group_sketches(dctSketches, 'genres', yearRange=yearRange)
+    df = data_sketch.group_sketch_quantiles(dctSketches, strCol, lstQuantiles, ['genres'])
+    df = df.loc[df['count'] > 0]
+    return df.sort_values(f'q{lstQuantiles[0]:g}', ascending=False).reset_index(drop=True)
+
+def genre_cooccurrence(config, useCache=True):
+    """
+    Genre x genre co-occurrence matrices of the merged data set: title counts, revenue-weighted (worldwide gross)
+    and vote-weighted (numvotes), see 'dataanalysis.genre_cooccurrence_matrices'.
+    With 'useCache' the matrices are read from, or computed once and written to, the file
+    config['files-merge']['genre-cooccurrence'] next to the merged data set (see 'dataprep.load_genre_cooccurrence').
+    """
+    dctMatrices = dataprep.load_genre_cooccurrence(config) if useCache else None
+    if dctMatrices is None:
+        df = dataprep.select(config, ['tconst','genres','worldwide_gross','numvotes'], [('genres','notna')])
+        dctMatrices = dataanalysis.genre_cooccurrence_matrices(df)
+        if useCache:
+            dataprep.write_genre_cooccurrence(config, dctMatrices)
+    return dctMatrices
+
+def list_topN_genre_pairs(config, strMeasure='titles', maxPairs=10):
+    """
+    Top genre pairs by co-occurrence 'strMeasure' ('titles', 'worldwide_gross', 'numvotes').
+    Returns a DataFrame with columns 'genre_a', 'genre_b', 'titles' (and 'strMeasure').
+    """
+    dctMatrices = genre_cooccurrence(config)
+    if strMeasure not in dctMatrices or strMeasure == 'genre_names':
+        raise KeyError(f'Co-occurrence measure "{strMeasure}" must be one of "titles", "worldwide_gross", "numvotes"')
+    return dataanalysis.genre_pairs_frame(dctMatrices, strMeasure).head(maxPairs)
+
+def genre_year_sums(config, strCol='worldwide_gross', yearRange=None):
+    """
+    Dense genre x year sums of column 'strCol' ('titles' counts titles) over the release years 'yearRange'
+    (default: config 'title-release-year-min' to 'title-release-year-max').
+    From the aggregate cube for 'titles' and the cube revenue columns, else from one groupby over
+    (genre, year) of the merged data set.
+    Returns (genre names, years, sums of shape (genres, years), counts of titles with a value of the same shape).
+    """
+    if yearRange is None:
+        yearRange = (config['title-release-year-min'], config['title-release-year-max'])
+    arrYears = np.arange(yearRange[0], yearRange[1] + 1)
+    cube = dataprep.load_aggregate_cube(config)
+    if cube is not None and (strCol == 'titles' or strCol in dataprep.lstCubeRevenueCols):
+        mskCells = (cube['year'] >= yearRange[0]) & (cube['year'] <= yearRange[1])
+        arrGenreNames = cube['genre_names'].astype(object)
+        arrGenreCodes = cube['genre'][mskCells]
+        arrYearCodes = cube['year'][mskCells].astype(np.int64) - yearRange[0]
+        arrSumValues = cube['titles' if strCol == 'titles' else f'{strCol}_sum'][mskCells]
+        arrCountValues = cube['titles' if strCol == 'titles' else f'{strCol}_count'][mskCells]
+    else:
+        lstCols = ['tconst','genres','year'] + ([] if strCol == 'titles' else [strCol])
+        df = dataprep.select(config, lstCols, [('genres','notna'), ('year','>=',yearRange[0]), ('year','<=',yearRange[1])])
+        if strCol == 'titles':
+            df = df.assign(titles=1.0)
+        dfGrouped = df.groupby(['genres','year'], sort=False)[strCol].agg(['sum','count']).reset_index()
+        arrGenreCodes, idxGenres = pd.factorize(dfGrouped['genres'], sort=True)
+        arrGenreNames = np.asarray(idxGenres, dtype=object)
+        arrYearCodes = dfGrouped['year'].to_numpy(dtype=np.int64) - yearRange[0]
+        arrSumValues = dfGrouped['sum'].to_numpy(dtype=np.float64)
+        arrCountValues = dfGrouped['count'].to_numpy(dtype=np.float64)
+    intNumCells = arrGenreNames.shape[0] * arrYears.shape[0]
+    arrCells = arrGenreCodes.astype(np.int64) * arrYears.shape[0] + arrYearCodes
+    arrSums = np.bincount(arrCells, weights=arrSumValues, minlength=intNumCells).reshape(-1, arrYears.shape[0])
+    arrCounts = np.bincount(arrCells, weights=arrCountValues, minlength=intNumCells).reshape(-1, arrYears.shape[0])
+    return arrGenreNames, arrYears, arrSums, arrCounts
+
+def genre_year_trends(config, strCol='worldwide_gross', lstWindows=None, yearRange=None):
+    """
+    Year trends of the genre sums of 'strCol' (see 'genre_year_sums' and 'dataanalysis.year_trend_arrays').
+    'lstWindows': rolling window lengths in years (default [3]).
+    Returns a DataFrame with one row per (genre, year): 'genres', 'year', '<col>' (sum), '<col>_count',
+    '<col>_cumsum', '<col>_yoy', and '<col>_rolling<w>', '<col>_rolling<w>_growth' for every window;
+    genres without titles in 'yearRange' are dropped.
+    """
+    if lstWindows is None:
+        lstWindows = [3]
+    arrGenreNames, arrYears, arrSums, arrCounts = genre_year_sums(config, strCol, yearRange)
+    mskGenres = arrCounts.sum(axis=1) > 0
+    arrGenreNames, arrSums, arrCounts = arrGenreNames[mskGenres], arrSums[mskGenres], arrCounts[mskGenres]
+    dctTrends = dataanalysis.year_trend_arrays(arrSums, lstWindows)
+    dctColumns = {'genres': np.repeat(arrGenreNames, arrYears.shape[0]), 'year': np.tile(arrYears, arrGenreNames.shape[0]),
+                  strCol: arrSums.ravel(), f'{strCol}_count': arrCounts.ravel().astype(np.int64)}
+    for (strTrend, arrTrend) in dctTrends.items():
+        dctColumns[f'{strCol}_{strTrend}'] = arrTrend.ravel()
+    return pd.DataFrame(dctColumns)
+
+def list_topN_growing_genres(config, maxGenres=10, intWindow=3, strCol='worldwide_gross', yearRange=None):
+    """
+    Top genres by growth of the sum of 'strCol' over the last 'intWindow' years of 'yearRange' against the
+    'intWindow' years before, for genres with at least config['charts']['min-titles-per-genre'] titles with a
+    value in each of the two windows. Returns a DataFrame with columns 'genres', '<col>_rolling<w>' (last window),
+    '<col>_rolling<w>_growth', '<col>_count_rolling<w>' (titles in the last window).
+    """
+    arrGenreNames, arrYears, arrSums, arrCounts = genre_year_sums(config, strCol, yearRange)
+    dctTrends = dataanalysis.year_trend_arrays(arrSums, [intWindow])
+    dctCountTrends = dataanalysis.year_trend_arrays(arrCounts, [intWindow])
+    arrLastCounts = dctCountTrends[f'rolling{intWindow}'][:, -1]
+    arrPreviousCounts = dctCountTrends[f'rolling{intWindow}'][:, -1-intWindow] if arrYears.shape[0] > intWindow \
+                        else np.full(arrGenreNames.shape[0], np.nan)
+    df = pd.DataFrame({'genres': arrGenreNames,
+                       f'{strCol}_rolling{intWindow}': dctTrends[f'rolling{intWindow}'][:, -1],
+                       f'{strCol}_rolling{intWindow}_growth': dctTrends[f'rolling{intWindow}_growth'][:, -1],
+                       f'{strCol}_count_rolling{intWindow}': arrLastCounts})
+    intMinTitles = config['charts']['min-titles-per-genre']
+    df = df.loc[(arrLastCounts >= intMinTitles) & (arrPreviousCounts >= intMinTitles) &
+                df[f'{strCol}_rolling{intWindow}_growth'].notna()]
+    return df.sort_values(f'{strCol}_rolling{intWindow}_growth', ascending=False).head(maxGenres).reset_index(drop=True)
@@ -2,7 +2,9 @@ import os
 import sys
 import json
 import gzip
+import hashlib
 import shutil
+import numpy as np
 
 def convert_user_config_to_json(strUserConfigFile):
     """
@@ -88,7 +90,42 @@ def check_file_exists(strFolder, strFile):
         dctReturnValue['file'] = strLoc
     
     return dctReturnValue
-    
+
+### SHA-256 of files by location: (size, mtime_ns, digest) of the last version hashed (see 'file_fingerprint')
+dctFileDigestCache = dict()
+
+def file_fingerprint(strFilePath):
+    """
+    Fingerprint of the content of file 'strFilePath': {'bytes': size, 'mtime_ns': modification time,
+    'sha256': hex digest}. Derived files (aggregates, sketches, column stores, partitions) record the
+    fingerprint of their source to detect a re-written source. The digest of an unchanged file
+    (same size and mtime) is computed once per process.
+    """
+    statFile = os.stat(strFilePath)
+    tplVersion = (statFile.st_size, statFile.st_mtime_ns)
+    tplCached = dctFileDigestCache.get(strFilePath)
+    if tplCached is None or tplCached[:2] != tplVersion:
+        hashFile = hashlib.sha256()
+        with open(strFilePath, mode='rb') as fileData:
+            for bytesBlock in iter(lambda: fileData.read(1 << 20), b''):
+                hashFile.update(bytesBlock)
+        tplCached = tplVersion + (hashFile.hexdigest(),)
+        dctFileDigestCache[strFilePath] = tplCached
+    return {'bytes': int(tplCached[0]), 'mtime_ns': int(tplCached[1]), 'sha256': tplCached[2]}
+
+def file_fingerprint_matches(dctFingerprint, strFilePath):
+    """
+    True if file 'strFilePath' has the content recorded in 'dctFingerprint' (see 'file_fingerprint'):
+    same size and modification time, or, for a file re-written with the same size, the same SHA-256
+    """
+    if dctFingerprint is None or not os.path.exists(strFilePath):
+        return False
+    statFile = os.stat(strFilePath)
+    if statFile.st_size != dctFingerprint['bytes']:
+        return False
+    if statFile.st_mtime_ns == dctFingerprint['mtime_ns']:
+        return True
+    return file_fingerprint(strFilePath)['sha256'] == dctFingerprint['sha256']
 
 def unzip_gz_file(strFileNameZip, strFileNameTxt, strFolderFrom, strFolderTo):
     """
@@ -136,4 +173,44 @@ def generate_zipfilename_list_from_config(config):
         elif type(config[key]['zip']) == str:
                 lstReturnValue.append((config[key]['zip']))
     
-    return lstReturnValue
\ No newline at end of file
+    return lstReturnValue
+
+def select_topN_rows(df, lstRankColNames, maxN, config, strTieBreakColName='genres'):
+    """
+    Select the top 'maxN' rows of 'df' for each ranking column of 'lstRankColNames' (largest values first).
+    Rows are chosen by partial selection (np.argpartition) instead of a full sort; only the selected rows
+    are sorted. Ties are broken by 'strTieBreakColName' in ascending order, so the result is deterministic.
+    NaN values rank last.
+
+    Arguments:
+        'df': DataFrame with the ranking columns and the tie-break column (e.g. one row per genre)
+        'lstRankColNames': list of ranking columns; all are ranked in one call over the same frame
+        'maxN': number of rows to keep; from 0 to config['charts']['bar-number-upperbound']
+        'config': project config
+    Returns a dictionary {ranking column: DataFrame with the top rows in rank order}
+    """
+    if maxN < 0:
+        raise ValueError(f'Argument "maxN" {maxN} must not be negative')
+    if maxN > config['charts']['bar-number-upperbound']:
+        raise ValueError(f'Argument "maxN" {maxN} exceeds upper bound value of {config["charts"]["bar-number-upperbound"]}')
+
+    dctReturnValue = dict()
+    intNumRows = df.shape[0]
+    intN = min(maxN, intNumRows)
+    arrTieBreak = df[strTieBreakColName].to_numpy()
+    for strRankColName in lstRankColNames:
+        arrValues = df[strRankColName].to_numpy(dtype=np.float64)
+        arrValues = np.where(np.isnan(arrValues), -np.inf, arrValues)
+        if intN == 0:
+            arrTop = np.arange(0)
+        elif intN < intNumRows:
+            ### threshold value of the N-th largest row; keep every row tied with it before tie-breaking
+            fltThreshold = arrValues[np.argpartition(-arrValues, intN - 1)[intN - 1]]
+            arrTop = np.flatnonzero(arrValues >= fltThreshold)
+        else:
+            arrTop = np.arange(intNumRows)
+        ### tie-break keys are compared for the candidate rows only
+        arrOrder = np.lexsort((arrTieBreak[arrTop], -arrValues[arrTop]))[:intN]
+        dctReturnValue[strRankColName] = df.iloc[arrTop[arrOrder]]
+
+    return dctReturnValue